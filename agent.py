@@ -1,15 +1,67 @@
 #!/usr/bin/env python3
+import asyncio
 import socket
 import json
+import struct
 import subprocess
 import os
+import re
 import base64
+import hashlib
+import hmac
+import shlex
+import shutil
+import tempfile
 import threading
+import time
+import atexit
+from collections import OrderedDict, deque
 from datetime import datetime
 
+# Optional: faster JSON encoding straight to bytes (pip install orjson)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Optional: SIMD base64 for image payloads (pip install pybase64). Same API as the stdlib module.
+try:
+    import pybase64 as _b64
+except ImportError:
+    _b64 = base64
+
+# Chrome automation over CDP (pip install websocket-client). Everything else works without it.
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+# Optional: async image downloads (pip install aiohttp). Without it, downloads run
+# on worker threads through urllib.
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Optional: in-process screen capture via pyobjc (pip install pyobjc-framework-Quartz)
+try:
+    import Quartz
+except ImportError:
+    Quartz = None
+
 PORT = 9999
 SECRET = os.environ.get('MAC_AGENT_SECRET', '0eea2cc233ae59295e0ac411d45b1eb5a886d71c0376d2abfe481f0ade12f334')
 SCREENSHOT_DIR = os.path.expanduser('~/Desktop')
+MAX_REQUEST_SIZE = 16 * 1024 * 1024
+# Absolute paths + close_fds=False let subprocess use posix_spawn instead of
+# fork/exec. Our fds are non-inheritable (PEP 446), so nothing leaks to children.
+OSASCRIPT = '/usr/bin/osascript'
+SCREENCAPTURE = '/usr/sbin/screencapture'
+IMAGE_FETCH_CONCURRENCY = 4
+WINDOW_BOUNDS_TTL = 0.25  # seconds
+WINDOW_LIST_TTL = 1.0  # seconds
+# Dump raw page/CDP state from the browser flows (MAC_AGENT_DEBUG=1)
+DEBUG = os.environ.get('MAC_AGENT_DEBUG') == '1'
 
 # Global interrupt flag - can be set by /stop command from Telegram
 INTERRUPT_FLAG = threading.Event()
@@ -17,6 +69,23 @@ INTERRUPT_FLAG = threading.Event()
 def log(msg):
     print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}")
 
+def debug(fmt, *args):
+    """log() for bulky diagnostics; fmt % args is only built when DEBUG is on"""
+    if DEBUG:
+        log(fmt % args if args else fmt)
+
+def _json_loads(data):
+    """Parse JSON from str or bytes, using orjson when installed."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _json_dumps(obj):
+    """Serialize to UTF-8 JSON bytes, using orjson when installed."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False).encode('utf-8')
+
 def check_interrupt():
     """Check if operation should be interrupted. Returns True if interrupted."""
     if INTERRUPT_FLAG.is_set():
@@ -39,43 +108,215 @@ def interruptible_sleep(seconds):
         time.sleep(min(0.5, end_time - time.time()))
     return False
 
-def execute_command(command):
+async def _communicate(proc, timeout):
+    """Wait for a subprocess to finish, killing it on timeout. Returns (returncode, stdout, stderr)."""
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise TimeoutError(f'Command timed out after {timeout} seconds')
+    return proc.returncode, (out or b'').decode('utf-8', errors='replace'), (err or b'').decode('utf-8', errors='replace')
+
+async def run_process(*argv, timeout=30):
+    """Run argv without blocking the event loop. Returns (returncode, stdout, stderr)."""
+    proc = await asyncio.create_subprocess_exec(*argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, close_fds=False)
+    return await _communicate(proc, timeout)
+
+# Long-lived osascript worker: reads {"script": ...} JSON lines on stdin, runs each
+# through OSAScript and writes {"ok", "out"|"error"} JSON lines back. Saves the
+# fork+exec+OSA init cost of a fresh osascript per call.
+_OSASCRIPT_WORKER_JS = r'''
+ObjC.import('Foundation');
+ObjC.import('OSAKit');
+var stdin = $.NSFileHandle.fileHandleWithStandardInput;
+var stdout = $.NSFileHandle.fileHandleWithStandardOutput;
+function reply(obj) {
+    stdout.writeData($(JSON.stringify(obj) + '\n').dataUsingEncoding($.NSUTF8StringEncoding));
+}
+// null when d has no plain text form (records, missing value, object references)
+function fmt(d) {
+    var t = d.descriptorType;
+    if (t === 0x6E756C6C) return '';  // 'null' - the script returned nothing
+    if (t === 0x6C697374) {  // 'list' - match osascript's "a, b, c" output
+        var parts = [];
+        for (var i = 1; i <= d.numberOfItems; i++) {
+            var p = fmt(d.descriptorAtIndex(i));
+            if (p === null) return null;
+            parts.push(p);
+        }
+        return parts.join(', ');
+    }
+    if (t === 0x74727565 || t === 0x66616C73 || t === 0x626F6F6C) return d.booleanValue ? 'true' : 'false';
+    var s = d.stringValue;
+    return s.isNil() ? null : s.js;
+}
+var buf = '';
+while (true) {
+    var data = stdin.availableData;
+    if (data.length === 0) break;
+    buf += $.NSString.alloc.initWithDataEncoding(data, $.NSUTF8StringEncoding).js;
+    var nl;
+    while ((nl = buf.indexOf('\n')) >= 0) {
+        var line = buf.slice(0, nl);
+        buf = buf.slice(nl + 1);
+        try {
+            var err = Ref(), shown = Ref();
+            var result = $.OSAScript.alloc.initWithSource(JSON.parse(line).script).executeAndReturnDisplayValueError(shown, err);
+            if (result.isNil()) {
+                var info = ObjC.deepUnwrap(err[0]) || {};
+                reply({ok: false, error: String(info.OSAScriptErrorMessageKey || info.OSAScriptErrorMessage
+                                                || info.NSAppleScriptErrorMessage || 'AppleScript error')});
+            } else {
+                // Anything fmt can't render gets the display value osascript/Script Editor show
+                var out = fmt(result);
+                if (out === null) out = shown[0] && !shown[0].isNil() ? shown[0].string.js : '';
+                reply({ok: true, out: out});
+            }
+        } catch (e) {
+            reply({ok: false, error: String(e)});
+        }
+    }
+}
+'''
+
+_osascript_proc = None
+_osascript_lock = None
+
+async def _osascript_worker():
+    global _osascript_proc
+    if _osascript_proc is None or _osascript_proc.returncode is not None:
+        _osascript_proc = await asyncio.create_subprocess_exec(
+            OSASCRIPT, '-l', 'JavaScript', '-e', _OSASCRIPT_WORKER_JS,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL, close_fds=False, limit=16 * 1024 * 1024)
+    return _osascript_proc
+
+async def run_osascript(script, timeout=30):
+    """Run AppleScript on the persistent osascript worker. Returns (returncode, stdout, stderr).
+    Falls back to a one-shot osascript if the worker is unavailable, or busy with another
+    call - a slow script never holds up the rest, and waiting never eats into timeout."""
+    global _osascript_proc, _osascript_lock
+    if _osascript_lock is None:
+        _osascript_lock = asyncio.Lock()
+    if _osascript_lock.locked():
+        return await run_process(OSASCRIPT, '-e', script, timeout=timeout)
+    async with _osascript_lock:
+        try:
+            proc = await _osascript_worker()
+            # stdlib json keeps this ASCII-only so no UTF-8 sequence is split across the worker's reads
+            proc.stdin.write((json.dumps({'script': script}) + '\n').encode('utf-8'))
+            await proc.stdin.drain()
+            line = await asyncio.wait_for(proc.stdout.readline(), timeout)
+        except asyncio.TimeoutError:
+            # A hung script blocks the worker - kill it so the next call gets a fresh one
+            _osascript_proc.kill()
+            await _osascript_proc.wait()
+            _osascript_proc = None
+            raise TimeoutError(f'Command timed out after {timeout} seconds')
+        except Exception as e:
+            log(f"osascript worker unavailable: {e}")
+            line = b''
+        if line:
+            reply = _json_loads(line)
+            if reply.get('ok'):
+                return 0, reply.get('out', ''), ''
+            return 1, '', reply.get('error', '')
+        _osascript_proc = None
+    return await run_process(OSASCRIPT, '-e', script, timeout=timeout)
+
+# Anything here needs /bin/sh (pipes, redirects, globs, variables, chaining)
+_SHELL_METACHARS = set('|&;<>()$`\\"\'*?[]{}~#\n')
+
+async def execute_command(command):
+    """Run a command. Lists and plain strings are exec'd directly; strings that use
+    shell syntax still go through /bin/sh."""
+    _invalidate_window_caches()
     try:
-        result = subprocess.run(command, shell=True, capture_output=True, text=True, timeout=30)
-        return {'success': True, 'stdout': result.stdout[:5000], 'stderr': result.stderr[:1000], 'returncode': result.returncode}
+        if isinstance(command, list):
+            argv = [str(a) for a in command]
+        elif _SHELL_METACHARS.isdisjoint(command):
+            argv = shlex.split(command)
+        else:
+            argv = None
+        proc = None
+        if argv:
+            try:
+                proc = await asyncio.create_subprocess_exec(shutil.which(argv[0]) or argv[0], *argv[1:], stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, close_fds=False)
+            except OSError:
+                # Shell builtins (cd, export, ...), unknown commands and files exec refuses
+                # (no execute bit, a directory, a script without #!) keep the shell's behaviour
+                if isinstance(command, list):
+                    command = shlex.join(argv)
+        if proc is None:
+            proc = await asyncio.create_subprocess_shell(command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, close_fds=False)
+        returncode, stdout, stderr = await _communicate(proc, 30)
+        return {'success': True, 'stdout': stdout[:5000], 'stderr': stderr[:1000], 'returncode': returncode}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
-def execute_applescript(script):
+async def execute_applescript(script):
+    _invalidate_window_caches()
     try:
-        result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=30)
-        return {'success': result.returncode == 0, 'stdout': result.stdout.strip()[:5000], 'stderr': result.stderr[:1000]}
+        returncode, stdout, stderr = await run_osascript(script, timeout=30)
+        return {'success': returncode == 0, 'stdout': stdout.strip()[:5000], 'stderr': stderr[:1000]}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
+READ_FILE_LIMIT = 50000
+# One reusable read buffer per worker thread (read_file runs via asyncio.to_thread)
+_read_buffers = threading.local()
+
 def read_file(filepath):
     try:
         filepath = os.path.expanduser(filepath)
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            return {'success': True, 'content': f.read(50000)}
+        buf = getattr(_read_buffers, 'buf', None)
+        if buf is None:
+            buf = _read_buffers.buf = bytearray(READ_FILE_LIMIT)
+        with open(filepath, 'rb', buffering=0) as f:
+            n = f.readinto(buf)
+        return {'success': True, 'content': str(memoryview(buf)[:n], 'utf-8', 'ignore')}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
+class FileBlob:
+    """A response blob streamed straight from disk with sendfile instead of read into memory."""
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def read(self):
+        """The file's bytes, read with readinto into one buffer sized up front"""
+        buf = bytearray(self.size)
+        view = memoryview(buf)
+        n = 0
+        with open(self.path, 'rb', buffering=0) as f:
+            while n < self.size:
+                got = f.readinto(view[n:])
+                if not got:
+                    break
+                n += got
+        return view[:n]
+
 def read_image(filepath):
     try:
         filepath = os.path.expanduser(filepath)
-        if os.path.getsize(filepath) > 5*1024*1024:
+        size = os.path.getsize(filepath)
+        if size > 5*1024*1024:
             return {'success': False, 'error': 'File too large'}
-        with open(filepath, 'rb') as f:
-            return {'success': True, 'image_data': base64.b64encode(f.read()).decode('utf-8')}
+        if not os.access(filepath, os.R_OK):
+            return {'success': False, 'error': f'Permission denied: {filepath}'}
+        # Sent as a raw blob by write_response - the bytes never enter Python
+        return {'success': True, 'image_data': FileBlob(filepath, size)}
     except Exception as e:
         return {'success': False, 'error': str(e)}
 
-def get_spotify_current_track():
+async def get_spotify_current_track():
     """Get currently playing track from Spotify desktop app via AppleScript."""
     try:
-        import time
-
         # Check if Spotify is running, if not launch it
         check_script = '''
         tell application "System Events"
@@ -83,14 +324,14 @@ def get_spotify_current_track():
         end tell
         return isRunning
         '''
-        result = subprocess.run(['osascript', '-e', check_script], capture_output=True, text=True, timeout=10)
-        is_running = result.stdout.strip() == 'true'
+        returncode, stdout, stderr = await run_osascript(check_script, timeout=10)
+        is_running = stdout.strip() == 'true'
 
         if not is_running:
             log("🎵 Launching Spotify app...")
             launch_script = 'tell application "Spotify" to activate'
-            subprocess.run(['osascript', '-e', launch_script], capture_output=True, text=True, timeout=10)
-            time.sleep(3)  # Wait for Spotify to launch
+            await run_osascript(launch_script, timeout=10)
+            await asyncio.sleep(3)  # Wait for Spotify to launch
 
         # Get current track info from Spotify app
         track_script = '''
@@ -110,12 +351,12 @@ def get_spotify_current_track():
         end tell
         '''
 
-        result = subprocess.run(['osascript', '-e', track_script], capture_output=True, text=True, timeout=10)
+        returncode, stdout, stderr = await run_osascript(track_script, timeout=10)
 
-        if result.returncode != 0:
-            return {'success': False, 'error': f'Could not get track info: {result.stderr}'}
+        if returncode != 0:
+            return {'success': False, 'error': f'Could not get track info: {stderr}'}
 
-        output = result.stdout.strip()
+        output = stdout.strip()
 
         if output == "STOPPED":
             return {'success': False, 'error': 'No track playing. Play a song in Spotify first!'}
@@ -143,7 +384,7 @@ def get_spotify_current_track():
         }
 
         # Fetch Last.fm data for tags and wiki info
-        lastfm_data = get_lastfm_track_info(track_name, artist, album)
+        lastfm_data = await asyncio.to_thread(get_lastfm_track_info, track_name, artist, album)
 
         return {
             'success': True,
@@ -318,7 +559,7 @@ def get_lastfm_track_info(track_name, artist, album):
         log(f"⚠️ Last.fm fetch error: {str(e)}")
         return {'tags': [], 'track_wiki': None, 'album_wiki': None, 'artist_wiki': None}
 
-def create_apple_note(title, body):
+async def create_apple_note(title, body):
     """Create a new note in Apple Notes app using AppleScript."""
     try:
         # Escape special characters for AppleScript string
@@ -333,18 +574,31 @@ tell application "Notes"
     return id of newNote
 end tell
 '''
-        result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=30)
-        if result.returncode == 0:
+        returncode, stdout, stderr = await run_osascript(script, timeout=30)
+        if returncode == 0:
             log(f"✅ Created Apple Note: {title}")
-            return {'success': True, 'title': title, 'note_id': result.stdout.strip()}
+            return {'success': True, 'title': title, 'note_id': stdout.strip()}
         else:
-            log(f"❌ Failed to create note: {result.stderr}")
-            return {'success': False, 'error': result.stderr}
+            log(f"❌ Failed to create note: {stderr}")
+            return {'success': False, 'error': stderr}
     except Exception as e:
         log(f"❌ Exception creating note: {str(e)}")
         return {'success': False, 'error': str(e)}
 
-def get_window_bounds(app_name):
+# app_name -> (monotonic timestamp, bounds) so burst window screenshots skip osascript
+_bounds_cache = {}
+# [monotonic timestamp, list_windows result], same idea for repeated window listings
+_window_list_cache = [0.0, None]
+
+def _invalidate_window_caches():
+    """Forget cached bounds and window lists after something that can move or open windows"""
+    _bounds_cache.clear()
+    _window_list_cache[1] = None
+
+async def get_window_bounds(app_name):
+    cached = _bounds_cache.get(app_name)
+    if cached and time.monotonic() - cached[0] < WINDOW_BOUNDS_TTL:
+        return cached[1]
     script = f'''
 tell application "System Events"
     tell process "{app_name}"
@@ -356,38 +610,92 @@ tell application "System Events"
     end tell
 end tell
 '''
-    result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=10)
-    if result.returncode == 0:
+    try:
+        returncode, stdout, stderr = await run_osascript(script, timeout=10)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+    if returncode == 0:
         try:
-            x, y, w, h = result.stdout.strip().split(',')
-            return {'success': True, 'x': int(x), 'y': int(y), 'width': int(w), 'height': int(h)}
+            x, y, w, h = stdout.strip().split(',')
+            bounds = {'success': True, 'x': int(x), 'y': int(y), 'width': int(w), 'height': int(h)}
+            _bounds_cache[app_name] = (time.monotonic(), bounds)
+            return bounds
         except:
             return {'success': False, 'error': 'Could not parse window bounds'}
-    return {'success': False, 'error': result.stderr}
+    return {'success': False, 'error': stderr}
+
+# [epoch second, formatted timestamp, sequence within that second]
+_screenshot_name_state = [None, '', 0]
+
+def _next_screenshot_name():
+    """Unique screenshot filename; the timestamp is formatted once per second and a
+    sequence number keeps captures within the same second from overwriting each other."""
+    now = int(time.time())
+    if now != _screenshot_name_state[0]:
+        _screenshot_name_state[:] = [now, datetime.fromtimestamp(now).strftime('%Y%m%d_%H%M%S'), 0]
+    _screenshot_name_state[2] += 1
+    return f"screenshot_{_screenshot_name_state[1]}_{_screenshot_name_state[2]}.png"
+
+def _cg_screenshot(rect=None):
+    """Capture the screen (or an x,y,w,h rect) in-process via Quartz. Returns PNG bytes, or None."""
+    if Quartz is None:
+        return None
+    bounds = Quartz.CGRectInfinite if rect is None else Quartz.CGRectMake(*rect)
+    image = Quartz.CGWindowListCreateImage(bounds, Quartz.kCGWindowListOptionOnScreenOnly, Quartz.kCGNullWindowID, Quartz.kCGWindowImageDefault)
+    if image is None:
+        return None
+    data = Quartz.CFDataCreateMutable(None, 0)
+    dest = Quartz.CGImageDestinationCreateWithData(data, 'public.png', 1, None)
+    Quartz.CGImageDestinationAddImage(dest, image, None)
+    if not Quartz.CGImageDestinationFinalize(dest):
+        return None
+    return bytes(data)
 
-def take_screenshot(mode='full', app_name=None, region=None):
+async def take_screenshot(mode='full', app_name=None, region=None, inline=False):
+    """Capture the screen to SCREENSHOT_DIR. With inline=True the PNG bytes are returned
+    in image_data instead and nothing is left on disk."""
     try:
-        filename = 'screenshot_' + datetime.now().strftime('%Y%m%d_%H%M%S') + '.png'
+        filename = _next_screenshot_name()
         filepath = os.path.join(SCREENSHOT_DIR, filename)
 
+        rect = None
         if mode == 'window' and app_name:
-            bounds = get_window_bounds(app_name)
+            bounds = await get_window_bounds(app_name)
             if not bounds.get('success'):
                 return bounds
             log(f"Window screenshot for '{app_name}': x={bounds['x']}, y={bounds['y']}, w={bounds['width']}, h={bounds['height']}")
-            cmd = ['screencapture', '-x', '-R', f"{bounds['x']},{bounds['y']},{bounds['width']},{bounds['height']}", filepath]
-            subprocess.run(cmd, timeout=10)
+            rect = (bounds['x'], bounds['y'], bounds['width'], bounds['height'])
         elif mode == 'region' and region:
             x = int(region.get('x', 0))
             y = int(region.get('y', 0))
             width = int(region.get('width', 800))
             height = int(region.get('height', 600))
             log(f"Region screenshot: x={x}, y={y}, w={width}, h={height}")
-            cmd = ['screencapture', '-x', '-R', f"{x},{y},{width},{height}", filepath]
-            subprocess.run(cmd, timeout=10)
+            rect = (x, y, width, height)
         else:
             log("Full screen screenshot")
-            subprocess.run(['screencapture', '-x', filepath], timeout=10)
+
+        png = await asyncio.to_thread(_cg_screenshot, rect) if Quartz is not None else None
+        if png is not None:
+            if inline:
+                return {'success': True, 'image_data': png, 'mode': mode}
+            with open(filepath, 'wb') as f:
+                f.write(png)
+        else:
+            if inline:
+                # screencapture can only write to a file (it has no stdout output) - use a
+                # temp one and drop it after reading
+                filepath = os.path.join(tempfile.gettempdir(), f'agent_{os.getpid()}_{filename}')
+            cmd = [SCREENCAPTURE, '-x', '-t', 'png']
+            if rect:
+                cmd += ['-R', ','.join(str(v) for v in rect)]
+            await run_process(*cmd, filepath, timeout=10)
+            if inline and os.path.exists(filepath):
+                try:
+                    png = FileBlob(filepath, os.path.getsize(filepath)).read()
+                    return {'success': True, 'image_data': png, 'mode': mode}
+                finally:
+                    os.unlink(filepath)
 
         if os.path.exists(filepath):
             log(f"Screenshot saved: {filepath}")
@@ -397,7 +705,9 @@ def take_screenshot(mode='full', app_name=None, region=None):
         log(f"Screenshot error: {e}")
         return {'success': False, 'error': str(e)}
 
-def list_windows():
+async def list_windows():
+    if _window_list_cache[1] and time.monotonic() - _window_list_cache[0] < WINDOW_LIST_TTL:
+        return _window_list_cache[1]
     script = '''
 tell application "System Events"
     set windowList to {}
@@ -413,13 +723,19 @@ tell application "System Events"
     return windowList
 end tell
 '''
-    result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=10)
-    if result.returncode == 0:
-        windows = [w.strip() for w in result.stdout.strip().split(',') if w.strip()]
-        return {'success': True, 'windows': windows}
+    try:
+        returncode, stdout, stderr = await run_osascript(script, timeout=10)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+    if returncode == 0:
+        windows = [w.strip() for w in stdout.strip().split(',') if w.strip()]
+        result = {'success': True, 'windows': windows}
+        _window_list_cache[:] = [time.monotonic(), result]
+        return result
     return {'success': False, 'error': 'Could not list windows'}
 
-def scroll_page(app_name='Google Chrome', direction='down', amount=3):
+async def scroll_page(app_name='Google Chrome', direction='down', amount=3):
+    _invalidate_window_caches()
     script = f'''
 tell application "{app_name}"
     activate
@@ -432,76 +748,166 @@ tell application "System Events"
         script += f'repeat {amount} times\n        key code 126\n        delay 0.1\n    end repeat'
     script += '\nend tell'
 
-    result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=15)
-    if result.returncode == 0:
+    try:
+        returncode, stdout, stderr = await run_osascript(script, timeout=15)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+    if returncode == 0:
         return {'success': True, 'message': f'Scrolled {direction} {amount} times'}
-    return {'success': False, 'error': result.stderr}
+    return {'success': False, 'error': stderr}
 
-def execute_js_in_chrome(js_code):
-    escaped_js = js_code.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
-    script = f'''
+def _escape_applescript(text):
+    """Escape text for use inside an AppleScript string literal."""
+    return text.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
+
+_CHROME_JS_SCRIPT = '''
 tell application "Google Chrome"
     tell active tab of front window
-        execute javascript "{escaped_js}"
+        return execute javascript "%s"
     end tell
 end tell
 '''
-    result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=10)
-    if result.returncode == 0:
-        return {'success': True, 'result': result.stdout.strip()}
-    return {'success': False, 'error': result.stderr}
 
-def capture_webpage_images(count=5, min_width=150, min_height=150):
-    import urllib.request
+# Image scan used by capture_webpage_images and list_page_images. Escaped for
+# AppleScript once at import; per call only the %(...)d knobs are filled in.
+_IMAGE_SCAN_JS = '''
+(function() {
+    var r = [];
+    var imgs = document.querySelectorAll('img');
+    for (var i = 0; i < imgs.length && r.length < %(limit)d; i++) {
+        var img = imgs[i];
+        if (img.naturalWidth < %(min_width)d || img.naturalHeight < %(min_height)d) continue;
+        var rect = img.getBoundingClientRect();
+        if (rect.width < 80 || rect.height < 80) continue;
+        var src = img.src;
+        if (img.srcset) {
+            var parts = img.srcset.split(',');
+            var last = parts[parts.length - 1].trim().split(' ')[0];
+            if (last) src = last;
+        }
+        if (!src || src.indexOf('data:') === 0) continue;
+        var link = img.closest('a');
+        r.push({i: r.length, s: src, u: link ? link.href : '', a: img.alt || '', w: img.naturalWidth, h: img.naturalHeight});
+    }
+    return JSON.stringify({title: document.title, url: location.href, imgs: r});
+})();
+'''
+_IMAGE_SCAN_SCRIPT = _CHROME_JS_SCRIPT.replace('%s', _escape_applescript(_IMAGE_SCAN_JS))
 
-    # Simplified and faster JS
-    js_code = f'''
-    (function() {{
-        var r = [];
-        var imgs = document.querySelectorAll('img');
-        for (var i = 0; i < imgs.length && r.length < {count}; i++) {{
-            var img = imgs[i];
-            if (img.naturalWidth < {min_width} || img.naturalHeight < {min_height}) continue;
-            var rect = img.getBoundingClientRect();
-            if (rect.width < 80 || rect.height < 80) continue;
-            var src = img.src;
-            if (img.srcset) {{
-                var parts = img.srcset.split(',');
-                var last = parts[parts.length - 1].trim().split(' ')[0];
-                if (last) src = last;
-            }}
-            if (!src || src.indexOf('data:') === 0) continue;
-            var link = img.closest('a');
-            r.push({{s: src, u: link ? link.href : '', a: img.alt || '', w: img.naturalWidth, h: img.naturalHeight}});
-        }}
-        return JSON.stringify(r);
-    }})();
-    '''
+async def execute_js_in_chrome(js_code):
+    _invalidate_window_caches()
+    script = _CHROME_JS_SCRIPT % _escape_applescript(js_code)
+    try:
+        returncode, stdout, stderr = await run_osascript(script, timeout=10)
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+    if returncode == 0:
+        return {'success': True, 'result': stdout.strip()}
+    return {'success': False, 'error': stderr}
+
+# src URL -> (ETag, bytes), least recently used first. Repeat images are revalidated
+# with If-None-Match and served from here on a 304. Bounded by entry count and by
+# total size; a single body over IMAGE_CACHE_MAX_ENTRY is never kept.
+_image_cache = OrderedDict()
+_image_cache_bytes = 0
+IMAGE_CACHE_SIZE = 128
+IMAGE_CACHE_MAX_BYTES = 32 * 1024 * 1024
+IMAGE_CACHE_MAX_ENTRY = 4 * 1024 * 1024
+
+def _cache_image(src, etag, data):
+    global _image_cache_bytes
+    if not etag or len(data) > IMAGE_CACHE_MAX_ENTRY:
+        return
+    old = _image_cache.pop(src, None)
+    if old is not None:
+        _image_cache_bytes -= len(old[1])
+    _image_cache[src] = (etag, data)
+    _image_cache_bytes += len(data)
+    while len(_image_cache) > IMAGE_CACHE_SIZE or _image_cache_bytes > IMAGE_CACHE_MAX_BYTES:
+        _, (_, evicted) = _image_cache.popitem(last=False)
+        _image_cache_bytes -= len(evicted)
+
+_IMAGE_FETCH_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
+}
+
+IMAGE_KEEPALIVE = 60.0  # seconds; list_page_images and the follow-up download are a user turn apart
+_image_http = None
+
+def _image_session():
+    """Shared aiohttp session for _fetch_image, created on first use. Pooled keep-alive
+    connections (and their TLS sessions) carry over between requests to the same CDN.
+    Returns None when aiohttp is not installed."""
+    global _image_http
+    if aiohttp is None:
+        return None
+    if _image_http is None or _image_http.closed:
+        _image_http = aiohttp.ClientSession(
+            headers=_IMAGE_FETCH_HEADERS,
+            connector=aiohttp.TCPConnector(keepalive_timeout=IMAGE_KEEPALIVE))
+    return _image_http
+
+async def _close_image_session():
+    if _image_http is not None and not _image_http.closed:
+        await _image_http.close()
+
+def _fetch_image_blocking(src, cached):
+    """urllib version of the GET in _fetch_image. Returns (status, etag, bytes)."""
+    headers = dict(_IMAGE_FETCH_HEADERS)
+    if cached:
+        headers['If-None-Match'] = cached[0]
+    req = urllib.request.Request(src, headers=headers)
+    try:
+        with urllib.request.urlopen(req, timeout=10) as response:
+            return response.status, response.headers.get('ETag'), response.read()
+    except urllib.error.HTTPError as e:
+        # urllib raises on 304; the cached copy is still good
+        if e.code == 304 and cached:
+            return 304, None, b''
+        raise
+
+async def _fetch_image(session, limit, src):
+    """GET an image (at most `limit` at a time), revalidating against _image_cache.
+    Without an aiohttp session the GET runs on a worker thread. Returns the bytes,
+    or None if the fetch failed."""
+    try:
+        cached = _image_cache.get(src)
+        async with limit:
+            if session is None:
+                status, etag, image_data = await asyncio.to_thread(_fetch_image_blocking, src, cached)
+            else:
+                headers = {'If-None-Match': cached[0]} if cached else None
+                async with session.get(src, headers=headers, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                    response.raise_for_status()
+                    status, etag = response.status, response.headers.get('ETag')
+                    image_data = await response.read()
+        if status == 304 and cached:
+            # Re-inserted: a concurrent fetch may have evicted it while we waited
+            _cache_image(src, *cached)
+            return cached[1]
+        _cache_image(src, etag, image_data)
+        return image_data
+    except Exception as e:
+        log(f"    Failed: {e}")
+        return None
 
-    escaped_js = js_code.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
-    script = f'''
-tell application "Google Chrome"
-    set currentURL to URL of active tab of front window
-    set pageTitle to title of active tab of front window
-    tell active tab of front window
-        set jsResult to execute javascript "{escaped_js}"
-    end tell
-    return pageTitle & "|||" & currentURL & "|||" & jsResult
-end tell
-'''
+async def capture_webpage_images(count=5, min_width=150, min_height=150):
+    script = _IMAGE_SCAN_SCRIPT % {'limit': int(count), 'min_width': int(min_width), 'min_height': int(min_height)}
 
     log("Finding images on page...")
-    result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=30)
+    try:
+        returncode, stdout, stderr = await run_osascript(script, timeout=30)
+    except Exception as e:
+        return {'success': False, 'error': f'JS failed: {e}'}
 
-    if result.returncode != 0:
-        return {'success': False, 'error': f'JS failed: {result.stderr}'}
+    if returncode != 0:
+        return {'success': False, 'error': f'JS failed: {stderr}'}
 
     try:
-        parts = result.stdout.strip().split('|||')
-        page_title = parts[0] if len(parts) > 0 else ''
-        page_url = parts[1] if len(parts) > 1 else ''
-        images_json = parts[2] if len(parts) > 2 else '[]'
-        raw_data = json.loads(images_json)
+        page = _json_loads(stdout.strip() or '{}')
+        page_title = page.get('title', '')
+        page_url = page.get('url', '')
+        raw_data = page.get('imgs', [])
         # Convert short keys back to full names
         images_data = [
             {
@@ -521,33 +927,32 @@ end tell
 
     log(f"Found {len(images_data)} images, downloading...")
 
-    downloaded = []
-    for i, img in enumerate(images_data):
+    limit = asyncio.Semaphore(IMAGE_FETCH_CONCURRENCY)
+
+    async def fetch(session, i, img):
         src = img.get('src', '')
         if not src:
-            continue
+            return None
 
         log(f"  Image {i+1}: {src[:50]}...")
 
-        try:
-            req = urllib.request.Request(src, headers={
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-            })
-            with urllib.request.urlopen(req, timeout=10) as response:
-                image_data = response.read()
-                image_b64 = base64.b64encode(image_data).decode('utf-8')
-
-                downloaded.append({
-                    'image_data': image_b64,
-                    'url': img.get('url', ''),
-                    'src': src,
-                    'alt': img.get('alt', ''),
-                    'width': img.get('width', 0),
-                    'height': img.get('height', 0)
-                })
-        except Exception as e:
-            log(f"    Failed: {e}")
-            continue
+        image_data = await _fetch_image(session, limit, src)
+        if image_data is None:
+            return None
+
+        return {
+            'image_data': image_data,
+            'url': img.get('url', ''),
+            'src': src,
+            'alt': img.get('alt', ''),
+            'width': img.get('width', 0),
+            'height': img.get('height', 0)
+        }
+
+    # Fetch all images concurrently - total latency is the slowest image, not the sum
+    session = _image_session()
+    results = await asyncio.gather(*(fetch(session, i, img) for i, img in enumerate(images_data)))
+    downloaded = [r for r in results if r]
 
     log(f"Downloaded {len(downloaded)} images")
     return {
@@ -560,58 +965,25 @@ end tell
 
 _cached_images = []
 
-def list_page_images(min_width=150, min_height=150):
+async def list_page_images(min_width=150, min_height=150):
     global _cached_images
 
-    # Simplified JS - faster execution
-    js_code = f'''
-    (function() {{
-        var r = [];
-        var imgs = document.querySelectorAll('img');
-        var idx = 0;
-        for (var i = 0; i < imgs.length && idx < 30; i++) {{
-            var img = imgs[i];
-            if (img.naturalWidth < {min_width} || img.naturalHeight < {min_height}) continue;
-            var rect = img.getBoundingClientRect();
-            if (rect.width < 80 || rect.height < 80) continue;
-            var src = img.src;
-            if (img.srcset) {{
-                var parts = img.srcset.split(',');
-                var last = parts[parts.length - 1].trim().split(' ')[0];
-                if (last) src = last;
-            }}
-            if (!src || src.indexOf('data:') === 0) continue;
-            var link = img.closest('a');
-            r.push({{i: idx++, s: src, u: link ? link.href : '', a: img.alt || '', w: img.naturalWidth, h: img.naturalHeight}});
-        }}
-        return JSON.stringify(r);
-    }})();
-    '''
-
-    escaped_js = js_code.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
-    script = f'''
-tell application "Google Chrome"
-    set currentURL to URL of active tab of front window
-    set pageTitle to title of active tab of front window
-    tell active tab of front window
-        set jsResult to execute javascript "{escaped_js}"
-    end tell
-    return pageTitle & "|||" & currentURL & "|||" & jsResult
-end tell
-'''
+    script = _IMAGE_SCAN_SCRIPT % {'limit': 30, 'min_width': int(min_width), 'min_height': int(min_height)}
 
     log("Listing images on page...")
-    result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=30)
+    try:
+        returncode, stdout, stderr = await run_osascript(script, timeout=30)
+    except Exception as e:
+        return {'success': False, 'error': f'JS failed: {e}'}
 
-    if result.returncode != 0:
-        return {'success': False, 'error': f'JS failed: {result.stderr}'}
+    if returncode != 0:
+        return {'success': False, 'error': f'JS failed: {stderr}'}
 
     try:
-        parts = result.stdout.strip().split('|||')
-        page_title = parts[0] if len(parts) > 0 else ''
-        page_url = parts[1] if len(parts) > 1 else ''
-        images_json = parts[2] if len(parts) > 2 else '[]'
-        images_data = json.loads(images_json)
+        page = _json_loads(stdout.strip() or '{}')
+        page_title = page.get('title', '')
+        page_url = page.get('url', '')
+        images_data = page.get('imgs', [])
         # Convert short keys back to full names
         images_data = [
             {
@@ -670,127 +1042,279 @@ def uber_open_app(pickup_lat=None, pickup_lon=None):
     else:
         uber_url = "https://m.uber.com"
 
-    # Open Chrome and navigate
-    open_script = '''
-tell application "Google Chrome"
-    activate
-    if (count of windows) = 0 then
-        make new window
-    end if
-    set URL of active tab of front window to "''' + uber_url + '''"
-end tell
-'''
-    result = subprocess.run(['osascript', '-e', open_script], capture_output=True, text=True, timeout=10)
-    if result.returncode != 0:
-        return {'success': False, 'error': 'Failed to open Chrome: ' + result.stderr}
+    ws_url = cdp_page_ws_url('uber.com')
+    if not ws_url:
+        return {'success': False, 'error': 'Chrome debug mode not running or no tab available'}
 
-    log("Opened Uber, waiting for page load...")
-    time.sleep(3)
+    # Navigate and return as soon as the page's load event fires (3s cap, as before)
+    loaded, error = _cdp_navigate_and_wait(ws_url, uber_url, timeout=3.0)
+    if error:
+        return {'success': False, 'error': f'Failed to open Uber: {error}'}
+    cdp_send(ws_url, 'Page.bringToFront')
+    log("Uber page loaded" if loaded else "Uber page still loading after 3s, continuing")
 
     return {
         'success': True,
         'message': 'Uber app opened in Chrome',
         'url': uber_url,
-        'next_step': 'Take a screenshot to see current state (login required? pickup set?)'
+        'next_step': 'Call uber_screenshot to see current state (login required? pickup set?)'
     }
 
 
-def uber_get_page_state():
-    """
-    Analyze current Uber page state by extracting visible text and elements.
-    Returns structured info about what's on screen.
-    """
-    import time
+# Installed into the Uber tab before the helpers run. window.__uberQuery(sel) memoises
+# querySelectorAll results until the DOM changes, so the find -> click -> type steps of
+# one flow don't rescan the page for the same selector. Each new document starts empty.
+# window.__uberButton(texts, exact) finds the first <button> whose lowercased text
+# equals (or contains) one of texts with a single XPath query instead of a JS loop.
+# window.__uberBodyText() is document.body.innerText, read (one layout pass) only
+# after something that could change it - text, nodes, class/style - has mutated.
+_UBER_QUERY_CACHE_JS = '''
+(function() {
+    if (window.__uberQuery) return;
+    var cache = new Map();
+    function lookup(sel) {
+        // Plain #id, .class and tag selectors skip the selector parser
+        if (/^#[\\w-]+$/.test(sel)) {
+            var el = document.getElementById(sel.slice(1));
+            return el ? [el] : [];
+        }
+        if (/^\\.[\\w-]+$/.test(sel)) return document.getElementsByClassName(sel.slice(1));
+        if (/^[a-zA-Z][\\w-]*$/.test(sel)) return document.getElementsByTagName(sel);
+        return document.querySelectorAll(sel);
+    }
+    window.__uberQuery = function(sel) {
+        var hit = cache.get(sel);
+        if (!hit) {
+            hit = lookup(sel);
+            cache.set(sel, hit);
+        }
+        return hit;
+    };
+    var LOWER = "translate(normalize-space(.), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')";
+    window.__uberButton = function(texts, exact) {
+        var tests = [].concat(texts).map(function(t) {
+            var lit = '"' + t + '"';
+            return exact ? LOWER + ' = ' + lit : 'contains(' + LOWER + ', ' + lit + ')';
+        });
+        return document.evaluate('//button[' + tests.join(' or ') + ']', document, null,
+            XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    };
+    new MutationObserver(function() { cache.clear(); }).observe(document, {
+        childList: true,
+        subtree: true,
+        attributes: true,
+        attributeFilter: ['class', 'role', 'type', 'href', 'data-testid']
+    });
+    var bodyText = null;
+    window.__uberBodyText = function() {
+        if (bodyText === null) bodyText = document.body ? document.body.innerText : '';
+        return bodyText;
+    };
+    new MutationObserver(function() { bodyText = null; }).observe(document, {
+        childList: true,
+        subtree: true,
+        characterData: true,
+        attributes: true,
+        attributeFilter: ['class', 'style', 'hidden']
+    });
+})();
+'''
 
-    js_code = '''
-    (function() {
-        var state = {
-            url: window.location.href,
-            title: document.title,
-            isLoggedIn: false,
-            hasPickup: false,
-            hasDestination: false,
-            rideOptions: [],
-            visibleButtons: [],
-            visibleInputs: [],
-            pageText: ''
-        };
+# Page-state extractor for uber_get_page_state. Kept as one constant so the
+# CDP session can compile it once per page and re-run it by script id.
+# The result is memoized on the page and only rebuilt after a DOM mutation,
+# an input event, or a URL/title change, so repeated polls of an idle page
+# skip the walk. A navigation starts a fresh window and so a fresh memo.
+_UBER_PAGE_STATE_JS = '''
+(function() {
+    var memo = window.__uberPageState;
+    if (memo && !memo.dirty && memo.url === window.location.href && memo.title === document.title) {
+        return memo.state;
+    }
+    if (!memo) {
+        memo = window.__uberPageState = {};
+        var markDirty = function() { memo.dirty = true; };
+        new MutationObserver(markDirty).observe(document, {
+            childList: true,
+            subtree: true,
+            characterData: true,
+            attributes: true
+        });
+        // Typing changes input values without mutating the DOM
+        document.addEventListener('input', markDirty, true);
+    }
 
-        // Check for login indicators
-        var loginBtn = document.querySelector('[data-testid="login-button"]') ||
-                      document.querySelector('a[href*="login"]') ||
-                      Array.from(document.querySelectorAll('button')).find(b =>
-                          b.textContent.toLowerCase().includes('sign in') ||
-                          b.textContent.toLowerCase().includes('log in'));
-        state.isLoggedIn = !loginBtn;
-
-        // Check for pickup/destination
-        var inputs = document.querySelectorAll('input');
-        inputs.forEach(function(inp) {
-            var placeholder = (inp.placeholder || '').toLowerCase();
-            var value = inp.value || '';
-            state.visibleInputs.push({
-                placeholder: inp.placeholder,
-                value: value,
-                id: inp.id,
-                name: inp.name
-            });
+    var state = {
+        url: window.location.href,
+        title: document.title,
+        isLoggedIn: true,
+        hasPickup: false,
+        hasDestination: false,
+        rideOptions: [],
+        visibleButtons: [],
+        visibleInputs: [],
+        pageText: ''
+    };
+
+    // One walk over the DOM, classifying each node as we go. Script, style and SVG
+    // subtrees are skipped and the walk stops after 5000 elements so a huge page
+    // can't stall the helper.
+    var cards = [];   // ride cards that contain the current node
+    var walker = document.createTreeWalker(document.body, NodeFilter.SHOW_ELEMENT, {
+        acceptNode: function(node) {
+            var tag = node.tagName;
+            return tag === 'SCRIPT' || tag === 'STYLE' || tag === 'NOSCRIPT' || tag === 'svg' ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_ACCEPT;
+        }
+    });
+    var visited = 0;
+    while (walker.nextNode()) {
+        if (++visited > 5000) {
+            state.truncated = true;
+            break;
+        }
+        var el = walker.currentNode;
+        var tag = el.tagName;
+        var cls = el.getAttribute('class') || '';
+        var testId = el.getAttribute('data-testid') || '';
+
+        while (cards.length && !cards[cards.length - 1].node.contains(el)) cards.pop();
+
+        if (tag === 'INPUT') {
+            var placeholder = (el.placeholder || '').toLowerCase();
+            var value = el.value || '';
+            state.visibleInputs.push({placeholder: el.placeholder, value: value, id: el.id, name: el.name});
             if (placeholder.includes('pickup') || placeholder.includes('from')) {
                 state.hasPickup = value.length > 0;
             }
             if (placeholder.includes('destination') || placeholder.includes('where') || placeholder.includes('to')) {
                 state.hasDestination = value.length > 0;
             }
-        });
+            continue;
+        }
 
-        // Find clickable buttons
-        var buttons = document.querySelectorAll('button, [role="button"], a[href]');
-        buttons.forEach(function(btn) {
-            var text = (btn.textContent || '').trim().substring(0, 50);
+        var isLink = tag === 'A' && el.hasAttribute('href');
+        if (tag === 'BUTTON' || isLink || el.getAttribute('role') === 'button') {
+            var fullText = el.textContent || '';
+            var lower = fullText.toLowerCase();
+            // Login indicators
+            if (testId === 'login-button' ||
+                (isLink && el.getAttribute('href').includes('login')) ||
+                (tag === 'BUTTON' && (lower.includes('sign in') || lower.includes('log in')))) {
+                state.isLoggedIn = false;
+            }
+            var text = fullText.trim().substring(0, 50);
             if (text && !text.includes('\\n')) {
                 state.visibleButtons.push(text);
             }
-        });
+        }
 
-        // Extract ride options if visible
-        var rideCards = document.querySelectorAll('[data-testid*="product"], [class*="product"]');
-        rideCards.forEach(function(card) {
-            var name = card.querySelector('[class*="name"], [class*="title"]');
-            var price = card.querySelector('[class*="price"], [class*="fare"]');
-            if (name) {
-                state.rideOptions.push({
-                    name: (name.textContent || '').trim(),
-                    price: price ? (price.textContent || '').trim() : ''
-                });
+        // Ride cards and the first name/price node inside each. Name/price is tested
+        // first so a node like class="product-name" inside a card labels that card
+        // instead of opening a new, nameless one.
+        var isName = cards.length && (cls.includes('name') || cls.includes('title'));
+        var isPrice = cards.length && (cls.includes('price') || cls.includes('fare'));
+        if (isName || isPrice) {
+            for (var c = 0; c < cards.length; c++) {
+                if (isName && !cards[c].name) cards[c].name = el;
+                if (isPrice && !cards[c].price) cards[c].price = el;
             }
-        });
+        } else if (testId.includes('product') || cls.includes('product')) {
+            cards.push({node: el, name: null, price: null, outer: cards.slice()});
+        }
+        if (cards.length && cards[cards.length - 1].node === el) {
+            state.rideOptions.push(cards[cards.length - 1]);
+        }
+    }
 
-        // Get visible page text for context
-        state.pageText = document.body.innerText.substring(0, 2000);
+    // A "card" holding named cards (the product list itself) is a container, not an option
+    state.rideOptions.forEach(function(card) {
+        if (card.name) card.outer.forEach(function(outer) { outer.hasNamedCard = true; });
+    });
+    state.rideOptions = state.rideOptions.filter(function(card) { return card.name && !card.hasNamedCard; }).map(function(card) {
+        return {
+            name: (card.name.textContent || '').trim(),
+            price: card.price ? (card.price.textContent || '').trim() : ''
+        };
+    });
+
+    // Page text for context. Walks text nodes instead of reading innerText, which forces
+    // a layout, and stops once 2000 characters have been collected.
+    var texts = [], length = 0;
+    var textWalker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT, {
+        acceptNode: function(node) {
+            var tag = node.parentNode.tagName;
+            return tag === 'SCRIPT' || tag === 'STYLE' || tag === 'NOSCRIPT' ? NodeFilter.FILTER_REJECT : NodeFilter.FILTER_ACCEPT;
+        }
+    });
+    while (length < 2000 && textWalker.nextNode()) {
+        var chunk = textWalker.currentNode.nodeValue.replace(/\\s+/g, ' ').trim();
+        if (chunk) {
+            texts.push(chunk);
+            length += chunk.length + 1;
+        }
+    }
+    state.pageText = texts.join(' ').substring(0, 2000);
+
+    memo.state = state;
+    memo.url = state.url;
+    memo.title = state.title;
+    memo.dirty = false;
+    return state;
+})();
+'''
 
-        return JSON.stringify(state);
-    })();
-    '''
+def uber_get_page_state():
+    """
+    Analyze current Uber page state by extracting visible text and elements.
+    Returns structured info about what's on screen.
+    """
+    value, error = cdp_run_in_page(_UBER_PAGE_STATE_JS, 'uber_page_state.js')
+    if error:
+        return {'success': False, 'error': f'Failed to analyze page: {error}'}
 
-    escaped_js = js_code.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
-    script = f'''
-tell application "Google Chrome"
-    tell active tab of front window
-        execute javascript "{escaped_js}"
-    end tell
-end tell
-'''
+    if isinstance(value, dict):
+        return {'success': True, 'state': value}
+    return {'success': True, 'state': {'raw': value}}
 
-    result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=15)
 
-    if result.returncode != 0:
-        return {'success': False, 'error': f'Failed to analyze page: {result.stderr}'}
+async def uber_snapshot(mode='full', app_name=None, inline=True):
+    """
+    Page state and a screenshot together. The CDP query runs on a worker thread
+    while the screen is captured, so this costs the slower of the two, not the sum.
+    """
+    state, shot = await asyncio.gather(
+        asyncio.to_thread(uber_get_page_state),
+        take_screenshot(mode=mode, app_name=app_name, inline=inline)
+    )
+    return {
+        'success': state.get('success', False) and shot.get('success', False),
+        'state': state.get('state'),
+        'state_error': state.get('error'),
+        'screenshot': shot
+    }
 
-    try:
-        state = json.loads(result.stdout.strip())
-        return {'success': True, 'state': state}
-    except:
-        return {'success': True, 'state': {'raw': result.stdout.strip()}}
+
+def uber_screenshot():
+    """
+    Screenshot of the Uber tab via Page.captureScreenshot. Returns changed=False and no
+    image when it is identical to the previous capture, so an unchanged page isn't
+    sent for analysis again.
+    """
+    session = _uber_page_session('uber.com')
+    if not session:
+        return {'success': False, 'error': 'Chrome debug mode not running or no tab available'}
+    # Page events reset the hash on navigation
+    session.enable('Page')
+    response = session.send('Page.captureScreenshot', {'format': 'png'})
+    if 'error' in response:
+        return {'success': False, 'error': str(response['error'])}
+
+    png = _b64.b64decode(response['result']['data'])
+    digest = hashlib.sha256(png).digest()
+    if digest == session.last_screenshot:
+        return {'success': True, 'changed': False}
+    session.last_screenshot = digest
+    return {'success': True, 'changed': True, 'image_data': png}
 
 
 def uber_click_element(selector=None, text_contains=None, element_type='button'):
@@ -798,55 +1322,49 @@ def uber_click_element(selector=None, text_contains=None, element_type='button')
     Click an element on the Uber page.
     Can target by CSS selector or by text content.
     """
-    import time
-
     if selector:
-        js_code = f'''
-        (function() {{
-            var el = document.querySelector('{selector}');
-            if (el) {{
+        # Real mouse events at the node's box; fall back to el.click() for nodes
+        # without a box (hidden inputs and the like)
+        session = _uber_page_session('uber.com')
+        if not session:
+            return {'success': False, 'error': 'Chrome debug mode not running or no tab available'}
+        result = cdp_click_selector(session.ws_url, selector)
+        if not result.get('no_box'):
+            return result
+
+    # Values go in as JSON literals, so no hand-rolled quote escaping is needed
+    if selector:
+        js_code = '''
+        (function(selector) {
+            var el = window.__uberQuery(selector)[0];
+            if (el) {
                 el.click();
-                return JSON.stringify({{success: true, clicked: '{selector}'}});
-            }}
-            return JSON.stringify({{success: false, error: 'Element not found: {selector}'}});
-        }})();
-        '''
+                return {success: true, clicked: selector};
+            }
+            return {success: false, error: 'Element not found: ' + selector};
+        })(%s);
+        ''' % json.dumps(selector)
     elif text_contains:
-        safe_text = text_contains.replace("'", "\\'")
-        js_code = f'''
-        (function() {{
-            var elements = document.querySelectorAll('{element_type}, [role="button"], a');
-            for (var i = 0; i < elements.length; i++) {{
+        js_code = '''
+        (function(elementType, needle) {
+            var elements = window.__uberQuery(elementType + ', [role="button"], a');
+            for (var i = 0; i < elements.length; i++) {
                 var el = elements[i];
-                if (el.textContent.toLowerCase().includes('{safe_text.lower()}')) {{
+                if (el.textContent.toLowerCase().includes(needle.toLowerCase())) {
                     el.click();
-                    return JSON.stringify({{success: true, clicked: el.textContent.trim().substring(0, 50)}});
-                }}
-            }}
-            return JSON.stringify({{success: false, error: 'No element containing "{safe_text}" found'}});
-        }})();
-        '''
+                    return {success: true, clicked: el.textContent.trim().substring(0, 50)};
+                }
+            }
+            return {success: false, error: 'No element containing "' + needle + '" found'};
+        })(%s, %s);
+        ''' % (json.dumps(element_type), json.dumps(text_contains))
     else:
         return {'success': False, 'error': 'Must provide selector or text_contains'}
 
-    escaped_js = js_code.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
-    script = f'''
-tell application "Google Chrome"
-    tell active tab of front window
-        execute javascript "{escaped_js}"
-    end tell
-end tell
-'''
-
-    result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=10)
-
-    if result.returncode != 0:
-        return {'success': False, 'error': result.stderr}
-
-    try:
-        return json.loads(result.stdout.strip())
-    except:
-        return {'success': True, 'result': result.stdout.strip()}
+    value, error = cdp_eval_in_page(js_code)
+    if error:
+        return {'success': False, 'error': error}
+    return value or {'success': False, 'error': 'No result from page'}
 
 
 def uber_type_text(text, selector=None, clear_first=True):
@@ -854,74 +1372,120 @@ def uber_type_text(text, selector=None, clear_first=True):
     Type text into an input field.
     Can target by selector or will find the focused/active input.
     """
-    import time
-
-    safe_text = text.replace('\\', '\\\\').replace("'", "\\'").replace('"', '\\"')
-
-    if selector:
-        js_code = f'''
-        (function() {{
-            var el = document.querySelector('{selector}');
-            if (!el) return JSON.stringify({{success: false, error: 'Input not found'}});
-            el.focus();
-            {'el.value = "";' if clear_first else ''}
-            el.value = '{safe_text}';
-            el.dispatchEvent(new Event('input', {{bubbles: true}}));
-            el.dispatchEvent(new Event('change', {{bubbles: true}}));
-            return JSON.stringify({{success: true, typed: '{safe_text}'}});
-        }})();
-        '''
-    else:
-        js_code = f'''
-        (function() {{
-            var el = document.activeElement;
-            if (!el || (el.tagName !== 'INPUT' && el.tagName !== 'TEXTAREA')) {{
+    js_code = '''
+    (function(text, selector, clearFirst) {
+        var el;
+        if (selector) {
+            el = window.__uberQuery(selector)[0];
+            if (!el) return {success: false, error: 'Input not found'};
+        } else {
+            el = document.activeElement;
+            if (!el || (el.tagName !== 'INPUT' && el.tagName !== 'TEXTAREA')) {
                 // Try to find a visible input
-                var inputs = document.querySelectorAll('input:not([type="hidden"])');
-                for (var i = 0; i < inputs.length; i++) {{
+                var inputs = window.__uberQuery('input:not([type="hidden"])');
+                for (var i = 0; i < inputs.length; i++) {
                     var rect = inputs[i].getBoundingClientRect();
-                    if (rect.width > 0 && rect.height > 0) {{
+                    if (rect.width > 0 && rect.height > 0) {
                         el = inputs[i];
                         break;
-                    }}
-                }}
-            }}
-            if (!el) return JSON.stringify({{success: false, error: 'No input found'}});
-            el.focus();
-            {'el.value = "";' if clear_first else ''}
-            el.value = '{safe_text}';
-            el.dispatchEvent(new Event('input', {{bubbles: true}}));
-            el.dispatchEvent(new Event('change', {{bubbles: true}}));
-            return JSON.stringify({{success: true, typed: '{safe_text}', element: el.tagName}});
-        }})();
-        '''
-
-    escaped_js = js_code.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
-    script = f'''
-tell application "Google Chrome"
-    tell active tab of front window
-        execute javascript "{escaped_js}"
-    end tell
-end tell
-'''
-
-    result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=10)
-
-    if result.returncode != 0:
-        return {'success': False, 'error': result.stderr}
+                    }
+                }
+            }
+            if (!el) return {success: false, error: 'No input found'};
+        }
+        el.focus();
+        if (clearFirst) el.value = '';
+        el.value = text;
+        el.dispatchEvent(new Event('input', {bubbles: true}));
+        el.dispatchEvent(new Event('change', {bubbles: true}));
+        return {success: true, typed: text, element: el.tagName};
+    })(%s, %s, %s);
+    ''' % (json.dumps(text), json.dumps(selector), json.dumps(bool(clear_first)))
+
+    value, error = cdp_eval_in_page(js_code)
+    if error:
+        return {'success': False, 'error': error}
+    return value or {'success': False, 'error': 'No result from page'}
+
+
+# Clicks the "where to" field, types the address and clicks the first autocomplete
+# suggestion. MutationObservers wait for the input and the suggestion list instead of
+# fixed sleeps. %s is the address as a JSON string literal.
+_UBER_SET_DESTINATION_JS = '''
+(function(address) {
+    function findOpener() {
+        var els = window.__uberQuery('button, [role="button"], a, input');
+        for (var i = 0; i < els.length; i++) {
+            var text = (els[i].textContent || els[i].placeholder || '').toLowerCase();
+            if (text.includes('where to') || text.includes('destination')) return els[i];
+        }
+        return null;
+    }
+    function findInput() {
+        var el = document.activeElement;
+        if (el && (el.tagName === 'INPUT' || el.tagName === 'TEXTAREA')) return el;
+        var inputs = window.__uberQuery('input:not([type="hidden"])');
+        for (var i = 0; i < inputs.length; i++) {
+            var rect = inputs[i].getBoundingClientRect();
+            if (rect.width > 0 && rect.height > 0) return inputs[i];
+        }
+        return null;
+    }
+    function findOptions() {
+        var items = window.__uberQuery('[data-testid*="autocomplete"] li, [class*="autocomplete"] li, [role="listbox"] [role="option"], [class*="suggestion"], [class*="result"]');
+        var valid = Array.prototype.filter.call(items, function(item) {
+            var rect = item.getBoundingClientRect();
+            return rect.width > 50 && rect.height > 20;
+        });
+        return valid.length ? valid : null;
+    }
+    function whenReady(check, timeoutMs, done) {
+        var found = check();
+        if (found) return done(found);
+        var timer;
+        var observer = new MutationObserver(function() {
+            var found = check();
+            if (found) {
+                observer.disconnect();
+                clearTimeout(timer);
+                done(found);
+            }
+        });
+        observer.observe(document.body, {childList: true, subtree: true, attributes: true});
+        timer = setTimeout(function() {
+            observer.disconnect();
+            done(null);
+        }, timeoutMs);
+    }
 
-    try:
-        return json.loads(result.stdout.strip())
-    except:
-        return {'success': True, 'result': result.stdout.strip()}
+    var opener = findOpener();
+    if (opener) opener.click();
 
+    return new Promise(function(resolve) {
+        whenReady(findInput, 1000, function(el) {
+            if (!el) return resolve({success: false, error: 'No input found'});
+            el.focus();
+            // Use the native setter so React-controlled inputs see the change
+            var setter = Object.getOwnPropertyDescriptor(Object.getPrototypeOf(el), 'value').set;
+            setter.call(el, address);
+            el.dispatchEvent(new Event('input', {bubbles: true}));
+            el.dispatchEvent(new Event('change', {bubbles: true}));
+            whenReady(findOptions, 3000, function(items) {
+                if (!items) return resolve({success: false, error: 'No autocomplete items found', typed: address});
+                var label = items[0].textContent.trim().substring(0, 100);
+                items[0].click();
+                resolve({success: true, typed: address, selected: label});
+            });
+        });
+    });
+})(%s);
+'''
 
 def uber_set_location(location_type, lat, lon, address=''):
     """
     Set pickup or destination location using coordinates.
     location_type: 'pickup' or 'destination'
     """
-    import time
     import urllib.parse
 
     log(f"Setting {location_type}: {lat}, {lon} ({address})")
@@ -932,125 +1496,151 @@ def uber_set_location(location_type, lat, lon, address=''):
         pickup_json = json.dumps({"latitude": lat, "longitude": lon})
         uber_url = "https://m.uber.com/go/product-selection?pickup=" + urllib.parse.quote(pickup_json)
 
-        script = '''
-tell application "Google Chrome"
-    set URL of active tab of front window to "''' + uber_url + '''"
-end tell
-'''
-        result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=10)
-        time.sleep(2)
+        ws_url = cdp_page_ws_url('uber.com')
+        if not ws_url:
+            return {'success': False, 'error': 'Chrome debug mode not running or no tab available'}
+
+        # Return once the page's load event fires rather than after a fixed sleep
+        loaded, error = _cdp_navigate_and_wait(ws_url, uber_url, timeout=3.0)
+        if error:
+            return {'success': False, 'error': f'Failed to navigate to Uber: {error}', 'url': uber_url}
 
         return {
-            'success': result.returncode == 0,
+            'success': True,
+            'loaded': loaded,
             'message': f'Navigated to Uber with pickup at {address or f"{lat}, {lon}"}',
             'url': uber_url
         }
 
-    # For destination, we need to interact with the page
+    # For destination: open the field, type, and pick the first suggestion in one script
     else:
-        # First try to click the destination field
-        click_result = uber_click_element(text_contains='where to')
-        if not click_result.get('success'):
-            click_result = uber_click_element(text_contains='destination')
-
-        time.sleep(1)
-
-        # Type the address
-        if address:
-            type_result = uber_type_text(address)
-            time.sleep(2)  # Wait for autocomplete
-
-            return {
-                'success': True,
-                'message': f'Entered destination: {address}',
-                'click_result': click_result,
-                'type_result': type_result,
-                'next_step': 'Take a screenshot to see autocomplete results, then click the correct one'
-            }
-        else:
+        if not address:
             return {
                 'success': False,
                 'error': 'Destination address required'
             }
 
+        value, error = cdp_eval_in_page(_UBER_SET_DESTINATION_JS % json.dumps(address))
+        if error:
+            return {'success': False, 'error': error}
 
-def uber_select_autocomplete(index=0):
-    """
+        result = dict(value or {})
+        if result.get('success'):
+            result['message'] = f"Set destination: {result.get('selected') or address}"
+        else:
+            result['next_step'] = 'Call uber_screenshot to see the current state'
+        return result
+
+
+def uber_select_autocomplete(index=0, timeout_ms=3000):
+    """
     Select an autocomplete result by index (0 = first result).
+    Waits up to timeout_ms for the list to render instead of relying on a fixed sleep.
     """
-    import time
-
+    # Stay inside the CDP reply timeout
+    timeout_ms = max(0, min(int(timeout_ms), 8000))
     js_code = f'''
     (function() {{
-        // Look for autocomplete dropdown items
-        var items = document.querySelectorAll('[data-testid*="autocomplete"] li, [class*="autocomplete"] li, [role="listbox"] [role="option"], [class*="suggestion"], [class*="result"]');
-        if (items.length === 0) {{
-            // Try more generic selectors
-            items = document.querySelectorAll('ul li, [role="option"]');
-        }}
-
-        var validItems = [];
-        items.forEach(function(item) {{
-            var rect = item.getBoundingClientRect();
-            if (rect.width > 50 && rect.height > 20) {{
-                validItems.push(item);
+        function validItems() {{
+            // Look for autocomplete dropdown items
+            var items = window.__uberQuery('[data-testid*="autocomplete"] li, [class*="autocomplete"] li, [role="listbox"] [role="option"], [class*="suggestion"], [class*="result"]');
+            if (items.length === 0) {{
+                // Try more generic selectors
+                items = window.__uberQuery('ul li, [role="option"]');
             }}
-        }});
-
-        if (validItems.length > {index}) {{
-            validItems[{index}].click();
-            return JSON.stringify({{success: true, selected: validItems[{index}].textContent.trim().substring(0, 100)}});
+            return Array.prototype.filter.call(items, function(item) {{
+                var rect = item.getBoundingClientRect();
+                return rect.width > 50 && rect.height > 20;
+            }});
+        }}
+        function pick(items) {{
+            items[{index}].click();
+            return {{success: true, selected: items[{index}].textContent.trim().substring(0, 100)}};
         }}
 
-        return JSON.stringify({{success: false, error: 'No autocomplete items found', found: validItems.length}});
+        var items = validItems();
+        if (items.length > {index}) return pick(items);
+
+        // Re-check on DOM mutations (at most once per frame) until the item exists or we time out
+        return new Promise(function(resolve) {{
+            var pending = false;
+            var observer = new MutationObserver(function() {{
+                if (pending) return;
+                pending = true;
+                requestAnimationFrame(function() {{
+                    pending = false;
+                    var items = validItems();
+                    if (items.length > {index}) {{
+                        observer.disconnect();
+                        clearTimeout(timer);
+                        resolve(pick(items));
+                    }}
+                }});
+            }});
+            observer.observe(document.body, {{childList: true, subtree: true}});
+            var timer = setTimeout(function() {{
+                observer.disconnect();
+                resolve({{success: false, error: 'No autocomplete items found', found: validItems().length}});
+            }}, {timeout_ms});
+        }});
     }})();
     '''
 
-    escaped_js = js_code.replace('\\', '\\\\').replace('"', '\\"').replace('\n', ' ')
-    script = f'''
-tell application "Google Chrome"
-    tell active tab of front window
-        execute javascript "{escaped_js}"
-    end tell
-end tell
+    value, error = cdp_eval_in_page(js_code)
+    if error:
+        return {'success': False, 'error': error}
+    return value or {'success': False, 'error': 'No result from page'}
+
+
+# Clicks the first button/link whose text contains one of the patterns. Patterns are
+# tried in priority order but the DOM is scanned and lowercased only once.
+# %s is a JSON array of lowercase patterns.
+_UBER_CLICK_FIRST_MATCH_JS = '''
+(function(patterns) {
+    var elements = window.__uberQuery('button, [role="button"], a');
+    var texts = [];
+    for (var i = 0; i < elements.length; i++) {
+        texts.push((elements[i].textContent || '').toLowerCase());
+    }
+    for (var p = 0; p < patterns.length; p++) {
+        for (var i = 0; i < texts.length; i++) {
+            if (texts[i].includes(patterns[p])) {
+                elements[i].click();
+                return {success: true, pattern: patterns[p], clicked: elements[i].textContent.trim().substring(0, 50)};
+            }
+        }
+    }
+    return {success: false, error: 'No element matching ' + patterns.join(', ') + ' found'};
+})(%s);
 '''
 
-    result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=10)
+def uber_click_first_match(patterns):
+    """Click the first element whose text contains any of the patterns, in one CDP call."""
+    value, error = cdp_eval_in_page(_UBER_CLICK_FIRST_MATCH_JS % json.dumps([p.lower() for p in patterns]))
+    if error:
+        return {'success': False, 'error': error}
+    return value or {'success': False, 'error': 'No result from page'}
 
-    if result.returncode != 0:
-        return {'success': False, 'error': result.stderr}
 
-    try:
-        return json.loads(result.stdout.strip())
-    except:
-        return {'success': True, 'result': result.stdout.strip()}
+_UBER_RIDE_ALTERNATES = {
+    'uberx': ['uber x', 'economy'],
+    'comfort': ['uber comfort'],
+    'uberxl': ['uber xl', 'xl'],
+    'black': ['uber black', 'premium']
+}
+_UBER_CONFIRM_PATTERNS = ['confirm', 'request', 'book', 'continue']
 
+def _uber_ride_patterns(ride_type):
+    return [ride_type.lower()] + _UBER_RIDE_ALTERNATES.get(ride_type.lower(), [])
 
 def uber_select_ride_type(ride_type='UberX'):
     """
     Select a ride type from available options.
     """
-    import time
-
     log(f"Selecting ride type: {ride_type}")
 
-    # Click on the ride type option
-    result = uber_click_element(text_contains=ride_type.lower())
-
-    if not result.get('success'):
-        # Try alternate names
-        alternates = {
-            'uberx': ['uber x', 'economy'],
-            'comfort': ['uber comfort'],
-            'uberxl': ['uber xl', 'xl'],
-            'black': ['uber black', 'premium']
-        }
-        for alt in alternates.get(ride_type.lower(), []):
-            result = uber_click_element(text_contains=alt)
-            if result.get('success'):
-                break
-
-    return result
+    # Try the name and its alternates in a single pass
+    return uber_click_first_match(_uber_ride_patterns(ride_type))
 
 
 def uber_confirm_ride():
@@ -1060,70 +1650,197 @@ def uber_confirm_ride():
     log("Confirming ride request...")
 
     # Try various confirm button patterns
-    patterns = ['confirm', 'request', 'book', 'continue']
-
-    for pattern in patterns:
-        result = uber_click_element(text_contains=pattern)
-        if result.get('success'):
-            return {
-                'success': True,
-                'message': f'Clicked "{pattern}" button',
-                'result': result
-            }
+    result = uber_click_first_match(_UBER_CONFIRM_PATTERNS)
+    if result.get('success'):
+        return {
+            'success': True,
+            'message': f'Clicked "{result["pattern"]}" button',
+            'result': result
+        }
 
     return {
         'success': False,
         'error': 'Could not find confirm button',
-        'next_step': 'Take a screenshot to see current state'
+        'next_step': 'Call uber_screenshot to see current state'
     }
 
 
-def uber_keyboard_action(action):
+# Runs a list of in-page steps in one Runtime.evaluate. Each step is
+# {op, waitMs, run: function() -> result or Promise}; a step that doesn't succeed is
+# retried on DOM mutations (once per frame) for up to waitMs. Stops at the first failure.
+# %s is the comma-separated step list.
+_UBER_CHAIN_JS = '''
+(async function(steps) {
+    function settle(step) {
+        return Promise.resolve(step.run()).then(function(result) {
+            if ((result && result.success) || !step.waitMs) return result;
+            return new Promise(function(resolve) {
+                var pending = false;
+                var observer = new MutationObserver(function() {
+                    if (pending) return;
+                    pending = true;
+                    requestAnimationFrame(function() {
+                        pending = false;
+                        var retry = step.run();
+                        if (retry && retry.success) {
+                            observer.disconnect();
+                            clearTimeout(timer);
+                            resolve(retry);
+                        } else {
+                            result = retry;
+                        }
+                    });
+                });
+                observer.observe(document.body, {childList: true, subtree: true});
+                var timer = setTimeout(function() {
+                    observer.disconnect();
+                    resolve(result);
+                }, step.waitMs);
+            });
+        });
+    }
+
+    var results = [];
+    for (var i = 0; i < steps.length; i++) {
+        var result = Object.assign({op: steps[i].op}, await settle(steps[i]));
+        results.push(result);
+        if (!result.success) break;
+    }
+    return results;
+})([%s]);
+'''
+
+def _uber_chain_step_js(step):
+    """JS step object for one in-page uber_chain op"""
+    op = step.get('op')
+    if op == 'set_destination':
+        # Has its own MutationObserver waits, so no outer retry
+        run, wait_ms = _UBER_SET_DESTINATION_JS % json.dumps(step.get('address', '')), 0
+    elif op == 'select_ride':
+        run, wait_ms = _UBER_CLICK_FIRST_MATCH_JS % json.dumps(_uber_ride_patterns(step.get('type', 'UberX'))), 5000
+    elif op == 'confirm':
+        run, wait_ms = _UBER_CLICK_FIRST_MATCH_JS % json.dumps(_UBER_CONFIRM_PATTERNS), 5000
+    elif op == 'click':
+        run, wait_ms = _UBER_CLICK_FIRST_MATCH_JS % json.dumps([step.get('text', '').lower()]), 3000
+    else:
+        raise ValueError(f'Unknown op: {op}')
+    wait_ms = max(0, min(int(step.get('wait_ms', wait_ms)), 8000))
+    return '{op: %s, waitMs: %d, run: function() { return %s; }}' % (json.dumps(op), wait_ms, run.strip().rstrip(';'))
+
+def uber_chain(steps):
     """
-    Perform keyboard actions: 'enter', 'tab', 'escape', 'down', 'up'
+    Run a booking plan in as few CDP round trips as possible.
+    steps: [{'op': 'set_pickup', 'lat', 'lon'}, {'op': 'set_destination', 'address'},
+            {'op': 'select_ride', 'type'}, {'op': 'confirm'}, {'op': 'click', 'text'}]
+    set_pickup navigates, so it runs on its own; consecutive in-page steps share one
+    evaluated script. Returns the per-step results and stops at the first failure.
     """
-    key_codes = {
-        'enter': 36,
-        'return': 36,
-        'tab': 48,
-        'escape': 53,
-        'down': 125,
-        'up': 126,
-        'left': 123,
-        'right': 124
+    results = []
+    batch = []
+
+    def flush():
+        if not batch:
+            return True
+        try:
+            steps_js = [_uber_chain_step_js(step) for step in batch]
+        except ValueError as e:
+            results.append({'success': False, 'error': str(e)})
+            return False
+        finally:
+            batch.clear()
+        # Every step waits at most 8s (destination ~4s), so size the reply timeout to match
+        value, error = cdp_eval_in_page(_UBER_CHAIN_JS % ', '.join(steps_js), timeout=10 + 8 * len(steps_js))
+        if error:
+            results.append({'success': False, 'error': error})
+            return False
+        results.extend(value or [])
+        return all(r.get('success') for r in value or [])
+
+    for step in steps:
+        if step.get('op') == 'set_pickup':
+            if not flush():
+                break
+            result = uber_set_location('pickup', step.get('lat'), step.get('lon'), step.get('address', ''))
+            results.append(dict(result, op='set_pickup'))
+            if not result.get('success'):
+                break
+        else:
+            batch.append(step)
+    else:
+        flush()
+
+    return {
+        'success': len(results) == len(steps) and all(r.get('success') for r in results),
+        'results': results
     }
 
-    code = key_codes.get(action.lower())
-    if not code:
-        return {'success': False, 'error': f'Unknown key: {action}'}
 
-    script = f'''
-tell application "System Events"
-    key code {code}
-end tell
-'''
+# action -> (key, code, windowsVirtualKeyCode, text) for Input.dispatchKeyEvent
+_UBER_KEYS = {
+    'enter': ('Enter', 'Enter', 13, '\r'),
+    'return': ('Enter', 'Enter', 13, '\r'),
+    'tab': ('Tab', 'Tab', 9, '\t'),
+    'escape': ('Escape', 'Escape', 27, None),
+    'down': ('ArrowDown', 'ArrowDown', 40, None),
+    'up': ('ArrowUp', 'ArrowUp', 38, None),
+    'left': ('ArrowLeft', 'ArrowLeft', 37, None),
+    'right': ('ArrowRight', 'ArrowRight', 39, None),
+}
 
-    result = subprocess.run(['osascript', '-e', script], capture_output=True, text=True, timeout=5)
+def uber_keyboard_action(action):
+    """
+    Perform keyboard actions: 'enter', 'tab', 'escape', 'down', 'up'
+    Keys go to the Uber tab over CDP, so Chrome doesn't need focus.
+    """
+    key = _UBER_KEYS.get(action.lower())
+    if not key:
+        return {'success': False, 'error': f'Unknown key: {action}'}
+
+    ws_url = cdp_page_ws_url('uber.com')
+    if not ws_url:
+        return {'success': False, 'error': 'Chrome debug mode not running or no tab available'}
+
+    name, code, vk, text = key
+    params = {'key': name, 'code': code, 'windowsVirtualKeyCode': vk, 'nativeVirtualKeyCode': vk}
+    down = dict(params, type='keyDown')
+    if text:
+        down['text'] = text
+    replies = cdp_send_many(ws_url, [
+        ('Input.dispatchKeyEvent', down),
+        ('Input.dispatchKeyEvent', dict(params, type='keyUp')),
+    ])
+    errors = [str(r['error']) for r in replies if 'error' in r]
 
     return {
-        'success': result.returncode == 0,
+        'success': not errors,
         'action': action,
-        'error': result.stderr if result.returncode != 0 else None
+        'error': errors[0] if errors else None
     }
 
 
 # ============================================================================
 # Chrome DevTools Protocol (CDP) Browser Automation
 
+# When the debug port last answered; checks within CHROME_CHECK_TTL are skipped
+CHROME_CHECK_TTL = 5.0
+_chrome_checked_at = 0.0
+
+def _mark_chrome_alive(alive=True):
+    global _chrome_checked_at
+    _chrome_checked_at = time.monotonic() if alive else 0.0
+
 def ensure_chrome_debug_mode():
     """Start Chrome with remote debugging if not already running"""
     import urllib.request
-    import time
+
+    if time.monotonic() - _chrome_checked_at < CHROME_CHECK_TTL:
+        return True
 
     # Check if Chrome debug port is already available
     try:
         with urllib.request.urlopen(f'http://localhost:{CDP_PORT}/json', timeout=2) as resp:
             log("Chrome debug mode already running")
+            _mark_chrome_alive()
             return True
     except:
         pass
@@ -1139,18 +1856,22 @@ def ensure_chrome_debug_mode():
     ]
 
     try:
-        # Start Chrome in background
-        subprocess.Popen(chrome_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-
-        # Wait for Chrome to start (up to 5 seconds)
-        for i in range(10):
-            time.sleep(0.5)
+        # Start Chrome in background (absolute path + close_fds=False -> posix_spawn)
+        subprocess.Popen(chrome_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, close_fds=False)
+
+        # Wait for Chrome to start (up to ~5 seconds). The port usually opens well
+        # under a second in, so poll with short timeouts and a growing delay.
+        delay = 0.05
+        deadline = time.monotonic() + 5.0
+        while time.monotonic() < deadline:
             try:
-                with urllib.request.urlopen(f'http://localhost:{CDP_PORT}/json', timeout=2) as resp:
+                with urllib.request.urlopen(f'http://localhost:{CDP_PORT}/json', timeout=0.3) as resp:
                     log(f"Chrome debug mode started on port {CDP_PORT}")
+                    _mark_chrome_alive()
                     return True
             except:
-                continue
+                time.sleep(delay)
+                delay = min(delay * 2, 0.5)
 
         log("Warning: Chrome started but debug port not responding")
         return False
@@ -1159,267 +1880,1218 @@ def ensure_chrome_debug_mode():
         return False
 # ============================================================================
 
+import http.client
 import urllib.request
 import urllib.parse
 
 CDP_PORT = 9222  # Chrome remote debugging port
 
+# Kept-alive connection to the debug port's HTTP endpoint (/json etc.)
+_cdp_http = None
+_cdp_http_lock = threading.Lock()
+
+def _cdp_http_request(path, method='GET', timeout=5):
+    """Request a path from the debug port and return the body, reusing one HTTP
+    connection. A connection Chrome has dropped is reopened once."""
+    global _cdp_http
+    with _cdp_http_lock:
+        for attempt in range(2):
+            if _cdp_http is None:
+                _cdp_http = http.client.HTTPConnection('localhost', CDP_PORT, timeout=timeout)
+            try:
+                _cdp_http.request(method, path)
+                return _cdp_http.getresponse().read()
+            except Exception as e:
+                _cdp_http.close()
+                _cdp_http = None
+                if attempt or not isinstance(e, (http.client.HTTPException, OSError)):
+                    raise
+
+def _cdp_http_json(path, method='GET', timeout=5):
+    """Request a JSON document from the debug port"""
+    return _json_loads(_cdp_http_request(path, method, timeout))
+
 def cdp_get_targets():
     """Get list of available Chrome targets (tabs)"""
     try:
-        with urllib.request.urlopen(f'http://localhost:{CDP_PORT}/json', timeout=5) as resp:
-            return json.loads(resp.read().decode())
+        targets = _cdp_http_json('/json')
+        _mark_chrome_alive()
     except Exception as e:
         log(f"CDP connection failed: {e}")
+        _mark_chrome_alive(False)
         return None
-
-def cdp_send(ws_url, method, params=None):
-    """Send a CDP command via WebSocket - synchronous version"""
-    import websocket
-
+    # Drop sessions for tabs that have since been closed
+    live = {t.get('id') for t in targets}
+    with _cdp_sessions_lock:
+        gone = [ws_url for ws_url in _cdp_sessions if ws_url.rsplit('/', 1)[-1] not in live]
+    for ws_url in gone:
+        cdp_close(ws_url)
+    return targets
+
+# Page targets currently driven by a flow (order_uber); see cdp_claim_page
+_claimed_targets = set()
+_opened_targets = set()  # ids of the claimed tabs cdp_claim_page opened itself
+_claimed_targets_lock = threading.Lock()
+
+def cdp_claim_page(url_contains=None):
+    """Reserve a page target no other flow is driving (preferring one whose URL
+    contains url_contains), opening a new tab in the same Chrome when every page
+    is taken. Returns the target, or None if Chrome is down. Hand it back with
+    cdp_release_page, which closes the tab again if it was opened here and never used."""
+    targets = cdp_get_targets()
+    if targets is None:
+        return None
+    if url_contains:
+        targets = sorted(targets, key=lambda t: url_contains not in t.get('url', ''))
+    with _claimed_targets_lock:
+        for target in targets:
+            if target.get('type') == 'page' and target.get('id') not in _claimed_targets:
+                break
+        else:
+            try:
+                # Chrome only accepts PUT for /json/new
+                target = _cdp_http_json('/json/new?about:blank', method='PUT')
+            except Exception as e:
+                log(f"Could not open a new Chrome tab: {e}")
+                return None
+            _opened_targets.add(target['id'])
+        _claimed_targets.add(target['id'])
+        return target
+
+def cdp_release_page(target):
+    """Hand back a claimed target. A tab cdp_claim_page opened is closed only while it
+    still shows about:blank (the flow failed before navigating); once it has been used
+    it stays open so the user can follow up on it in Chrome."""
+    with _claimed_targets_lock:
+        _claimed_targets.discard(target['id'])
+        opened = target['id'] in _opened_targets
+        _opened_targets.discard(target['id'])
+    if not opened:
+        return
     try:
-        # Use synchronous WebSocket connection
-        ws = websocket.create_connection(ws_url, timeout=10)
-
-        msg_id = 1
-        cmd = {'id': msg_id, 'method': method}
-        if params:
-            cmd['params'] = params
-
-        ws.send(json.dumps(cmd))
+        current = next((t for t in _cdp_http_json('/json') if t.get('id') == target['id']), None)
+    except Exception as e:
+        log(f"Could not check Chrome tab {target['id']}: {e}")
+        return
+    if current is not None and current.get('url', '') in ('', 'about:blank'):
+        cdp_close(target.get('webSocketDebuggerUrl'))
+        try:
+            _cdp_http_request(f"/json/close/{target['id']}")
+        except Exception as e:
+            log(f"Could not close Chrome tab {target['id']}: {e}")
+
+# url_contains -> (looked up at, ws_url) for cdp_page_ws_url
+PAGE_TARGET_TTL = 30.0
+_page_ws_urls = {}
+
+def cdp_page_ws_url(url_contains=None):
+    """WebSocket URL of the first page target whose URL contains url_contains
+    (falling back to the first page), or None if Chrome isn't reachable. The answer
+    is reused for PAGE_TARGET_TTL seconds while our socket to that tab stays open."""
+    cached = _page_ws_urls.get(url_contains)
+    if cached and time.monotonic() - cached[0] < PAGE_TARGET_TTL:
+        session = _cdp_sessions.get(cached[1])
+        if session is not None and session.ws is not None:
+            return cached[1]
+    pages = [t for t in cdp_get_targets() or [] if t.get('type') == 'page']
+    ws_url = pages[0].get('webSocketDebuggerUrl') if pages else None
+    if url_contains:
+        for target in pages:
+            if url_contains in target.get('url', ''):
+                ws_url = target.get('webSocketDebuggerUrl')
+                break
+    if ws_url:
+        _page_ws_urls[url_contains] = (time.monotonic(), ws_url)
+    else:
+        _page_ws_urls.pop(url_contains, None)
+    return ws_url
+
+class CDPSession:
+    """A persistent WebSocket to one Chrome target, shared by every caller.
+    A reader thread per connection hands replies to the callers waiting on them
+    and buffers events for wait_for_event, so a slow command doesn't hold up the
+    others and events never sit unread in the socket."""
+
+    def __init__(self, ws_url):
+        self.ws_url = ws_url
+        self.ws = None
+        self.lock = threading.Lock()
+        self.cond = threading.Condition(self.lock)
+        self.next_id = 0
+        self.pending = set()  # ids of sent commands still awaiting a reply
+        self.replies = {}     # id -> reply, until the caller collects it
+        self.events = deque(maxlen=256)
+        self.enabled = set()
+        self.scripts = {}   # script source -> compiled scriptId
+        self.installed = set()
+        self.nodes = {}     # selector -> backendNodeId, until the document changes
+        self.root_node = None  # DOM.getDocument root nodeId, until the document changes
+        self.last_screenshot = None  # SHA-256 of the last uber_screenshot PNG
+
+    def _connect(self):
+        """Open the socket and start its reader if needed. Caller holds the lock."""
+        if websocket is None:
+            raise ImportError('websocket-client is not installed (pip install websocket-client)')
+        if self.ws is None or not self.ws.connected:
+            self.ws = websocket.create_connection(self.ws_url, timeout=10)
+            self.enabled.clear()
+            self.scripts.clear()
+            self.installed.clear()
+            self.nodes.clear()
+            self.root_node = None
+            threading.Thread(target=self._read_loop, args=(self.ws,), daemon=True,
+                             name='cdp-reader').start()
+
+    def _close(self, ws=None):
+        """Drop the socket (only if it is still ws, when given - another caller may
+        already have reconnected); its reader exits and waiters see the loss.
+        Caller holds the lock."""
+        if self.ws is not None and (ws is None or self.ws is ws):
+            try:
+                self.ws.abort()
+                self.ws.shutdown()
+            except Exception:
+                pass
+            self.ws = None
+            self.cond.notify_all()
 
-        # Wait for response with matching ID
+    def _read_loop(self, ws):
+        """Demultiplex one connection: replies by id, everything else to events"""
         while True:
-            response = ws.recv()
-            data = json.loads(response)
-            if data.get('id') == msg_id:
-                ws.close()
-                return data
+            try:
+                data = _json_loads(ws.recv())
+            except websocket.WebSocketTimeoutException:
+                continue
+            except Exception:
+                break
+            with self.cond:
+                if 'id' in data:
+                    if data['id'] in self.pending:
+                        self.replies[data['id']] = data
+                elif 'method' in data:
+                    if data['method'] in ('Page.frameNavigated', 'DOM.documentUpdated'):
+                        # New document: cached node ids and the last screenshot are stale
+                        self.nodes.clear()
+                        self.root_node = None
+                        self.last_screenshot = None
+                    self.events.append(data)
+                self.cond.notify_all()
+        with self.cond:
+            if self.ws is ws:
+                self.ws = None
+            self.cond.notify_all()
+
+    def _write(self, commands):
+        """Send (method, params) commands; returns their ids. Caller holds the lock."""
+        ids = []
+        for method, params in commands:
+            self.next_id += 1
+            cmd = {'id': self.next_id, 'method': method}
+            if params:
+                cmd['params'] = params
+            self.pending.add(self.next_id)
+            ids.append(self.next_id)
+            self.ws.send(_json_dumps(cmd), websocket.ABNF.OPCODE_TEXT)
+        return ids
+
+    def _collect(self, ids, timeout):
+        """Wait (lock released meanwhile) for the replies to ids; None for any that
+        time out. Raises ConnectionError if the socket goes away first."""
+        ws = self.ws
+        deadline = time.monotonic() + timeout
+        try:
+            while any(i not in self.replies for i in ids):
+                if self.ws is not ws:
+                    raise ConnectionError('CDP connection closed')
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return [self.replies.get(i) for i in ids]
+        finally:
+            for i in ids:
+                self.pending.discard(i)
+                self.replies.pop(i, None)
+
+    def send(self, method, params=None, timeout=10):
+        """Send a command and wait for its reply. Returns the reply, or {'error': ...}."""
+        with self.cond:
+            for attempt in range(2):
+                ws = self.ws
+                try:
+                    self._connect()
+                    ws = self.ws
+                    data = self._collect(self._write([(method, params)]), timeout)[0]
+                    if data is None:
+                        return {'error': f'{method} timed out after {timeout}s'}
+                    return data
+                except Exception as e:
+                    self._close(ws)
+                    dropped = isinstance(e, ConnectionError) or (
+                        websocket is not None and isinstance(e, websocket.WebSocketConnectionClosedException))
+                    if dropped and not attempt:
+                        # Chrome dropped the socket (tab reload, sleep) - reconnect once
+                        continue
+                    log(f"CDP send error: {e}")
+                    _mark_chrome_alive(False)
+                    return {'error': str(e)}
+
+    def send_many(self, commands, timeout=10):
+        """Pipeline several (method, params) commands: write them all, then collect
+        the replies. Returns the replies in order; failures are {'error': ...}."""
+        with self.cond:
+            ws = self.ws
+            try:
+                self._connect()
+                ws = self.ws
+                replies = self._collect(self._write(commands), timeout)
+                return [reply or {'error': f'timed out after {timeout}s'} for reply in replies]
+            except Exception as e:
+                self._close(ws)
+                log(f"CDP send error: {e}")
+                _mark_chrome_alive(False)
+                return [{'error': str(e)} for _ in commands]
+
+    def enable(self, domain):
+        """Enable a CDP domain (Page, Network, ...) once per connection."""
+        if domain in self.enabled and self.ws is not None and self.ws.connected:
+            return {}
+        result = self.send(f'{domain}.enable')
+        if 'error' not in result:
+            self.enabled.add(domain)
+        return result
 
-    except Exception as e:
-        log(f"CDP send error: {e}")
-        return {'error': str(e)}
+    def install(self, source):
+        """Run a setup script in the current document and every document loaded
+        after it. Done once per connection."""
+        if source in self.installed and self.ws is not None and self.ws.connected:
+            return {}
+        result = self.send('Page.addScriptToEvaluateOnNewDocument', {'source': source})
+        if 'error' not in result:
+            result = self.send('Runtime.evaluate', {'expression': source})
+        if 'error' not in result:
+            self.installed.add(source)
+        return result
+
+    def _evaluate(self, source):
+        """Plain Runtime.evaluate, for when a script can't be compiled"""
+        return self.send('Runtime.evaluate', {
+            'expression': source,
+            'returnByValue': True,
+            'awaitPromise': True
+        })
 
-def cdp_execute_script(ws_url, script):
+    def run_script(self, source, source_url):
+        """Run a script compiled once per page with Runtime.compileScript. A stale
+        id (the page navigated) triggers one recompile. Compiling needs the Runtime
+        domain (re-enabled after a reconnect); if it fails anyway the script is
+        evaluated directly."""
+        for attempt in range(2):
+            self.enable('Runtime')
+            script_id = self.scripts.get(source)
+            if script_id is None:
+                compiled = self.send('Runtime.compileScript', {
+                    'expression': source,
+                    'sourceURL': source_url,
+                    'persistScript': True
+                })
+                if 'exceptionDetails' in compiled.get('result', {}):
+                    return compiled
+                if 'error' in compiled:
+                    log(f"CDP compile error ({source_url}), evaluating instead: {compiled['error']}")
+                    return self._evaluate(source)
+                script_id = self.scripts[source] = compiled['result']['scriptId']
+            response = self.send('Runtime.runScript', {
+                'scriptId': script_id,
+                'returnByValue': True,
+                'awaitPromise': True
+            })
+            if 'error' not in response:
+                return response
+            self.scripts.pop(source, None)
+        return response
+
+    def run_scripts(self, sources):
+        """run_script for several (source, source_url) pairs: new scripts are
+        compiled in one pipelined batch and all of them run in a second."""
+        self.enable('Runtime')
+        missing = {source: url for source, url in sources if source not in self.scripts}
+        failed = {}
+        if missing:
+            replies = self.send_many([
+                ('Runtime.compileScript', {'expression': source, 'sourceURL': url, 'persistScript': True})
+                for source, url in missing.items()
+            ])
+            for source, compiled in zip(missing, replies):
+                if 'exceptionDetails' in compiled.get('result', {}):
+                    failed[source] = compiled
+                elif 'error' in compiled:
+                    log(f"CDP compile error ({missing[source]}), evaluating instead: {compiled['error']}")
+                    failed[source] = self._evaluate(source)
+                else:
+                    self.scripts[source] = compiled['result']['scriptId']
+        ready = [source for source, _ in sources if source in self.scripts]
+        replies = self.send_many([
+            ('Runtime.runScript', {'scriptId': self.scripts[source], 'returnByValue': True, 'awaitPromise': True})
+            for source in ready
+        ]) if ready else []
+        runs = dict(zip(ready, replies))
+        results = []
+        for source, url in sources:
+            response = failed.get(source) or runs[source]
+            if 'error' in response and source not in failed:
+                # Stale id (the page navigated): recompile this one
+                self.scripts.pop(source, None)
+                response = self.run_script(source, url)
+            results.append(response)
+        return results
+
+    def discard_events(self, method):
+        with self.lock:
+            kept = [e for e in self.events if e.get('method') != method]
+            self.events.clear()
+            self.events.extend(kept)
+
+    def wait_for_event(self, method, timeout=10):
+        """Return the next `method` event (buffered or new), or None on timeout."""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            ws = self.ws
+            try:
+                self._connect()
+            except Exception as e:
+                self._close(ws)
+                log(f"CDP event wait error: {e}")
+                return None
+            while True:
+                for i, event in enumerate(self.events):
+                    if event.get('method') == method:
+                        del self.events[i]
+                        return event
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self.ws is None:
+                    return None
+                self.cond.wait(remaining)
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+_cdp_sessions = {}
+_cdp_sessions_lock = threading.Lock()
+
+def cdp_session(ws_url):
+    """Shared CDPSession for a target, created on first use"""
+    with _cdp_sessions_lock:
+        session = _cdp_sessions.get(ws_url)
+        if session is None:
+            session = _cdp_sessions[ws_url] = CDPSession(ws_url)
+        return session
+
+def cdp_close(ws_url):
+    """Close and forget a target's session (e.g. once its tab is gone)"""
+    with _cdp_sessions_lock:
+        session = _cdp_sessions.pop(ws_url, None)
+    if session is not None:
+        session.close()
+
+@atexit.register
+def _close_cdp_sessions():
+    for session in list(_cdp_sessions.values()):
+        session.close()
+
+def cdp_send(ws_url, method, params=None, timeout=10):
+    """Send a CDP command over the target's persistent session"""
+    return cdp_session(ws_url).send(method, params, timeout)
+
+def cdp_send_many(ws_url, commands):
+    """Send (method, params) commands back to back over the target's session"""
+    return cdp_session(ws_url).send_many(commands)
+
+def cdp_execute_script(ws_url, script, timeout=10):
     """Execute JavaScript in the page context"""
     return cdp_send(ws_url, 'Runtime.evaluate', {
         'expression': script,
         'returnByValue': True,
         'awaitPromise': True
-    })
+    }, timeout)
+
+def _cdp_result_value(response):
+    """(value, error) from a Runtime.evaluate / Runtime.runScript reply"""
+    if 'error' in response:
+        return None, str(response['error'])
+    result = response.get('result', {})
+    if 'exceptionDetails' in result:
+        details = result['exceptionDetails']
+        return None, details.get('exception', {}).get('description') or details.get('text', 'Script error')
+    return result.get('result', {}).get('value'), None
+
+def _eval_value(resp, default=None):
+    """_cdp_result_value for callers that want just the value: errors and page
+    exceptions are logged, and the value falls back to default ({} unless given)"""
+    value, error = _cdp_result_value(resp or {})
+    if error:
+        log(f"CDP script error: {error}")
+    if value is None:
+        return default if default is not None else {}
+    return value
+
+def _uber_page_session(url_contains):
+    """Session for the Uber tab with the page-side query cache installed, or None"""
+    ws_url = cdp_page_ws_url(url_contains)
+    if not ws_url:
+        return None
+    session = cdp_session(ws_url)
+    session.install(_UBER_QUERY_CACHE_JS)
+    return session
+
+def cdp_eval_in_page(script, url_contains='uber.com', timeout=10):
+    """Evaluate JavaScript in the Uber tab (or the first tab). Returns (value, error)."""
+    session = _uber_page_session(url_contains)
+    if not session:
+        return None, 'Chrome debug mode not running or no tab available'
+    return _cdp_result_value(cdp_execute_script(session.ws_url, script, timeout))
+
+def cdp_run_in_page(script, source_url, url_contains='uber.com'):
+    """Like cdp_eval_in_page, but the script is compiled once and re-run by id"""
+    session = _uber_page_session(url_contains)
+    if not session:
+        return None, 'Chrome debug mode not running or no tab available'
+    return _cdp_result_value(session.run_script(script, source_url))
 
 def cdp_navigate(ws_url, url):
     """Navigate to a URL"""
     return cdp_send(ws_url, 'Page.navigate', {'url': url})
 
+def _cdp_navigate_and_wait(ws_url, url, timeout):
+    """Navigate and block until Page.loadEventFired or timeout. Returns (loaded, error),
+    where error is the Page.navigate failure (protocol error or errorText), if any."""
+    session = cdp_session(ws_url)
+    session.enable('Page')
+    # Drop load events left over from earlier navigations
+    session.discard_events('Page.loadEventFired')
+    result = session.send('Page.navigate', {'url': url})
+    error = result.get('error') or result.get('result', {}).get('errorText')
+    if error:
+        log(f"CDP navigate error: {error}")
+        return False, str(error)
+    return session.wait_for_event('Page.loadEventFired', timeout) is not None, None
+
+def cdp_navigate_and_wait(ws_url, url, timeout=10.0):
+    """Navigate and block until Page.loadEventFired or timeout. Returns True if the page loaded."""
+    return _cdp_navigate_and_wait(ws_url, url, timeout)[0]
+
+def _cdp_node_center(session, node):
+    """Scroll a node into view and return the centre of its content box, or None"""
+    replies = session.send_many([
+        ('DOM.scrollIntoViewIfNeeded', node),
+        ('DOM.getBoxModel', node),
+    ])
+    quad = replies[1].get('result', {}).get('model', {}).get('content')
+    if not quad:
+        return None
+    return sum(quad[0::2]) / 4, sum(quad[1::2]) / 4
+
+def _cdp_query_selector(session, selector):
+    """DOM.querySelector against the document root, whose nodeId is fetched once per
+    document. Returns (nodeId or 0, error). No page JavaScript runs."""
+    for attempt in range(2):
+        if session.root_node is None:
+            session.enable('DOM')
+            doc = session.send('DOM.getDocument', {'depth': 0})
+            if 'error' in doc:
+                return 0, str(doc['error'])
+            session.root_node = doc['result']['root']['nodeId']
+        found = session.send('DOM.querySelector', {'nodeId': session.root_node, 'selector': selector})
+        if 'error' not in found:
+            return found['result'].get('nodeId', 0), None
+        # Root id went stale without an event we saw - refetch once
+        session.root_node = None
+    return 0, str(found['error'])
+
+def cdp_click_selector(ws_url, selector):
+    """Click the element matching selector with real mouse events. The node's
+    backendNodeId is cached per selector until the session sees a new document."""
+    session = cdp_session(ws_url)
+    center = None
+    backend_id = session.nodes.get(selector)
+    if backend_id:
+        center = _cdp_node_center(session, {'backendNodeId': backend_id})
+    if center is None:
+        session.nodes.pop(selector, None)
+        node_id, error = _cdp_query_selector(session, selector)
+        if error:
+            return {'success': False, 'error': error}
+        if not node_id:
+            return {'success': False, 'error': f'Element not found: {selector}'}
+        described = session.send('DOM.describeNode', {'nodeId': node_id})
+        backend_id = described.get('result', {}).get('node', {}).get('backendNodeId')
+        if not backend_id:
+            return {'success': False, 'error': f'Element not found: {selector}'}
+        center = _cdp_node_center(session, {'backendNodeId': backend_id})
+        if center is None:
+            return {'success': False, 'error': f'Element has no box: {selector}', 'no_box': True}
+        session.nodes[selector] = backend_id
+
+    x, y = center
+    click = {'x': x, 'y': y, 'button': 'left', 'clickCount': 1}
+    replies = session.send_many([
+        ('Input.dispatchMouseEvent', dict(click, type='mousePressed')),
+        ('Input.dispatchMouseEvent', dict(click, type='mouseReleased')),
+    ])
+    errors = [str(r['error']) for r in replies if 'error' in r]
+    if errors:
+        return {'success': False, 'error': errors[0]}
+    return {'success': True, 'clicked': selector, 'x': x, 'y': y}
+
+# Inserts text at the caret of the focused input/textarea through the native value
+# setter, so React-controlled fields see the change. %s is the text as a JSON string.
+_INSERT_TEXT_JS = '''
+(function(text) {
+    var el = document.activeElement;
+    if (!el || (el.tagName !== 'INPUT' && el.tagName !== 'TEXTAREA')) return false;
+    var value = el.value || '';
+    var start = el.selectionStart == null ? value.length : el.selectionStart;
+    var end = el.selectionEnd == null ? value.length : el.selectionEnd;
+    var setter = Object.getOwnPropertyDescriptor(Object.getPrototypeOf(el), 'value').set;
+    setter.call(el, value.slice(0, start) + text + value.slice(end));
+    el.dispatchEvent(new Event('input', {bubbles: true}));
+    el.dispatchEvent(new Event('change', {bubbles: true}));
+    return true;
+})(%s);
+'''
+
 def cdp_type_text(ws_url, text):
-    """Type text character by character"""
+    """Type text into the focused field. Inputs and textareas get the whole string in
+    one evaluate; anything else (contenteditable etc.) gets real key events."""
+    response = cdp_execute_script(ws_url, _INSERT_TEXT_JS % json.dumps(text))
+    if _eval_value(response) is True:
+        return {'success': True}
+
+    commands = []
     for char in text:
-        cdp_send(ws_url, 'Input.dispatchKeyEvent', {
-            'type': 'keyDown',
-            'text': char
-        })
-        cdp_send(ws_url, 'Input.dispatchKeyEvent', {
-            'type': 'keyUp',
-            'text': char
-        })
+        commands.append(('Input.dispatchKeyEvent', {'type': 'keyDown', 'text': char}))
+        commands.append(('Input.dispatchKeyEvent', {'type': 'keyUp', 'text': char}))
+    cdp_send_many(ws_url, commands)
+    return {'success': True}
+
+_KEY_CODES = {
+    'Enter': {'key': 'Enter', 'code': 'Enter', 'keyCode': 13},
+    'Tab': {'key': 'Tab', 'code': 'Tab', 'keyCode': 9},
+    'ArrowDown': {'key': 'ArrowDown', 'code': 'ArrowDown', 'keyCode': 40},
+    'ArrowUp': {'key': 'ArrowUp', 'code': 'ArrowUp', 'keyCode': 38},
+    'Escape': {'key': 'Escape', 'code': 'Escape', 'keyCode': 27},
+}
+
+def cdp_press_keys(ws_url, *keys):
+    """Press keys in order. All the key events go out as one pipelined batch; Chrome
+    still delivers them one after another, so e.g. ArrowDown + Enter picks a suggestion."""
+    commands = []
+    for key in keys:
+        kc = _KEY_CODES.get(key, {'key': key, 'code': key, 'keyCode': 0})
+        params = {
+            'key': kc['key'],
+            'code': kc['code'],
+            'windowsVirtualKeyCode': kc['keyCode'],
+            'nativeVirtualKeyCode': kc['keyCode']
+        }
+        commands.append(('Input.dispatchKeyEvent', dict(params, type='keyDown')))
+        commands.append(('Input.dispatchKeyEvent', dict(params, type='keyUp')))
+    cdp_send_many(ws_url, commands)
     return {'success': True}
 
 def cdp_press_key(ws_url, key):
     """Press a special key (Enter, Tab, ArrowDown, etc.)"""
-    key_codes = {
-        'Enter': {'key': 'Enter', 'code': 'Enter', 'keyCode': 13},
-        'Tab': {'key': 'Tab', 'code': 'Tab', 'keyCode': 9},
-        'ArrowDown': {'key': 'ArrowDown', 'code': 'ArrowDown', 'keyCode': 40},
-        'ArrowUp': {'key': 'ArrowUp', 'code': 'ArrowUp', 'keyCode': 38},
-        'Escape': {'key': 'Escape', 'code': 'Escape', 'keyCode': 27},
-    }
-
-    kc = key_codes.get(key, {'key': key, 'code': key, 'keyCode': 0})
-
-    cdp_send(ws_url, 'Input.dispatchKeyEvent', {
-        'type': 'keyDown',
-        'key': kc['key'],
-        'code': kc['code'],
-        'windowsVirtualKeyCode': kc['keyCode'],
-        'nativeVirtualKeyCode': kc['keyCode']
-    })
-    cdp_send(ws_url, 'Input.dispatchKeyEvent', {
-        'type': 'keyUp',
-        'key': kc['key'],
-        'code': kc['code'],
-        'windowsVirtualKeyCode': kc['keyCode'],
-        'nativeVirtualKeyCode': kc['keyCode']
-    })
-    return {'success': True}
+    return cdp_press_keys(ws_url, key)
 
 def cdp_click_element(ws_url, selector):
-    """Click an element by selector"""
-    # First get element position
-    script = f'''
-    (function() {{
-        var el = document.querySelector('{selector}');
-        if (!el) return null;
-        var rect = el.getBoundingClientRect();
-        return {{
-            x: rect.x + rect.width / 2,
-            y: rect.y + rect.height / 2,
-            found: true
-        }};
-    }})();
-    '''
-    result = cdp_execute_script(ws_url, script)
-
-    if result and result.get('result', {}).get('result', {}).get('value'):
-        pos = result['result']['result']['value']
-        # Dispatch mouse click
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mousePressed',
-            'x': pos['x'],
-            'y': pos['y'],
-            'button': 'left',
-            'clickCount': 1
-        })
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mouseReleased',
-            'x': pos['x'],
-            'y': pos['y'],
-            'button': 'left',
-            'clickCount': 1
-        })
+    """Click an element by selector. The lookup and el.click() share one
+    Runtime.evaluate; use cdp_click_selector when real mouse events are needed."""
+    clicked = cdp_js_click(ws_url, 'document.querySelector(%s)' % json.dumps(selector))
+    if clicked.get('clicked'):
         return {'success': True, 'clicked': selector}
-
     return {'success': False, 'error': f'Element not found: {selector}'}
 
 
 # Uber ordering using Chrome DevTools Protocol
-def order_uber(pickup_lat, pickup_lon, pickup_address, destination, ride_type='UberX', num_passengers=1):
-    """
-    Automated Uber ordering using Chrome DevTools Protocol (CDP).
-    Smart approach: analyzes page, uses process of elimination if needed.
-    num_passengers: if > 4, will select UberXL instead of UberX
-    """
-    import time
 
-    # Auto-select ride type based on passenger count
-    if num_passengers > 4:
-        ride_type = 'UberXL'
-    elif ride_type == 'UberX' and num_passengers <= 4:
-        ride_type = 'UberX'
+# Scrolls an element into view and clicks it with el.click(), returning where it was.
+# The click waits two animation frames (capped at 100ms - rAF stalls in background
+# tabs) so layout has settled after the scroll.
+# %s is a JS expression that evaluates to the element (or null).
+_JS_CLICK_JS = '''
+(async function() {
+    var el = %s;
+    if (!el) return {clicked: false};
+    el.scrollIntoView({behavior: 'instant', block: 'center'});
+    await new Promise(function(resolve) {
+        requestAnimationFrame(function() { requestAnimationFrame(resolve); });
+        setTimeout(resolve, 100);
+    });
+    var rect = el.getBoundingClientRect();
+    el.click();
+    return {
+        clicked: true,
+        text: (el.textContent || '').trim().substring(0, 50),
+        x: rect.left + rect.width / 2,
+        y: rect.top + rect.height / 2
+    };
+})();
+'''
 
-    log(f"Starting Uber order via CDP: from ({pickup_lat}, {pickup_lon}) to {destination}, {num_passengers} passengers, ride: {ride_type}")
-    pickup_display = pickup_address if pickup_address else f"{pickup_lat}, {pickup_lon}"
+def cdp_js_click(ws_url, find_js):
+    """Find an element with a JS expression and click it, all in one Runtime.evaluate"""
+    value, error = _cdp_result_value(cdp_execute_script(ws_url, _JS_CLICK_JS % find_js))
+    if error:
+        log(f"JS click error: {error}")
+    return value or {'clicked': False}
+
+# Resolves once the DOM has gone quietMs without a mutation, or after timeoutMs.
+# With requireChange the quiet timer only starts after the first mutation, for
+# waits where something is expected to happen (a click, a key press).
+# Arguments: quietMs, timeoutMs, requireChange.
+_DOM_QUIET_JS = '''
+(function(quietMs, timeoutMs, requireChange) {
+    return new Promise(function(resolve) {
+        var start = Date.now(), changed = false, quiet = null;
+        function done() {
+            observer.disconnect();
+            clearTimeout(quiet);
+            clearTimeout(cap);
+            resolve({changed: changed, waitedMs: Date.now() - start});
+        }
+        var observer = new MutationObserver(function() {
+            changed = true;
+            clearTimeout(quiet);
+            quiet = setTimeout(done, quietMs);
+        });
+        observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true, characterData: true});
+        if (!requireChange) quiet = setTimeout(done, quietMs);
+        var cap = setTimeout(done, timeoutMs);
+    });
+})(%d, %d, %s);
+'''
 
-    # Step 1: Check CDP connection
-    targets = cdp_get_targets()
-    if targets is None:
-        return {'success': False, 'error': 'Chrome debug mode not running. Start agent.py to auto-launch Chrome.'}
+# Resolves true once the predicate holds (re-checked on every DOM mutation), or with
+# its final value after timeoutMs. Arguments: predicate (JS expression), timeoutMs.
+_WAIT_FOR_JS = '''
+(function(check, timeoutMs) {
+    if (check()) return Promise.resolve(true);
+    return new Promise(function(resolve) {
+        var observer = new MutationObserver(function() {
+            if (check()) {
+                observer.disconnect();
+                clearTimeout(cap);
+                resolve(true);
+            }
+        });
+        observer.observe(document.documentElement, {childList: true, subtree: true, characterData: true, attributes: true});
+        var cap = setTimeout(function() {
+            observer.disconnect();
+            resolve(!!check());
+        }, timeoutMs);
+    });
+})(function() { try { return !!(%s); } catch (e) { return false; } }, %d);
+'''
 
-    ws_url = None
-    for target in targets:
-        if target.get('type') == 'page':
-            ws_url = target.get('webSocketDebuggerUrl')
-            break
+def cdp_eval_batch(ws_url, scripts, timeout=15):
+    """Run several scripts one after another inside a single Runtime.evaluate, awaiting
+    any that return a promise (e.g. _dom_quiet_js waits). scripts maps name -> JS
+    expression; returns name -> value. A script that throws is logged and maps to
+    None without losing the others; {} only if the whole batch failed."""
+    body = ''.join(
+        'try { out[%s] = await (%s); } catch (e) { out[%s] = null; errors[%s] = String(e && e.stack || e); }\n'
+        % (key, js.strip().rstrip(';'), key, key)
+        for key, js in ((json.dumps(name), js) for name, js in scripts.items()))
+    batch = ('(async function() {\nvar out = {}, errors = {};\n%s'
+             'return {out: out, errors: errors};\n})()' % body)
+    value, error = _cdp_result_value(cdp_execute_script(ws_url, batch, timeout))
+    if error:
+        log(f"CDP batch error ({', '.join(scripts)}): {error}")
+        return {}
+    for name, script_error in (value or {}).get('errors', {}).items():
+        log(f"CDP batch error ({name}): {script_error}")
+    return (value or {}).get('out') or {}
+
+def cdp_run_script(ws_url, script, source_url):
+    """Run a static script compiled once per page; returns the raw reply"""
+    return cdp_session(ws_url).run_script(script, source_url)
+
+def cdp_run_scripts(ws_url, scripts, errors=None):
+    """Run several static scripts in pipelined batches, each compiled once per page.
+    scripts maps name -> JS (name doubles as the sourceURL); returns name -> value.
+    Failures are logged, and recorded as name -> message in errors if given."""
+    names = list(scripts)
+    replies = cdp_session(ws_url).run_scripts([(scripts[name], f'{name}.js') for name in names])
+    values = {}
+    for name, reply in zip(names, replies):
+        value, error = _cdp_result_value(reply)
+        if error:
+            log(f"CDP script error ({name}): {error}")
+            if errors is not None:
+                errors[name] = error
+        values[name] = value
+    return values
+
+def _dom_quiet_js(quiet, timeout, require_change=False):
+    return _DOM_QUIET_JS % (int(quiet * 1000), int(timeout * 1000), 'true' if require_change else 'false')
+
+def _cdp_await_page(ws_url, build, timeout):
+    """Evaluate the waiting script build(timeout, reloaded) and return its value. If the
+    document is replaced mid-wait, wait for the new one to load and evaluate again with
+    whatever time is left."""
+    deadline = time.monotonic() + timeout
+    session = cdp_session(ws_url)
+    session.enable('Page')
+    session.discard_events('Page.loadEventFired')
+    value, error = _cdp_result_value(cdp_execute_script(ws_url, build(timeout, False), timeout + 5))
+    if not error:
+        return value
+    # Usually "execution context was destroyed": the click or key press navigated
+    remaining = deadline - time.monotonic()
+    if remaining <= 0 or session.wait_for_event('Page.loadEventFired', remaining) is None:
+        return None
+    remaining = max(deadline - time.monotonic(), 0)
+    value, _ = _cdp_result_value(cdp_execute_script(ws_url, build(remaining, True), remaining + 5))
+    return value
+
+def cdp_wait_for_dom_quiet(ws_url, quiet=0.2, timeout=2.0, require_change=False):
+    """Block until the page's DOM settles (no mutations for `quiet` seconds), capped at timeout"""
+    # A fresh document is already a change
+    value = _cdp_await_page(ws_url, lambda t, reloaded: _dom_quiet_js(quiet, t, require_change and not reloaded), timeout)
+    return value or {}
+
+def cdp_wait_for(ws_url, predicate, timeout=2.0):
+    """Block until the JS expression `predicate` is truthy on the page (re-checked on
+    every DOM mutation), capped at timeout. Returns False on timeout."""
+    return bool(_cdp_await_page(ws_url, lambda t, reloaded: _WAIT_FOR_JS % (predicate, int(t * 1000)), timeout))
+
+def cdp_wait_for_selector(ws_url, selector, timeout=2.0):
+    """Block until selector matches something on the page. Returns False on timeout."""
+    return cdp_wait_for(ws_url, 'document.querySelector(%s)' % json.dumps(selector), timeout)
+
+# Suggestion rows in Uber's location pickers
+_UBER_SUGGESTIONS = '[data-testid*="autocomplete"] li, [class*="autocomplete"] li, [role="listbox"] [role="option"], [role="option"]'
+
+# Uber Eats' item customization modal
+_EATS_ITEM_MODAL = '[role="dialog"], [data-testid*="modal"], [class*="modal"]'
+
+# order_uber's static page scripts. They go through cdp_run_script(s), so each is
+# compiled once per page and re-run by script id.
+# order_uber: login check plus the pickup/dropoff fields on the page
+_UBER_ANALYZE_JS = '''
+(function() {
+    var result = {
+        url: window.location.href,
+        needsLogin: false,
+        pickupField: null,
+        dropoffField: null,
+        hasRideOptions: false,
+        hasDestination: false,
+        pageState: 'unknown'
+    };
+
+    var bodyText = window.__uberBodyText();
+
+    // Check if logged in
+    if (bodyText.includes('Sign in') || bodyText.includes('Log in') || bodyText.includes('Continue with')) {
+        result.needsLogin = true;
+        result.pageState = 'login_required';
+        return result;
+    }
 
-    if not ws_url:
-        return {'success': False, 'error': 'No Chrome tab available'}
+    // Find all clickable location fields
+    var allTestIds = window.__uberQuery('[data-testid]');
+    var locationFields = [];
+
+    allTestIds.forEach(function(el) {
+        var testId = el.getAttribute('data-testid') || '';
+        var text = (el.textContent || '').substring(0, 100);
+
+        // Look for pickup/dropoff related elements
+        if (testId.includes('pickup') || testId.includes('drop') || testId.includes('pudo') || testId.includes('enhancer')) {
+            locationFields.push({
+                testId: testId,
+                text: text,
+                isPickup: text.toLowerCase().includes('pickup') || testId.includes('pickup'),
+                isDropoff: text.toLowerCase().includes('dropoff') || text.toLowerCase().includes('drop') || testId.includes('drop')
+            });
+        }
+    });
 
-    log(f"Connected to Chrome tab: {ws_url}")
+    result.locationFields = locationFields;
 
-    # Step 2: Navigate to Uber WITH pickup coordinates in URL
-    # This pre-sets the pickup location so user doesn't need to allow location access
-    pickup_data = json.dumps({"latitude": pickup_lat, "longitude": pickup_lon})
-    uber_url = f"https://m.uber.com/go/home?pickup={urllib.parse.quote(pickup_data)}"
-    log(f"Navigating to: {uber_url}")
-    cdp_navigate(ws_url, uber_url)
-    time.sleep(4)
+    // Identify pickup vs dropoff by process of elimination
+    // Usually: first field = pickup (has address), second field = dropoff (empty or says "Dropoff")
+    if (locationFields.length >= 2) {
+        for (var i = 0; i < locationFields.length; i++) {
+            var f = locationFields[i];
+            if (f.isDropoff || f.text.includes('Dropoff') || f.text.includes('Where')) {
+                result.dropoffField = f.testId;
+                break;
+            }
+        }
+        // If still not found, second enhancer-container is usually dropoff
+        if (!result.dropoffField) {
+            for (var j = 0; j < locationFields.length; j++) {
+                if (locationFields[j].testId.includes('drop0') || locationFields[j].testId.includes('enhancer-container-drop')) {
+                    result.dropoffField = locationFields[j].testId;
+                    break;
+                }
+            }
+        }
+    }
 
-    # Step 3: Smart page analysis - understand what's on screen
-    analyze_script = '''
-    (function() {
-        var result = {
-            url: window.location.href,
-            needsLogin: false,
-            pickupField: null,
-            dropoffField: null,
-            hasRideOptions: false,
-            pageState: 'unknown'
-        };
+    // Check if ride options are showing
+    var lowerText = bodyText.toLowerCase();
+    if (lowerText.includes('uberx') || lowerText.includes('comfort') || lowerText.includes('black')) {
+        result.hasRideOptions = true;
+        result.pageState = 'ride_selection';
+    } else if (result.dropoffField) {
+        result.pageState = 'ready_for_destination';
+    }
 
-        var bodyText = document.body.innerText;
+    // Text already in the dropoff input (typing inserts at the caret, so it would be merged)
+    var dropoffInput = window.__uberQuery('[data-testid="enhancer-container-drop0"] input')[0];
+    result.hasDestination = !!(dropoffInput && dropoffInput.value);
 
-        // Check if logged in
-        if (bodyText.includes('Sign in') || bodyText.includes('Log in') || bodyText.includes('Continue with')) {
-            result.needsLogin = true;
-            result.pageState = 'login_required';
-            return result;
-        }
+    result.bodySnippet = bodyText.substring(0, 400);
+    return result;
+})();
+'''
 
-        // Find all clickable location fields
-        var allTestIds = document.querySelectorAll('[data-testid]');
-        var locationFields = [];
-
-        allTestIds.forEach(function(el) {
-            var testId = el.getAttribute('data-testid') || '';
-            var text = (el.textContent || '').substring(0, 100);
-
-            // Look for pickup/dropoff related elements
-            if (testId.includes('pickup') || testId.includes('drop') || testId.includes('pudo') || testId.includes('enhancer')) {
-                locationFields.push({
-                    testId: testId,
-                    text: text,
-                    isPickup: text.toLowerCase().includes('pickup') || testId.includes('pickup'),
-                    isDropoff: text.toLowerCase().includes('dropoff') || text.toLowerCase().includes('drop') || testId.includes('drop')
-                });
-            }
-        });
+# order_uber: whether the pickup from the URL took
+_UBER_PICKUP_CHECK_JS = '''
+(function() {
+    var pickup = window.__uberQuery('[data-testid="enhancer-container-pickup"]')[0];
+    if (!pickup) return {hasPickup: false};
+    var text = pickup.textContent.toLowerCase();
+    // Check if pickup is still empty/default
+    var isEmpty = text.includes('pickup location') && !text.includes(',');
+    return {hasPickup: !isEmpty, pickupText: pickup.textContent.substring(0, 100)};
+})();
+'''
 
-        result.locationFields = locationFields;
+# order_uber: centres of the pickup and dropoff fields
+_UBER_FIELD_COORDS_JS = '''
+(function() {
+    var result = {pickupCoords: null, dropoffCoords: null};
 
-        // Identify pickup vs dropoff by process of elimination
-        // Usually: first field = pickup (has address), second field = dropoff (empty or says "Dropoff")
-        if (locationFields.length >= 2) {
-            for (var i = 0; i < locationFields.length; i++) {
-                var f = locationFields[i];
-                if (f.isDropoff || f.text.includes('Dropoff') || f.text.includes('Where')) {
-                    result.dropoffField = f.testId;
-                    break;
+    // Find pickup element
+    var pickup = window.__uberQuery('[data-testid="enhancer-container-pickup"]')[0];
+    if (pickup) {
+        var pr = pickup.getBoundingClientRect();
+        result.pickupCoords = {x: pr.left + pr.width/2, y: pr.top + pr.height/2, bottom: pr.bottom};
+    }
+
+    // Find dropoff element - it should be BELOW the pickup
+    var dropoff = window.__uberQuery('[data-testid="enhancer-container-drop0"]')[0];
+    if (dropoff) {
+        var dr = dropoff.getBoundingClientRect();
+        result.dropoffCoords = {x: dr.left + dr.width/2, y: dr.top + dr.height/2, top: dr.top};
+    }
+
+    // Sanity check: dropoff should be below pickup
+    if (result.pickupCoords && result.dropoffCoords) {
+        result.dropoffIsBelowPickup = result.dropoffCoords.top > result.pickupCoords.bottom - 10;
+    }
+
+    return result;
+})();
+'''
+
+# order_uber: which location field has focus
+_UBER_FIELD_CHECK_JS = '''
+(function() {
+    // Check what field is active by looking at the page state
+    var bodyText = window.__uberBodyText();
+
+    // Look for indication of which field is being edited
+    var result = {
+        isEditingDropoff: false,
+        isEditingPickup: false,
+        activeFieldHint: ''
+    };
+
+    // If we see "Where to" or "Enter destination" prominently, we're editing dropoff
+    // If we see "Enter pickup" or "Set pickup", we're editing pickup
+    if (bodyText.includes('Where to') || bodyText.includes('Enter destination') ||
+        bodyText.includes('Dropoff') && !bodyText.includes('Dropoff location')) {
+        result.isEditingDropoff = true;
+        result.activeFieldHint = 'dropoff';
+    }
+    if (bodyText.includes('Enter pickup') || bodyText.includes('Set pickup location')) {
+        result.isEditingPickup = true;
+        result.activeFieldHint = 'pickup';
+    }
+
+    // Also check for any visible input placeholder
+    var activeEl = document.activeElement;
+    if (activeEl && activeEl.tagName === 'INPUT') {
+        var ph = (activeEl.placeholder || '').toLowerCase();
+        result.inputPlaceholder = activeEl.placeholder;
+        if (ph.includes('where') || ph.includes('destination') || ph.includes('drop')) {
+            result.isEditingDropoff = true;
+        } else if (ph.includes('pickup') || ph.includes('from')) {
+            result.isEditingPickup = true;
+        }
+    }
+
+    result.snippet = bodyText.substring(0, 200);
+    return result;
+})();
+'''
+
+# order_uber: airport terminal/gate picker and its Next button.
+# Matched options are kept on window.__uberTerminals for the click.
+_UBER_TERMINAL_CHECK_JS = '''
+(function() {
+    var bodyText = window.__uberBodyText();
+    var result = {
+        needsTerminalSelection: false,
+        terminals: [],
+        hasNextButton: false
+    };
+
+    // Check if we're on a terminal selection screen
+    if (bodyText.includes('Terminal') || bodyText.includes('terminal') ||
+        bodyText.includes('Gate') || bodyText.includes('Concourse')) {
+
+        // Look for terminal options (usually radio buttons or clickable divs).
+        // Matches are kept on window so the click can reuse them.
+        var matched = window.__uberTerminals = [];
+        var options = window.__uberQuery('[role="radio"], [role="option"], [data-testid*="terminal"], [data-testid*="option"]');
+        options.forEach(function(opt) {
+            var text = (opt.textContent || '').trim();
+            if (text && text.length < 50) {
+                var rect = opt.getBoundingClientRect();
+                if (rect.width > 0 && rect.height > 0) {
+                    matched.push(opt);
+                    result.terminals.push({
+                        text: text,
+                        x: rect.left + rect.width/2,
+                        y: rect.top + rect.height/2
+                    });
                 }
             }
-            // If still not found, second enhancer-container is usually dropoff
-            if (!result.dropoffField) {
-                for (var j = 0; j < locationFields.length; j++) {
-                    if (locationFields[j].testId.includes('drop0') || locationFields[j].testId.includes('enhancer-container-drop')) {
-                        result.dropoffField = locationFields[j].testId;
-                        break;
+        });
+
+        // Also look for list items that might be terminals
+        if (result.terminals.length === 0) {
+            var listItems = window.__uberQuery('li, [role="listitem"]');
+            listItems.forEach(function(li) {
+                var text = (li.textContent || '').trim();
+                if (text.includes('Terminal') || text.includes('Concourse') || text.includes('Gate')) {
+                    var rect = li.getBoundingClientRect();
+                    if (rect.width > 0 && rect.height > 0) {
+                        matched.push(li);
+                        result.terminals.push({
+                            text: text.substring(0, 40),
+                            x: rect.left + rect.width/2,
+                            y: rect.top + rect.height/2
+                        });
                     }
                 }
-            }
+            });
+        }
+
+        if (result.terminals.length > 0) {
+            result.needsTerminalSelection = true;
         }
+    }
+
+    // Check for Next button
+    var next = window.__uberButton(['next', 'continue', 'confirm'], true);
+    if (next) {
+        var rect = next.getBoundingClientRect();
+        result.hasNextButton = true;
+        result.nextButtonCoords = {x: rect.left + rect.width/2, y: rect.top + rect.height/2};
+    }
+
+    result.bodySnippet = bodyText.substring(0, 400);
+    return result;
+})();
+'''
+
+# order_uber: click Next/Continue on the terminal picker
+_UBER_NEXT_BUTTON_JS = '''
+(function() {
+    var btn = window.__uberButton(['next', 'continue', 'confirm'], true);
+    if (!btn) return {clicked: false};
+    // Use direct JS click - more reliable than CDP mouse events for off-screen elements
+    btn.click();
+    return {clicked: true, text: (btn.textContent || '').trim().toLowerCase()};
+})();
+'''
+
+# order_uber: scroll the Request button into view and report its centre once the
+# scroll has been painted (two animation frames, capped at 100ms)
+_UBER_REQUEST_BUTTON_JS = '''
+(async function() {
+    // Match any "Request ..." button
+    var btn = window.__uberButton('request ', false);
+    if (!btn) return {found: false, buttons: window.__uberQuery('button').length};
+    btn.scrollIntoView({behavior: 'instant', block: 'center'});
+    await new Promise(function(resolve) {
+        requestAnimationFrame(function() { requestAnimationFrame(resolve); });
+        setTimeout(resolve, 100);
+    });
+    var rect = btn.getBoundingClientRect();
+    return {
+        found: true,
+        text: btn.textContent.trim(),
+        x: rect.left + rect.width/2,
+        y: rect.top + rect.height/2
+    };
+})();
+'''
 
-        // Check if ride options are showing
-        var lowerText = bodyText.toLowerCase();
-        if (lowerText.includes('uberx') || lowerText.includes('comfort') || lowerText.includes('black')) {
-            result.hasRideOptions = true;
-            result.pageState = 'ride_selection';
-        } else if (result.dropoffField) {
-            result.pageState = 'ready_for_destination';
+# order_uber: whether the ride was actually requested
+_UBER_VERIFY_JS = '''
+(function() {
+    var bodyText = window.__uberBodyText();
+    // Ride status shows near the top; don't scan the rest of a long page
+    var text = bodyText.substring(0, 8000);
+
+    var result = {
+        rideRequested: false,
+        rideConfirmed: false,
+        lookingForDriver: false,
+        driverFound: false,
+        driverName: '',
+        eta: '',
+        stillOnSelection: false,
+        currentState: 'unknown',
+        visibleText: bodyText.substring(0, 600)
+    };
+
+    // Checked in order of precedence (as order_uber reads the result), returning at
+    // the first match so the common success case skips the remaining scans.
+    // Driver found - has driver name or "arriving"
+    var arriving = /arriving/i.test(text);
+    if (arriving || /is on the way|meet at|your driver/i.test(text)) {
+        result.driverFound = true;
+        result.rideConfirmed = true;
+        result.currentState = 'driver_assigned';
+        // ETA like "3 min" in context of arriving
+        var etaMatch = text.match(/(\\d+)\\s*min/);
+        if (etaMatch && (arriving || /away/i.test(text))) {
+            result.eta = etaMatch[1] + ' min';
         }
+        return result;
+    }
 
-        result.bodySnippet = bodyText.substring(0, 400);
+    // Ride was requested - looking for driver
+    if (/looking for|finding your|connecting you|searching for/i.test(text)) {
+        result.lookingForDriver = true;
+        result.rideRequested = true;
+        result.currentState = 'looking_for_driver';
         return result;
-    })();
-    '''
+    }
+
+    // Cancel button means the ride is in progress
+    if (/cancel (ride|trip)/i.test(text)) {
+        result.rideRequested = true;
+        return result;
+    }
 
-    analysis = cdp_execute_script(ws_url, analyze_script)
-    log(f"Page analysis: {analysis}")
+    // Still on ride selection screen (not yet requested)
+    if (/request uberx|choose a ride|request comfort/i.test(text)) {
+        result.stillOnSelection = true;
+        result.currentState = 'still_selecting';
+    }
 
-    # Parse analysis result
+    return result;
+})();
+'''
+
+
+def order_uber(pickup_lat, pickup_lon, pickup_address, destination, ride_type='UberX', num_passengers=1):
+    """
+    Automated Uber ordering using Chrome DevTools Protocol (CDP).
+    Smart approach: analyzes page, uses process of elimination if needed.
+    num_passengers: if > 4, will select UberXL instead of UberX
+    """
+    # Auto-select ride type based on passenger count
+    if num_passengers > 4:
+        ride_type = 'UberXL'
+    elif ride_type == 'UberX' and num_passengers <= 4:
+        ride_type = 'UberX'
+
+    log(f"Starting Uber order via CDP: from ({pickup_lat}, {pickup_lon}) to {destination}, {num_passengers} passengers, ride: {ride_type}")
+
+    # Step 1: Check CDP connection and take a tab. Concurrent orders each get their
+    # own tab in the same Chrome instead of fighting over the first one.
+    target = cdp_claim_page('m.uber.com')
+    if target is None:
+        return {'success': False, 'error': 'Chrome debug mode not running. Start agent.py to auto-launch Chrome.'}
     try:
-        page_state = analysis.get('result', {}).get('result', {}).get('value', {})
-    except:
-        page_state = {}
+        return _order_uber_in_tab(target['webSocketDebuggerUrl'], target.get('url', ''),
+                                  pickup_lat, pickup_lon, pickup_address, destination, ride_type)
+    finally:
+        cdp_release_page(target)
+
+def _same_uber_page(page_url, uber_url):
+    """True if page_url is uber_url's page with the same pickup. Uber adds and
+    reorders query parameters, so only host, path and the decoded pickup count."""
+    page, wanted = urllib.parse.urlsplit(page_url), urllib.parse.urlsplit(uber_url)
+    if (page.netloc, page.path.rstrip('/')) != (wanted.netloc, wanted.path.rstrip('/')):
+        return False
+    try:
+        pickup = json.loads(urllib.parse.parse_qs(page.query)['pickup'][0])
+    except (KeyError, ValueError):
+        return False
+    return pickup == json.loads(urllib.parse.parse_qs(wanted.query)['pickup'][0])
+
+def _order_uber_in_tab(ws_url, page_url, pickup_lat, pickup_lon, pickup_address, destination, ride_type):
+    """Steps 2-11 of order_uber, driving the page target at ws_url (currently showing page_url)"""
+    pickup_display = pickup_address if pickup_address else f"{pickup_lat}, {pickup_lon}"
+    log(f"Connected to Chrome tab: {ws_url}")
 
+    # Step 2: Navigate to Uber WITH pickup coordinates in URL
+    # This pre-sets the pickup location so user doesn't need to allow location access
+    pickup_data = json.dumps({"latitude": pickup_lat, "longitude": pickup_lon})
+    uber_url = f"https://m.uber.com/go/home?pickup={urllib.parse.quote(pickup_data)}"
+    # Selector cache (window.__uberQuery) for every document this tab loads from here on
+    cdp_session(ws_url).install(_UBER_QUERY_CACHE_JS)
+
+    def load_uber():
+        log(f"Navigating to: {uber_url}")
+        cdp_navigate_and_wait(ws_url, uber_url, timeout=4.0)
+        # The app renders after the load event; wait for it to settle
+        cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=2.0)
+
+    # Step 3: Smart page analysis - understand what's on screen, whether the
+    # pickup was set from the URL, and where the fields are (see Step 4).
+    # The three probes only read the page, so send them as one batch
+    probe_errors = {}
+
+    def analyze():
+        return cdp_run_scripts(ws_url, {
+            'uber_analyze': _UBER_ANALYZE_JS,
+            'uber_pickup_check': _UBER_PICKUP_CHECK_JS,
+            'uber_field_coords': _UBER_FIELD_COORDS_JS,
+        }, probe_errors)
+
+    # A tab already sitting on the Uber home page with this pickup is reused as is,
+    # skipping the SPA's cold start - unless it shows ride options or dropoff text
+    # left over from an earlier order, which a reload clears.
+    if _same_uber_page(page_url, uber_url):
+        log("Uber already loaded with this pickup, reusing the page")
+        probe = analyze()
+        leftover = probe['uber_analyze'] or {}
+        if leftover.get('hasRideOptions') or leftover.get('hasDestination'):
+            log("Uber page has a previous destination, reloading")
+            load_uber()
+            probe = analyze()
+    else:
+        load_uber()
+        probe = analyze()
+    page_state = probe['uber_analyze'] or {}
+    debug("Page analysis: %s", page_state)
+
+    if 'uber_analyze' in probe_errors:
+        return {'success': False, 'error': f"Could not analyze Uber page: {probe_errors['uber_analyze']}"}
     if not isinstance(page_state, dict):
         return {'success': False, 'error': 'Could not analyze Uber page'}
 
@@ -1430,337 +3102,119 @@ def order_uber(pickup_lat, pickup_lon, pickup_address, destination, ride_type='U
             'error': 'You need to log into Uber first. Open Chrome and sign in at m.uber.com'
         }
 
-    # Step 3b: Check if pickup was set from URL, if not we need to set it
-    pickup_check = cdp_execute_script(ws_url, '''
-    (function() {
-        var pickup = document.querySelector('[data-testid="enhancer-container-pickup"]');
-        if (!pickup) return {hasPickup: false};
-        var text = pickup.textContent.toLowerCase();
-        // Check if pickup is still empty/default
-        var isEmpty = text.includes('pickup location') && !text.includes(',');
-        return {hasPickup: !isEmpty, pickupText: pickup.textContent.substring(0, 100)};
-    })();
-    ''')
-    log(f"Pickup check: {pickup_check}")
-
-    try:
-        pickup_state = pickup_check.get('result', {}).get('result', {}).get('value', {})
-    except:
-        pickup_state = {}
+    pickup_state = probe['uber_pickup_check'] or {}
+    debug("Pickup check: %s", pickup_state)
 
     # If pickup not set, try to set it via clicking and using "Set location on map" or coordinates
     if not pickup_state.get('hasPickup'):
         log("Pickup not set from URL, attempting to set manually...")
 
         # Click the pickup field
-        pickup_coords_script = '''
-        (function() {
-            var pickup = document.querySelector('[data-testid="enhancer-container-pickup"]');
-            if (!pickup) return {found: false};
-            var rect = pickup.getBoundingClientRect();
-            return {found: true, x: rect.left + rect.width/2, y: rect.top + rect.height/2};
-        })();
-        '''
-        pickup_coords = cdp_execute_script(ws_url, pickup_coords_script)
-        try:
-            pc = pickup_coords.get('result', {}).get('result', {}).get('value', {})
-        except:
-            pc = {}
-
-        if pc.get('found'):
-            px, py = pc['x'], pc['y']
-            log(f"Clicking pickup at ({px}, {py})")
-            cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-                'type': 'mousePressed', 'x': px, 'y': py, 'button': 'left', 'clickCount': 1
-            })
-            time.sleep(0.1)
-            cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-                'type': 'mouseReleased', 'x': px, 'y': py, 'button': 'left', 'clickCount': 1
-            })
-            time.sleep(1.5)
+        pc = cdp_js_click(ws_url, 'window.__uberQuery(\'[data-testid="enhancer-container-pickup"]\')[0]')
+        if pc.get('clicked'):
+            log(f"Clicked pickup at ({pc['x']}, {pc['y']})")
+            cdp_wait_for_dom_quiet(ws_url, timeout=1.5, require_change=True)
 
             # Type the pickup address if we have it
             if pickup_address:
                 log(f"Typing pickup address: {pickup_address}")
                 cdp_type_text(ws_url, pickup_address)
-                time.sleep(2)
-                cdp_press_key(ws_url, 'ArrowDown')
-                time.sleep(0.3)
-                cdp_press_key(ws_url, 'Enter')
-                time.sleep(2)
+                cdp_wait_for_selector(ws_url, _UBER_SUGGESTIONS, timeout=2.0)
+                cdp_press_keys(ws_url, 'ArrowDown', 'Enter')
+                cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=2.0, require_change=True)
             else:
                 # Try to use "Allow location access" or type coordinates
                 log("No pickup address provided, trying to select first suggestion...")
-                cdp_press_key(ws_url, 'ArrowDown')
-                time.sleep(0.3)
-                cdp_press_key(ws_url, 'Enter')
-                time.sleep(2)
-
-    # Step 4: Get coordinates for BOTH pickup and dropoff to click the right one
-    coords_script = '''
-    (function() {
-        var result = {pickupCoords: null, dropoffCoords: null};
+                cdp_press_keys(ws_url, 'ArrowDown', 'Enter')
+                cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=2.0, require_change=True)
 
-        // Find pickup element
-        var pickup = document.querySelector('[data-testid="enhancer-container-pickup"]');
-        if (pickup) {
-            var pr = pickup.getBoundingClientRect();
-            result.pickupCoords = {x: pr.left + pr.width/2, y: pr.top + pr.height/2, bottom: pr.bottom};
-        }
-
-        // Find dropoff element - it should be BELOW the pickup
-        var dropoff = document.querySelector('[data-testid="enhancer-container-drop0"]');
-        if (dropoff) {
-            var dr = dropoff.getBoundingClientRect();
-            result.dropoffCoords = {x: dr.left + dr.width/2, y: dr.top + dr.height/2, top: dr.top};
-        }
-
-        // Sanity check: dropoff should be below pickup
-        if (result.pickupCoords && result.dropoffCoords) {
-            result.dropoffIsBelowPickup = result.dropoffCoords.top > result.pickupCoords.bottom - 10;
-        }
-
-        return result;
-    })();
-    '''
-
-    coords_result = cdp_execute_script(ws_url, coords_script)
-    log(f"Field coordinates: {coords_result}")
-
-    try:
-        coords = coords_result.get('result', {}).get('result', {}).get('value', {})
-    except:
-        coords = {}
+    # Step 4: Coordinates for BOTH pickup and dropoff to click the right one. Re-read
+    # them only if setting the pickup changed the page.
+    if pickup_state.get('hasPickup'):
+        coords = probe['uber_field_coords'] or {}
+    else:
+        probe_errors.pop('uber_field_coords', None)
+        coords = cdp_run_scripts(ws_url, {'uber_field_coords': _UBER_FIELD_COORDS_JS}, probe_errors)['uber_field_coords'] or {}
+    debug("Field coordinates: %s", coords)
 
     dropoff_coords = coords.get('dropoffCoords')
     pickup_coords = coords.get('pickupCoords')
 
     if not dropoff_coords:
+        if 'uber_field_coords' in probe_errors:
+            return {'success': False, 'error': f"Could not locate the Uber fields: {probe_errors['uber_field_coords']}"}
         return {'success': False, 'error': 'Could not find dropoff element on page'}
 
     # Make sure we're clicking the RIGHT field (dropoff, not pickup)
     x, y = dropoff_coords['x'], dropoff_coords['y']
     log(f"Dropoff at ({x}, {y}), Pickup at ({pickup_coords['x'] if pickup_coords else '?'}, {pickup_coords['y'] if pickup_coords else '?'})")
 
-    # Click the dropoff field
+    # Click the dropoff field (and focus its input, which a real click would do)
     log(f"Clicking dropoff at coordinates: ({x}, {y})")
-    cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-        'type': 'mousePressed',
-        'x': x,
-        'y': y,
-        'button': 'left',
-        'clickCount': 1
-    })
-    time.sleep(0.1)
-    cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-        'type': 'mouseReleased',
-        'x': x,
-        'y': y,
-        'button': 'left',
-        'clickCount': 1
-    })
-
-    time.sleep(1.5)
-
-    # Step 5: Verify we're in the RIGHT input field (dropoff, not pickup)
-    field_check = cdp_execute_script(ws_url, '''
-    (function() {
-        // Check what field is active by looking at the page state
-        var bodyText = document.body.innerText;
-
-        // Look for indication of which field is being edited
-        var result = {
-            isEditingDropoff: false,
-            isEditingPickup: false,
-            activeFieldHint: ''
-        };
-
-        // If we see "Where to" or "Enter destination" prominently, we're editing dropoff
-        // If we see "Enter pickup" or "Set pickup", we're editing pickup
-        if (bodyText.includes('Where to') || bodyText.includes('Enter destination') ||
-            bodyText.includes('Dropoff') && !bodyText.includes('Dropoff location')) {
-            result.isEditingDropoff = true;
-            result.activeFieldHint = 'dropoff';
-        }
-        if (bodyText.includes('Enter pickup') || bodyText.includes('Set pickup location')) {
-            result.isEditingPickup = true;
-            result.activeFieldHint = 'pickup';
-        }
-
-        // Also check for any visible input placeholder
-        var activeEl = document.activeElement;
-        if (activeEl && activeEl.tagName === 'INPUT') {
-            var ph = (activeEl.placeholder || '').toLowerCase();
-            result.inputPlaceholder = activeEl.placeholder;
-            if (ph.includes('where') || ph.includes('destination') || ph.includes('drop')) {
-                result.isEditingDropoff = true;
-            } else if (ph.includes('pickup') || ph.includes('from')) {
-                result.isEditingPickup = true;
-            }
-        }
-
-        result.snippet = bodyText.substring(0, 200);
-        return result;
-    })();
-    ''')
-    log(f"Field check: {field_check}")
-
-    try:
-        field_state = field_check.get('result', {}).get('result', {}).get('value', {})
-    except:
+    cdp_js_click(ws_url, '''(function() {
+        var dropoff = window.__uberQuery('[data-testid="enhancer-container-drop0"]')[0];
+        var input = dropoff && dropoff.querySelector('input');
+        if (input) input.focus();
+        return dropoff;
+    })()''')
+
+    cdp_wait_for_dom_quiet(ws_url, timeout=1.5, require_change=True)
+
+    # Step 5: Verify we're in the RIGHT input field (dropoff, not pickup). Not needed
+    # when the pickup came from the URL and the dropoff field sat clearly below it.
+    if pickup_state.get('hasPickup') and coords.get('dropoffIsBelowPickup'):
         field_state = {}
+    else:
+        field_check = cdp_run_script(ws_url, _UBER_FIELD_CHECK_JS, 'uber_field_check.js')
+        debug("Field check: %s", field_check)
+        field_state = _eval_value(field_check)
 
     # If we accidentally clicked pickup, try clicking lower (the dropoff field)
     if field_state.get('isEditingPickup') and not field_state.get('isEditingDropoff'):
         log("WARNING: Clicked pickup instead of dropoff! Pressing Escape and retrying lower...")
         cdp_press_key(ws_url, 'Escape')
-        time.sleep(0.5)
+        cdp_wait_for_dom_quiet(ws_url, quiet=0.1, timeout=0.5, require_change=True)
 
         # Click lower - dropoff should be ~50-80px below pickup
         new_y = y + 60
         log(f"Retrying click at ({x}, {new_y})")
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mousePressed', 'x': x, 'y': new_y, 'button': 'left', 'clickCount': 1
-        })
-        time.sleep(0.1)
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mouseReleased', 'x': x, 'y': new_y, 'button': 'left', 'clickCount': 1
-        })
-        time.sleep(1.5)
+        click = {'x': x, 'y': new_y, 'button': 'left', 'clickCount': 1}
+        cdp_send_many(ws_url, [
+            ('Input.dispatchMouseEvent', dict(click, type='mousePressed')),
+            ('Input.dispatchMouseEvent', dict(click, type='mouseReleased')),
+        ])
+        cdp_wait_for_dom_quiet(ws_url, timeout=1.5, require_change=True)
 
     # Step 6: Type the destination
     log(f"Typing destination: {destination}")
     cdp_type_text(ws_url, destination)
-    time.sleep(2.5)
+    cdp_wait_for_selector(ws_url, _UBER_SUGGESTIONS, timeout=2.5)
 
     # Step 7: Select first autocomplete result
     log("Selecting autocomplete result...")
-    cdp_press_key(ws_url, 'ArrowDown')
-    time.sleep(0.5)
-    cdp_press_key(ws_url, 'Enter')
-    time.sleep(2)
+    cdp_press_keys(ws_url, 'ArrowDown', 'Enter')
+    cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=2.0, require_change=True)
 
-    # Step 8: Click the "Search" button to get ride options
-    log("Looking for Search button...")
-    search_btn_script = '''
-    (function() {
-        // Find the Search button
-        var buttons = document.querySelectorAll('button');
-        for (var i = 0; i < buttons.length; i++) {
-            var text = (buttons[i].textContent || '').trim();
-            if (text === 'Search' || text.toLowerCase() === 'search') {
-                var rect = buttons[i].getBoundingClientRect();
-                return {found: true, x: rect.left + rect.width/2, y: rect.top + rect.height/2, text: text};
-            }
-        }
-        // Also try by aria-label or data-testid
-        var searchBtn = document.querySelector('button[aria-label*="Search"], button[data-testid*="search"]');
-        if (searchBtn) {
-            var rect = searchBtn.getBoundingClientRect();
-            return {found: true, x: rect.left + rect.width/2, y: rect.top + rect.height/2, text: 'search btn'};
-        }
-        return {found: false};
-    })();
-    '''
-    search_result = cdp_execute_script(ws_url, search_btn_script)
-    log(f"Search button: {search_result}")
-
-    try:
-        search_btn = search_result.get('result', {}).get('result', {}).get('value', {})
-    except:
-        search_btn = {}
-
-    if search_btn.get('found'):
-        sx, sy = search_btn['x'], search_btn['y']
-        log(f"Clicking Search button at ({sx}, {sy})")
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mousePressed', 'x': sx, 'y': sy, 'button': 'left', 'clickCount': 1
-        })
-        time.sleep(0.1)
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mouseReleased', 'x': sx, 'y': sy, 'button': 'left', 'clickCount': 1
-        })
-        time.sleep(3)  # Wait for next screen to load
-    else:
-        log("Search button not found, ride options may already be visible")
-
-    # Step 9: Check if terminal/gate selection is required (airports, large venues)
-    terminal_check_script = '''
-    (function() {
-        var bodyText = document.body.innerText;
-        var result = {
-            needsTerminalSelection: false,
-            terminals: [],
-            hasNextButton: false
-        };
-
-        // Check if we're on a terminal selection screen
-        if (bodyText.includes('Terminal') || bodyText.includes('terminal') ||
-            bodyText.includes('Gate') || bodyText.includes('Concourse')) {
-
-            // Look for terminal options (usually radio buttons or clickable divs)
-            var options = document.querySelectorAll('[role="radio"], [role="option"], [data-testid*="terminal"], [data-testid*="option"]');
-            options.forEach(function(opt) {
-                var text = (opt.textContent || '').trim();
-                if (text && text.length < 50) {
-                    var rect = opt.getBoundingClientRect();
-                    if (rect.width > 0 && rect.height > 0) {
-                        result.terminals.push({
-                            text: text,
-                            x: rect.left + rect.width/2,
-                            y: rect.top + rect.height/2
-                        });
-                    }
-                }
-            });
-
-            // Also look for list items that might be terminals
-            if (result.terminals.length === 0) {
-                var listItems = document.querySelectorAll('li, [role="listitem"]');
-                listItems.forEach(function(li) {
-                    var text = (li.textContent || '').trim();
-                    if (text.includes('Terminal') || text.includes('Concourse') || text.includes('Gate')) {
-                        var rect = li.getBoundingClientRect();
-                        if (rect.width > 0 && rect.height > 0) {
-                            result.terminals.push({
-                                text: text.substring(0, 40),
-                                x: rect.left + rect.width/2,
-                                y: rect.top + rect.height/2
-                            });
-                        }
-                    }
-                });
-            }
-
-            if (result.terminals.length > 0) {
-                result.needsTerminalSelection = true;
-            }
-        }
-
-        // Check for Next button
-        var buttons = document.querySelectorAll('button');
-        for (var i = 0; i < buttons.length; i++) {
-            var text = (buttons[i].textContent || '').trim().toLowerCase();
-            if (text === 'next' || text === 'continue' || text === 'confirm') {
-                var rect = buttons[i].getBoundingClientRect();
-                result.hasNextButton = true;
-                result.nextButtonCoords = {x: rect.left + rect.width/2, y: rect.top + rect.height/2};
-                break;
-            }
-        }
+    # Step 8: Click the "Search" button to get ride options
+    log("Looking for Search button...")
+    search_btn = cdp_js_click(ws_url, '''(
+        window.__uberButton('search', true) ||
+        // Also try by aria-label or data-testid
+        window.__uberQuery('button[aria-label*="Search"], button[data-testid*="search"]')[0]
+    )''')
+    debug("Search button: %s", search_btn)
 
-        result.bodySnippet = bodyText.substring(0, 400);
-        return result;
-    })();
-    '''
+    if search_btn.get('clicked'):
+        log(f"Clicked Search button at ({search_btn['x']}, {search_btn['y']})")
+        cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=3.0, require_change=True)  # Wait for next screen to load
+    else:
+        log("Search button not found, ride options may already be visible")
 
-    terminal_result = cdp_execute_script(ws_url, terminal_check_script)
-    log(f"Terminal check: {terminal_result}")
+    # Step 9: Check if terminal/gate selection is required (airports, large venues)
+    terminal_result = cdp_run_script(ws_url, _UBER_TERMINAL_CHECK_JS, 'uber_terminal_check.js')
+    debug("Terminal check: %s", terminal_result)
 
-    try:
-        terminal_state = terminal_result.get('result', {}).get('result', {}).get('value', {})
-    except:
-        terminal_state = {}
+    terminal_state = _eval_value(terminal_result)
 
     if terminal_state.get('needsTerminalSelection') and terminal_state.get('terminals'):
         terminals = terminal_state['terminals']
@@ -1768,43 +3222,21 @@ def order_uber(pickup_lat, pickup_lon, pickup_address, destination, ride_type='U
 
         # Select the first terminal option
         first_terminal = terminals[0]
-        tx, ty = first_terminal['x'], first_terminal['y']
-        log(f"Selecting terminal: '{first_terminal['text']}' at ({tx}, {ty})")
-
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mousePressed', 'x': tx, 'y': ty, 'button': 'left', 'clickCount': 1
-        })
-        time.sleep(0.1)
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mouseReleased', 'x': tx, 'y': ty, 'button': 'left', 'clickCount': 1
-        })
-        time.sleep(1)
+        log(f"Selecting terminal: '{first_terminal['text']}' at ({first_terminal['x']}, {first_terminal['y']})")
+        cdp_js_click(ws_url, '(window.__uberTerminals || [])[0]')
+        cdp_wait_for_dom_quiet(ws_url, timeout=1.0, require_change=True)
 
         # Now click Next button - use JS click since CDP mouse events have scroll issues
         log("Looking for Next/Continue button...")
-        next_btn_script = '''
-        (function() {
-            var buttons = document.querySelectorAll('button');
-            for (var i = 0; i < buttons.length; i++) {
-                var text = (buttons[i].textContent || '').trim().toLowerCase();
-                if (text === 'next' || text === 'continue' || text === 'confirm') {
-                    // Use direct JS click - more reliable than CDP mouse events for off-screen elements
-                    buttons[i].click();
-                    return {clicked: true, text: text};
-                }
-            }
-            return {clicked: false};
-        })();
-        '''
-        next_result = cdp_execute_script(ws_url, next_btn_script)
-        log(f"Next button click: {next_result}")
-        time.sleep(3)  # Wait for ride options to load
+        next_result = cdp_run_script(ws_url, _UBER_NEXT_BUTTON_JS, 'uber_next_button.js')
+        debug("Next button click: %s", next_result)
+        cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=3.0, require_change=True)  # Wait for ride options to load
 
     # Step 10: Wait for ride options page to fully load, then find Request button
     log(f"Looking for ride options, selecting {ride_type}...")
 
     # Give the page a moment to render ride options
-    time.sleep(1)
+    cdp_wait_for_dom_quiet(ws_url, timeout=1.0)
 
     # The ride options page should already have the first option (UberX) selected by default
     # We just need to find and click the Request button at the bottom
@@ -1812,189 +3244,89 @@ def order_uber(pickup_lat, pickup_lon, pickup_address, destination, ride_type='U
 
     if ride_type.lower() != 'uberx':
         # Need to select a different ride type - find and click it
-        ride_select_script = f'''
-        (function() {{
-            var targetRide = '{ride_type}'.toLowerCase();
-            var allElements = document.querySelectorAll('*');
+        ride_el = cdp_js_click(ws_url, '''(function(targetRide) {
+            // Match ride types - look for the label text
+            function isMatch(text, exact) {
+                if (targetRide === 'uberxl') return text.startsWith('uberxl');
+                if (targetRide === 'comfort') return text.startsWith('comfort') && !text.includes('electric');
+                // A card's text runs on past its name ("Black SUV", "Black4 seats"), so only
+                // rule out the SUV tier
+                if (targetRide === 'black') return exact ? text === 'black' : /^black(?!\s*suv)/.test(text);
+                return false;
+            }
+            function isVisible(el) {
+                var rect = el.getBoundingClientRect();
+                return rect.width > 50 && rect.height > 20;
+            }
 
-            for (var i = 0; i < allElements.length; i++) {{
+            // Ride option cards first - a handful of nodes instead of the whole page
+            var options = window.__uberQuery('[data-testid*="product"], [role="radio"], [data-testid*="ride-option"]');
+            for (var i = 0; i < options.length; i++) {
+                if (isMatch((options[i].textContent || '').trim().toLowerCase(), false) && isVisible(options[i])) {
+                    return options[i];
+                }
+            }
+
+            // Fall back to any element whose own text is the label
+            var allElements = window.__uberQuery('*');
+            for (var i = 0; i < allElements.length; i++) {
                 var el = allElements[i];
-                var text = (el.textContent || '').toLowerCase();
                 var directText = '';
 
                 // Get direct text content (not from children)
-                for (var j = 0; j < el.childNodes.length; j++) {{
-                    if (el.childNodes[j].nodeType === 3) {{
+                for (var j = 0; j < el.childNodes.length; j++) {
+                    if (el.childNodes[j].nodeType === 3) {
                         directText += el.childNodes[j].textContent;
-                    }}
-                }}
-                directText = directText.toLowerCase().trim();
-
-                // Match ride types - look for the label text
-                var isMatch = false;
-                if (targetRide === 'uberxl' && (directText === 'uberxl' || directText.startsWith('uberxl'))) {{
-                    isMatch = true;
-                }} else if (targetRide === 'comfort' && directText.startsWith('comfort') && !directText.includes('electric')) {{
-                    isMatch = true;
-                }} else if (targetRide === 'black' && directText === 'black') {{
-                    isMatch = true;
-                }}
-
-                if (isMatch) {{
-                    var rect = el.getBoundingClientRect();
-                    if (rect.width > 50 && rect.height > 20) {{
-                        el.scrollIntoView({{behavior: 'instant', block: 'center'}});
-                        return {{
-                            found: true,
-                            text: el.textContent.substring(0, 50),
-                            x: rect.left + rect.width/2,
-                            y: rect.top + rect.height/2
-                        }};
-                    }}
-                }}
-            }}
-            return {{found: false}};
-        }})();
-        '''
-        ride_result = cdp_execute_script(ws_url, ride_select_script)
-        log(f"Ride type selection: {ride_result}")
+                    }
+                }
 
-        try:
-            ride_el = ride_result.get('result', {}).get('result', {}).get('value', {})
-        except:
-            ride_el = {}
+                if (isMatch(directText.toLowerCase().trim(), true) && isVisible(el)) return el;
+            }
+            return null;
+        })(%s)''' % json.dumps(ride_type.lower()))
+        debug("Ride type selection: %s", ride_el)
 
-        if ride_el.get('found'):
-            time.sleep(0.3)
-            rx, ry = ride_el['x'], ride_el['y']
-            log(f"Clicking ride option at ({rx}, {ry})")
-            cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-                'type': 'mousePressed', 'x': rx, 'y': ry, 'button': 'left', 'clickCount': 1
-            })
-            time.sleep(0.1)
-            cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-                'type': 'mouseReleased', 'x': rx, 'y': ry, 'button': 'left', 'clickCount': 1
-            })
-            time.sleep(1)
+        if ride_el.get('clicked'):
+            cdp_wait_for_dom_quiet(ws_url, timeout=1.0, require_change=True)
 
     # Now find and click the Request button
     log("Looking for Request button...")
 
     # Find button with "Request" in text, scroll into view, get coordinates
-    request_btn_script = '''
-    (function() {
-        var buttons = document.querySelectorAll('button');
-        for (var i = 0; i < buttons.length; i++) {
-            var btnText = (buttons[i].textContent || '').toLowerCase();
-            // Match any "Request ..." button
-            if (btnText.includes('request ')) {
-                buttons[i].scrollIntoView({behavior: 'instant', block: 'center'});
-                // Small delay for scroll, then get rect
-                var rect = buttons[i].getBoundingClientRect();
-                return {
-                    found: true,
-                    text: buttons[i].textContent.trim(),
-                    x: rect.left + rect.width/2,
-                    y: rect.top + rect.height/2
-                };
-            }
-        }
-        return {found: false, buttons: buttons.length};
-    })();
-    '''
-    request_result = cdp_execute_script(ws_url, request_btn_script)
-    log(f"Request button location: {request_result}")
+    request_result = cdp_run_script(ws_url, _UBER_REQUEST_BUTTON_JS, 'uber_request_button.js')
+    debug("Request button location: %s", request_result)
 
-    try:
-        req_btn = request_result.get('result', {}).get('result', {}).get('value', {})
-    except:
-        req_btn = {}
+    req_btn, req_error = _cdp_result_value(request_result)
+    if req_error:
+        return {'success': False, 'error': f'Could not look for the Request button: {req_error}',
+                'pickup': pickup_display, 'destination': destination}
+    req_btn = req_btn or {}
 
     if req_btn.get('found'):
-        time.sleep(0.5)  # Wait for scroll to complete
-
         # Use CDP mouse click - more reliable for React buttons
         btn_x, btn_y = req_btn['x'], req_btn['y']
         log(f"Clicking Request button at ({btn_x}, {btn_y}) with CDP mouse event")
 
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mousePressed', 'x': btn_x, 'y': btn_y, 'button': 'left', 'clickCount': 1
-        })
-        time.sleep(0.1)
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mouseReleased', 'x': btn_x, 'y': btn_y, 'button': 'left', 'clickCount': 1
-        })
+        click = {'x': btn_x, 'y': btn_y, 'button': 'left', 'clickCount': 1}
+        cdp_send_many(ws_url, [
+            ('Input.dispatchMouseEvent', dict(click, type='mousePressed')),
+            ('Input.dispatchMouseEvent', dict(click, type='mouseReleased')),
+        ])
         log("Request button clicked via CDP")
     else:
         log("Request button not found!")
 
-    time.sleep(3)  # Wait for ride to be requested
+    cdp_wait_for_dom_quiet(ws_url, quiet=0.5, timeout=3.0, require_change=True)  # Wait for ride to be requested
 
     # Step 11: STRICT verification - check if ride was actually requested/confirmed
-    verify_script = '''
-    (function() {
-        var bodyText = document.body.innerText;
-        var lowerText = bodyText.toLowerCase();
-
-        var result = {
-            rideRequested: false,
-            rideConfirmed: false,
-            lookingForDriver: false,
-            driverFound: false,
-            driverName: '',
-            eta: '',
-            stillOnSelection: false,
-            currentState: 'unknown',
-            visibleText: bodyText.substring(0, 600)
-        };
-
-        // Check if ride was requested - looking for driver
-        if (lowerText.includes('looking for') || lowerText.includes('finding your') ||
-            lowerText.includes('connecting you') || lowerText.includes('searching for')) {
-            result.lookingForDriver = true;
-            result.rideRequested = true;
-            result.currentState = 'looking_for_driver';
-        }
+    final_state = cdp_run_script(ws_url, _UBER_VERIFY_JS, 'uber_verify.js')
+    debug("Final verification: %s", final_state)
 
-        // Check if driver found - has driver name or "arriving"
-        if (lowerText.includes('arriving') || lowerText.includes('is on the way') ||
-            lowerText.includes('meet at') || lowerText.includes('your driver')) {
-            result.driverFound = true;
-            result.rideConfirmed = true;
-            result.currentState = 'driver_assigned';
-        }
-
-        // Check for ETA like "3 min" in context of arriving
-        var etaMatch = bodyText.match(/(\\d+)\\s*min/);
-        if (etaMatch && (lowerText.includes('arriving') || lowerText.includes('away'))) {
-            result.eta = etaMatch[1] + ' min';
-        }
-
-        // Check if still on ride selection screen (not yet requested)
-        if (lowerText.includes('request uberx') || lowerText.includes('request uberxl') ||
-            lowerText.includes('choose a ride') || lowerText.includes('request comfort')) {
-            result.stillOnSelection = true;
-            if (!result.rideRequested) {
-                result.currentState = 'still_selecting';
-            }
-        }
-
-        // Check for cancel button (means ride is in progress)
-        if (lowerText.includes('cancel ride') || lowerText.includes('cancel trip')) {
-            result.rideRequested = true;
-        }
-
-        return result;
-    })();
-    '''
-
-    final_state = cdp_execute_script(ws_url, verify_script)
-    log(f"Final verification: {final_state}")
-
-    try:
-        state = final_state.get('result', {}).get('result', {}).get('value', {})
-    except:
-        state = {}
+    state, state_error = _cdp_result_value(final_state)
+    if state_error:
+        return {'success': False, 'error': f'Could not verify the ride request: {state_error}. Please check Chrome.',
+                'pickup': pickup_display, 'destination': destination}
+    state = state or {}
 
     # Return result based on ACTUAL ride status - only report success when ride is truly requested/confirmed
     current_state = state.get('currentState', 'unknown')
@@ -2046,11 +3378,24 @@ def order_uber(pickup_lat, pickup_lon, pickup_address, destination, ride_type='U
 # UBER EATS AUTOMATION
 # ============================================================================
 
+# DuckDuckGo's HTML results put every snippet well inside this; the rest isn't parsed
+REVIEW_SEARCH_MAX_BYTES = 64 * 1024
+_HTML_TAG_RE = re.compile(r'<[^>]+>')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Common food words to look for in search results
+_FOOD_KEYWORDS = ['chicken', 'beef', 'pork', 'rice', 'noodle', 'soup', 'salad',
+                  'burger', 'pizza', 'taco', 'burrito', 'sandwich', 'steak',
+                  'fish', 'shrimp', 'tofu', 'curry', 'pad thai', 'ramen',
+                  'dumpling', 'fried', 'grilled', 'roasted', 'bowl', 'roll',
+                  'wings', 'fries', 'combo', 'special', 'signature']
+# One pass over a sentence tells whether any keyword occurs at all
+_FOOD_KEYWORD_RE = re.compile('|'.join(map(re.escape, _FOOD_KEYWORDS)), re.IGNORECASE)
+
 def search_restaurant_reviews(restaurant_name, location=""):
     """Search online for top recommended dishes at a restaurant using DuckDuckGo"""
     import urllib.request
     import urllib.parse
-    import re
 
     log(f"Researching top dishes at: {restaurant_name}")
 
@@ -2063,28 +3408,23 @@ def search_restaurant_reviews(restaurant_name, location=""):
             'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
         })
         with urllib.request.urlopen(req, timeout=10) as response:
-            html = response.read().decode('utf-8', errors='ignore')
+            html = response.read(REVIEW_SEARCH_MAX_BYTES).decode('utf-8', errors='ignore')
 
             log(f"Got search results: {len(html)} chars")
 
             # Extract text content (strip HTML tags)
-            text = re.sub(r'<[^>]+>', ' ', html)
-            text = re.sub(r'\s+', ' ', text)
+            text = _HTML_TAG_RE.sub(' ', html)
+            text = _WHITESPACE_RE.sub(' ', text)
 
             dishes = []
 
-            # Common food words to look for
-            food_keywords = ['chicken', 'beef', 'pork', 'rice', 'noodle', 'soup', 'salad',
-                           'burger', 'pizza', 'taco', 'burrito', 'sandwich', 'steak',
-                           'fish', 'shrimp', 'tofu', 'curry', 'pad thai', 'ramen',
-                           'dumpling', 'fried', 'grilled', 'roasted', 'bowl', 'roll',
-                           'wings', 'fries', 'combo', 'special', 'signature']
-
             # Extract sentences that mention food
             sentences = text.split('.')
             for sentence in sentences:
+                if not _FOOD_KEYWORD_RE.search(sentence):
+                    continue
                 sentence_lower = sentence.lower()
-                for keyword in food_keywords:
+                for keyword in _FOOD_KEYWORDS:
                     if keyword in sentence_lower:
                         # Extract potential dish name (words around the keyword)
                         words = sentence.split()
@@ -2098,7 +3438,8 @@ def search_restaurant_reviews(restaurant_name, location=""):
                                     dishes.append(dish)
                                 break
 
-            # Remove duplicates and clean up
+            # Remove duplicates (case-insensitively, keeping first-seen order) and clean
+            # up, stopping once there are as many as get returned
             unique_dishes = []
             seen = set()
             for d in dishes:
@@ -2107,6 +3448,8 @@ def search_restaurant_reviews(restaurant_name, location=""):
                 if d_lower not in seen and len(d_clean) > 5:
                     seen.add(d_lower)
                     unique_dishes.append(d_clean)
+                    if len(unique_dishes) == 10:
+                        break
 
             log(f"Found potential dishes: {unique_dishes[:5]}")
 
@@ -2120,6 +3463,259 @@ def search_restaurant_reviews(restaurant_name, location=""):
         return {'success': False, 'error': str(e), 'suggested_dishes': []}
 
 
+# Uber Eats page scripts run repeatedly (in retry and customization loops). They go
+# through cdp_run_script, so each is compiled once per page and re-run by script id.
+# Picks the first option in each required customization section of the item modal
+_EATS_SELECT_REQUIRED_JS = '''
+(function() {
+    var modal = document.querySelector('[role="dialog"]');
+    if (!modal) return {error: 'No modal'};
+
+    var results = {clicked: [], debug: []};
+
+    // Find required sections that don't have a selection yet
+    var sections = modal.querySelectorAll('[data-testid="customization-pick-one"], [data-testid*="customization"]');
+
+    for (var s = 0; s < sections.length; s++) {
+        var section = sections[s];
+        var sectionText = section.innerText || '';
+
+        // Only process required sections
+        if (!sectionText.includes('Required')) continue;
+
+        // Check if already has selection
+        var hasSelection = section.querySelector('[aria-checked="true"], input:checked, .selected');
+        if (hasSelection) continue;
+
+        // Find first unselected option and click it
+        var options = section.querySelectorAll('label, [role="radio"], li');
+        for (var o = 0; o < options.length; o++) {
+            var opt = options[o];
+            var isSelected = opt.querySelector('[aria-checked="true"], input:checked');
+            if (isSelected) continue;
+
+            var optText = (opt.textContent || '').trim();
+            if (optText.length < 3 || optText.includes('Required')) continue;
+
+            opt.scrollIntoView({behavior: 'instant', block: 'center'});
+            opt.click();
+            results.clicked.push(optText.substring(0, 40));
+            break;
+        }
+    }
+
+    return results;
+})();
+'''
+
+# Whether the item modal's Add button is enabled yet
+_EATS_ADD_BUTTON_STATE_JS = '''
+(function() {
+    var modal = document.querySelector('[role="dialog"]');
+    if (!modal) return {error: 'No modal'};
+
+    var addBtn = null;
+    var buttons = modal.querySelectorAll('button');
+    for (var i = 0; i < buttons.length; i++) {
+        if (/add 1|add to order|add for \\$/i.test(buttons[i].textContent || '')) {
+            addBtn = buttons[i];
+            break;
+        }
+    }
+
+    return {
+        addBtnFound: addBtn !== null,
+        addBtnEnabled: addBtn ? !addBtn.disabled : false,
+        addBtnText: addBtn ? addBtn.textContent.trim().substring(0, 40) : null
+    };
+})();
+'''
+
+# Scrolls the item modal down to reveal more customization sections
+_EATS_MODAL_SCROLL_JS = '''
+(function() {
+    var modal = document.querySelector('[role="dialog"]');
+    if (modal) modal.scrollTop += 200;
+})();
+'''
+
+# Finds an enabled Add to Cart / Add to Order button and clicks it
+_EATS_ADD_TO_CART_JS = '''
+(function() {
+    var buttons = document.querySelectorAll('button');
+    var targets = /add to cart|add to order|add item|add 1 to order|add 1 for/;
+
+    for (var i = 0; i < buttons.length; i++) {
+        var btn = buttons[i];
+
+        // Skip disabled buttons
+        if (btn.disabled) continue;
+
+        var text = (btn.textContent || '').toLowerCase();
+        if (targets.test(text)) {
+            btn.scrollIntoView({behavior: 'instant', block: 'center'});
+
+            // Try multiple click methods
+            btn.focus();
+            btn.click();
+
+            // Also dispatch a real click event
+            var evt = new MouseEvent('click', {
+                bubbles: true,
+                cancelable: true,
+                view: window
+            });
+            btn.dispatchEvent(evt);
+
+            return {
+                found: true,
+                clicked: true,
+                text: btn.textContent.trim(),
+                disabled: btn.disabled
+            };
+        }
+    }
+    return {found: false, availableButtons: Array.from(buttons).slice(0,10).map(b => b.textContent.trim().substring(0,30))};
+})();
+'''
+
+# Dismisses an upsell/promo popup during checkout by clicking its bottom-most button
+_EATS_DISMISS_POPUP_JS = '''
+(function() {
+    // First check if we're already on the final checkout page (no popup needed)
+    var pageText = document.body.innerText.toLowerCase();
+    if (pageText.includes('place order') && !document.querySelector('[role="dialog"]')) {
+        return {dismissed: false, reason: 'already on checkout', onCheckout: true};
+    }
+
+    // Look for modal/dialog overlay - try multiple selectors
+    var modal = document.querySelector('[role="dialog"]');
+    if (!modal) modal = document.querySelector('[data-testid*="modal"]');
+    if (!modal) modal = document.querySelector('[aria-modal="true"]');
+    if (!modal) modal = document.querySelector('[class*="modal"]');
+    if (!modal) modal = document.querySelector('[class*="Modal"]');
+    if (!modal) modal = document.querySelector('[class*="overlay"]');
+    if (!modal) modal = document.querySelector('[class*="Overlay"]');
+
+    // Try finding by z-index (popups usually have high z-index)
+    if (!modal) {
+        var allDivs = document.querySelectorAll('div');
+        for (var d = 0; d < allDivs.length; d++) {
+            var div = allDivs[d];
+            var style = window.getComputedStyle(div);
+            var zIndex = parseInt(style.zIndex) || 0;
+            var position = style.position;
+
+            // High z-index, fixed/absolute position, covering screen
+            if (zIndex > 100 && (position === 'fixed' || position === 'absolute')) {
+                var rect = div.getBoundingClientRect();
+                if (rect.width > 300 && rect.height > 200) {
+                    modal = div;
+                    break;
+                }
+            }
+        }
+    }
+
+    if (!modal) return {dismissed: false, reason: 'no modal found'};
+
+    // Find all buttons - search INSIDE the modal first, then globally if needed
+    var buttons = modal.querySelectorAll('button');
+
+    // Find the bottom-most visible button (horizontal bar at bottom of popup)
+    var bottomBtn = null;
+    var maxY = -1;
+
+    for (var i = 0; i < buttons.length; i++) {
+        var btn = buttons[i];
+
+        // Skip disabled
+        if (btn.disabled) continue;
+
+        // Skip navigation/accessibility links
+        var text = (btn.textContent || '').toLowerCase().trim();
+        if (text === 'skip to content' || text === 'back' || text === 'close') continue;
+
+        var rect = btn.getBoundingClientRect();
+
+        // Must be visible (has size and on screen)
+        if (rect.width < 80 || rect.height < 30) continue;
+        if (rect.bottom < 0 || rect.top > window.innerHeight) continue;
+
+        // Track the bottom-most button
+        if (rect.bottom > maxY) {
+            maxY = rect.bottom;
+            bottomBtn = btn;
+        }
+    }
+
+    if (bottomBtn) {
+        bottomBtn.scrollIntoView({behavior: 'instant', block: 'center'});
+        bottomBtn.click();
+        return {
+            dismissed: true,
+            text: bottomBtn.textContent.trim().substring(0, 50),
+            method: 'bottom-button',
+            y: maxY
+        };
+    }
+
+    // Try finding buttons with common dismiss text anywhere on page
+    // The whole text, or its first word(s) followed by a space
+    var dismissTexts = /^(next|skip|continue|no thanks|not now|done|got it)( |$)/;
+    var allButtons = document.querySelectorAll('button');
+    for (var j = 0; j < allButtons.length; j++) {
+        var b = allButtons[j];
+        if (b.disabled) continue;
+        var bText = (b.textContent || '').toLowerCase().trim();
+        if (dismissTexts.test(bText)) {
+            var bRect = b.getBoundingClientRect();
+            if (bRect.width > 50 && bRect.height > 20) {
+                b.click();
+                return {dismissed: true, text: b.textContent.trim(), method: 'text-match'};
+            }
+        }
+    }
+
+    // Fallback: try clicking X/close buttons
+    var closeBtn = modal.querySelector('[aria-label="Close"], [aria-label="close"], button[class*="close"]');
+    if (closeBtn) {
+        closeBtn.click();
+        return {dismissed: true, method: 'close-btn'};
+    }
+
+    return {dismissed: false, hasModal: true, buttonCount: buttons.length};
+})();
+'''
+
+# Clicks the cart's + (increase quantity) button once
+_EATS_INCREASE_QUANTITY_JS = '''
+(function() {
+    // Look for + button or increase quantity button
+    var buttons = document.querySelectorAll('button, [role="button"]');
+    for (var i = 0; i < buttons.length; i++) {
+        var btn = buttons[i];
+        var text = btn.textContent || '';
+        var label = btn.getAttribute('aria-label') || '';
+
+        // Look for + or "increase" or "add"
+        if (text === '+' || text === 'Add' || label.includes('increase') || label.includes('Increase') || label.includes('add 1')) {
+            btn.click();
+            return {clicked: true, btn: text || label};
+        }
+    }
+
+    // Also try finding by Plus icon
+    var plusBtns = document.querySelectorAll('[data-testid*="increase"], [data-testid*="plus"], [aria-label*="Add"]');
+    if (plusBtns.length > 0) {
+        plusBtns[0].click();
+        return {clicked: true, method: 'plus-btn'};
+    }
+
+    return {clicked: false};
+})();
+'''
+
 def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', surprise_me=False, customization_answers=None):
     """
     Automated Uber Eats ordering using CDP.
@@ -2128,27 +3724,24 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
     - If customization_answers is None: returns questions for user to answer
     - If customization_answers is provided: applies selections and proceeds to checkout
     """
-    import time
-    import urllib.parse
-
     log(f"Starting Uber Eats order: cuisine={cuisine_type}, surprise_me={surprise_me}, has_answers={customization_answers is not None}")
 
     # Clear any previous interrupt flag
     clear_interrupt()
 
-    # Step 1: Check CDP connection
-    targets = cdp_get_targets()
-    if targets is None:
+    # Step 1: Check CDP connection and take a tab no other flow is driving
+    target = cdp_claim_page('ubereats.com')
+    if target is None:
         return {'success': False, 'error': 'Chrome debug mode not running. Start agent.py to auto-launch Chrome.'}
+    try:
+        return _order_uber_eats_in_tab(target['webSocketDebuggerUrl'], pickup_lat, pickup_lon, pickup_address,
+                                       cuisine_type, surprise_me, customization_answers)
+    finally:
+        cdp_release_page(target)
 
-    ws_url = None
-    for target in targets:
-        if target.get('type') == 'page':
-            ws_url = target.get('webSocketDebuggerUrl')
-            break
-
-    if not ws_url:
-        return {'success': False, 'error': 'No Chrome tab available'}
+def _order_uber_eats_in_tab(ws_url, pickup_lat, pickup_lon, pickup_address, cuisine_type, surprise_me, customization_answers):
+    """Steps 2 onwards of order_uber_eats, driving the page target at ws_url"""
+    import urllib.parse
 
     log(f"Connected to Chrome tab: {ws_url}")
 
@@ -2160,29 +3753,28 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
     location_data = json.dumps({"latitude": pickup_lat, "longitude": pickup_lon})
     uber_eats_url = f"https://www.ubereats.com/feed?diningMode=DELIVERY&pl={urllib.parse.quote(location_data)}"
     log(f"Navigating to: {uber_eats_url}")
-    cdp_navigate(ws_url, uber_eats_url)
-    time.sleep(4)
+    cdp_navigate_and_wait(ws_url, uber_eats_url, timeout=4.0)
 
     # Check for interrupt
     if check_interrupt():
         return {'success': False, 'error': 'Operation cancelled by user', 'interrupted': True}
 
     # Step 3: Check if logged in
-    login_check = cdp_execute_script(ws_url, '''
+    login_script = '''
     (function() {
-        var bodyText = document.body.innerText.toLowerCase();
+        var bodyText = document.body.innerText;
         return {
-            needsLogin: bodyText.includes('sign in') || bodyText.includes('log in'),
-            pageText: document.body.innerText.substring(0, 500)
+            needsLogin: /sign in|log in/i.test(bodyText),
+            pageText: bodyText.substring(0, 500)
         };
     })();
-    ''')
-    log(f"Login check: {login_check}")
-
-    try:
-        login_state = login_check.get('result', {}).get('result', {}).get('value', {})
-    except:
-        login_state = {}
+    '''
+    # The feed renders after the load event; let it settle and check in one go
+    login_state = cdp_eval_batch(ws_url, {
+        'settle': _dom_quiet_js(0.3, 2.0),
+        'login': login_script,
+    }).get('login') or {}
+    log(f"Login check: {login_state}")
 
     if login_state.get('needsLogin'):
         return {
@@ -2195,73 +3787,20 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
         # Click on "Best Overall" filter button
         log("Looking for 'Best Overall' or top restaurants...")
 
-        best_overall_script = '''
-        (function() {
-            // Look for filter buttons at the top
-            var buttons = document.querySelectorAll('button, [role="button"], a');
-            for (var i = 0; i < buttons.length; i++) {
-                var btn = buttons[i];
-                var text = (btn.textContent || '').toLowerCase().trim();
-                if (text === 'best overall' || text.includes('best overall')) {
-                    btn.scrollIntoView({behavior: 'instant', block: 'center'});
-                    var rect = btn.getBoundingClientRect();
-                    return {
-                        found: true,
-                        text: btn.textContent.substring(0, 50),
-                        x: rect.left + rect.width/2,
-                        y: rect.top + rect.height/2
-                    };
-                }
-            }
-            return {found: false};
-        })();
-        '''
-        best_result = cdp_execute_script(ws_url, best_overall_script)
-        log(f"Best Overall search: {best_result}")
-
-        try:
-            best_btn = best_result.get('result', {}).get('result', {}).get('value', {})
-        except:
-            best_btn = {}
-
-        if best_btn.get('found'):
-            time.sleep(0.5)
-            # Get fresh coordinates after scroll
-            fresh_coords = cdp_execute_script(ws_url, '''
-            (function() {
-                var buttons = document.querySelectorAll('button, [role="button"], a');
-                for (var i = 0; i < buttons.length; i++) {
-                    var text = (buttons[i].textContent || '').toLowerCase().trim();
-                    if (text === 'best overall' || text.includes('best overall')) {
-                        var rect = buttons[i].getBoundingClientRect();
-                        return {x: rect.left + rect.width/2, y: rect.top + rect.height/2};
-                    }
-                }
-                return null;
-            })();
-            ''')
-            try:
-                coords = fresh_coords.get('result', {}).get('result', {}).get('value', {})
-                if coords:
-                    bx, by = coords['x'], coords['y']
-                else:
-                    bx, by = best_btn['x'], best_btn['y']
-            except:
-                bx, by = best_btn['x'], best_btn['y']
+        # Find, scroll to and click the filter button in one round trip. The text
+        # match runs natively in XPath instead of lowercasing every button's text in JS.
+        best_btn = cdp_js_click(ws_url, '''document.evaluate(
+            "//*[self::button or @role='button' or self::a][contains(translate(., 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'best overall')]",
+            document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue''')
+        log(f"Best Overall click: {best_btn}")
 
-            log(f"Clicking Best Overall at ({bx}, {by})")
-            cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-                'type': 'mousePressed', 'x': bx, 'y': by, 'button': 'left', 'clickCount': 1
-            })
-            time.sleep(0.1)
-            cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-                'type': 'mouseReleased', 'x': bx, 'y': by, 'button': 'left', 'clickCount': 1
-            })
-            time.sleep(3)  # Wait for filter to apply
+        if best_btn.get('clicked'):
+            # Wait for the filtered list to render
+            cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=3.0, require_change=True)
 
             # Scroll down to see restaurants
             cdp_execute_script(ws_url, 'window.scrollBy(0, 400);')
-            time.sleep(1)
+            cdp_wait_for_dom_quiet(ws_url, quiet=0.2, timeout=1.0)
 
     elif cuisine_type:
         # Search for cuisine type
@@ -2292,21 +3831,16 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
         '''
         search_result = cdp_execute_script(ws_url, search_script)
         log(f"Search field: {search_result}")
-        time.sleep(1)
+        cdp_wait_for(ws_url, "document.activeElement && document.activeElement.tagName === 'INPUT'", timeout=1.0)
 
         # Type cuisine
         cdp_type_text(ws_url, cuisine_type)
-        time.sleep(1)
+        cdp_wait_for_dom_quiet(ws_url, quiet=0.2, timeout=1.0, require_change=True)
         cdp_press_key(ws_url, 'Enter')
-        time.sleep(3)
+        cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=3.0, require_change=True)
 
     # Step 5: Get list of restaurants
     log("Getting restaurant list...")
-    time.sleep(2)
-
-    # Scroll down a bit to load restaurants
-    cdp_execute_script(ws_url, 'window.scrollBy(0, 300);')
-    time.sleep(1)
 
     restaurants_script = '''
     (function() {
@@ -2320,6 +3854,19 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
         // Split by newlines and look for patterns
         var lines = pageText.split('\\n');
 
+        // Index the page's text nodes by their trimmed text in one walk, so each
+        // candidate line is a lookup rather than a walk of the whole document
+        var nodesByText = new Map();
+        var walker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT, null, false);
+        var node;
+        while (node = walker.nextNode()) {
+            var nodeText = node.textContent.trim();
+            if (nodeText.length < 5 || nodeText.length > 50) continue;
+            var sameText = nodesByText.get(nodeText);
+            if (sameText) sameText.push(node);
+            else nodesByText.set(nodeText, [node]);
+        }
+
         for (var i = 0; i < lines.length && restaurants.length < 10; i++) {
             var line = lines[i].trim();
 
@@ -2359,22 +3906,19 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
             seen[line] = true;
 
             // Now find this text on the page and get its position
-            var walker = document.createTreeWalker(document.body, NodeFilter.SHOW_TEXT, null, false);
-            var node;
-            while (node = walker.nextNode()) {
-                if (node.textContent.trim() === line) {
-                    var parent = node.parentElement;
-                    var clickable = parent.closest('a') || parent;
-                    var rect = clickable.getBoundingClientRect();
-
-                    if (rect.top > 200 && rect.top < window.innerHeight && rect.width > 50) {
-                        restaurants.push({
-                            name: line,
-                            x: rect.left + rect.width/2,
-                            y: rect.top + rect.height/2
-                        });
-                        break;
-                    }
+            var matches = nodesByText.get(line) || [];
+            for (var k = 0; k < matches.length; k++) {
+                var parent = matches[k].parentElement;
+                var clickable = parent.closest('a') || parent;
+                var rect = clickable.getBoundingClientRect();
+
+                if (rect.top > 200 && rect.top < window.innerHeight && rect.width > 50) {
+                    restaurants.push({
+                        name: line,
+                        x: rect.left + rect.width/2,
+                        y: rect.top + rect.height/2
+                    });
+                    break;
                 }
             }
         }
@@ -2386,13 +3930,15 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
         };
     })();
     '''
-    restaurants_result = cdp_execute_script(ws_url, restaurants_script)
-    log(f"Restaurants found: {restaurants_result}")
-
-    try:
-        rest_data = restaurants_result.get('result', {}).get('result', {}).get('value', {})
-    except:
-        rest_data = {}
+    # Let the feed settle, scroll down a bit to load restaurants, settle again and
+    # read the list - all in one round trip
+    rest_data = cdp_eval_batch(ws_url, {
+        'settle': _dom_quiet_js(0.3, 2.0),
+        'scroll': 'window.scrollBy(0, 300)',
+        'settled': _dom_quiet_js(0.2, 1.0),
+        'restaurants': restaurants_script,
+    }).get('restaurants') or {}
+    log(f"Restaurants found: {rest_data}")
 
     restaurants = rest_data.get('restaurants', [])
 
@@ -2428,66 +3974,51 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
     link_result = cdp_execute_script(ws_url, find_link_script)
     log(f"Restaurant link: {link_result}")
 
-    try:
-        link_data = link_result.get('result', {}).get('result', {}).get('value', {})
-    except:
-        link_data = {}
+    link_data = _eval_value(link_result)
 
     if link_data.get('found') and link_data.get('href'):
         # Navigate directly to the restaurant page
         store_url = link_data['href']
         log(f"Navigating to restaurant: {store_url}")
-        cdp_navigate(ws_url, store_url)
-        time.sleep(5)  # Wait for restaurant page to load
+        cdp_navigate_and_wait(ws_url, store_url, timeout=5.0)  # Wait for restaurant page to load
     else:
         log("Could not find restaurant link, trying click...")
         rx, ry = selected_restaurant['x'], selected_restaurant['y']
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mousePressed', 'x': rx, 'y': ry, 'button': 'left', 'clickCount': 1
-        })
-        time.sleep(0.1)
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mouseReleased', 'x': rx, 'y': ry, 'button': 'left', 'clickCount': 1
-        })
-        time.sleep(5)
-
-    # Verify we navigated to restaurant page
-    page_check = cdp_execute_script(ws_url, 'window.location.href')
-    log(f"Current URL: {page_check}")
+        cdp_send_many(ws_url, [
+            ('Input.dispatchMouseEvent', {'type': 'mousePressed', 'x': rx, 'y': ry, 'button': 'left', 'clickCount': 1}),
+            ('Input.dispatchMouseEvent', {'type': 'mouseReleased', 'x': rx, 'y': ry, 'button': 'left', 'clickCount': 1}),
+        ])
+        cdp_wait_for(ws_url, "location.pathname.indexOf('/store/') !== -1", timeout=5.0)
+
+    # Verify we navigated to restaurant page. The fallback store-link lookup is cheap,
+    # so it rides along in the same round trip.
+    find_store_script = '''
+    (function() {
+        var links = document.querySelectorAll('a[href*="/store/"]');
+        for (var i = 0; i < links.length; i++) {
+            var link = links[i];
+            var rect = link.getBoundingClientRect();
+            if (rect.top > 100 && rect.width > 50) {
+                return {found: true, href: link.href, text: link.textContent.substring(0, 50)};
+            }
+        }
+        return {found: false};
+    })();
+    '''
+    page = cdp_eval_batch(ws_url, {'url': 'window.location.href', 'store': find_store_script})
+    current_url = page.get('url') or ''
+    log(f"Current URL: {current_url}")
 
     # Check if we're actually on a store page
-    try:
-        current_url = page_check.get('result', {}).get('result', {}).get('value', '')
-    except:
-        current_url = ''
-
     if '/store/' not in current_url:
         log("Not on a store page, trying to find and click first restaurant link...")
         # Try to find any restaurant link on the page and navigate
-        find_any_store = cdp_execute_script(ws_url, '''
-        (function() {
-            var links = document.querySelectorAll('a[href*="/store/"]');
-            for (var i = 0; i < links.length; i++) {
-                var link = links[i];
-                var rect = link.getBoundingClientRect();
-                if (rect.top > 100 && rect.width > 50) {
-                    return {found: true, href: link.href, text: link.textContent.substring(0, 50)};
-                }
-            }
-            return {found: false};
-        })();
-        ''')
-        log(f"Found store link: {find_any_store}")
-
-        try:
-            store_link = find_any_store.get('result', {}).get('result', {}).get('value', {})
-        except:
-            store_link = {}
+        store_link = page.get('store') or {}
+        log(f"Found store link: {store_link}")
 
         if store_link.get('found') and store_link.get('href'):
             log(f"Navigating to store: {store_link['href']}")
-            cdp_navigate(ws_url, store_link['href'])
-            time.sleep(5)
+            cdp_navigate_and_wait(ws_url, store_link['href'], timeout=5.0)
 
     # Step 7: If surprise_me, research top dishes for this restaurant
     recommended_dish = None
@@ -2500,54 +4031,57 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
 
     # Step 8: Get menu items from restaurant page
     log("Getting menu items...")
-    time.sleep(2)
 
-    # Wait for menu to load - check if we're on a restaurant page
-    page_check = cdp_execute_script(ws_url, '''
+    # Check if we're on a restaurant page
+    page_check_script = '''
     (function() {
+        var bodyText = document.body.innerText;
         return {
             url: window.location.href,
-            hasMenu: document.body.innerText.includes('$'),
-            pageText: document.body.innerText.substring(0, 500)
+            hasMenu: bodyText.includes('$'),
+            pageText: bodyText.substring(0, 500)
         };
     })();
-    ''')
-    log(f"Restaurant page check: {page_check}")
-
-    # Scroll down to load more menu items
-    cdp_execute_script(ws_url, 'window.scrollBy(0, 300);')
-    time.sleep(1)
+    '''
 
     menu_script = '''
     (function() {
         var items = [];
         var seen = {};
 
-        // Look for clickable elements that have a price
-        var allElements = document.querySelectorAll('button, [role="button"], li, article, div');
-
-        allElements.forEach(function(el) {
-            if (items.length >= 15) return;
-
-            var text = (el.textContent || '').trim();
+        // Look for clickable elements that have a price. An element's text contains
+        // all of its descendants' text, so once one has no price (or is too short to
+        // be an item) its whole subtree is skipped.
+        var CANDIDATE = {BUTTON: 1, LI: 1, ARTICLE: 1, DIV: 1};
+        var text = '';
+        var walker = document.createTreeWalker(document.body, NodeFilter.SHOW_ELEMENT, {
+            acceptNode: function(el) {
+                if (!CANDIDATE[el.tagName] && el.getAttribute('role') !== 'button') return NodeFilter.FILTER_SKIP;
+                text = (el.textContent || '').trim();
+                // Must have a price
+                if (!text.includes('$') || text.length < 10) return NodeFilter.FILTER_REJECT;
+                return NodeFilter.FILTER_ACCEPT;
+            }
+        });
 
-            // Must have a price
-            if (!text.includes('$')) return;
+        while (items.length < 15) {
+            var el = walker.nextNode();
+            if (!el) break;
 
             // Extract price
             var priceMatch = text.match(/\\$\\d+\\.?\\d*/);
-            if (!priceMatch) return;
+            if (!priceMatch) continue;
 
-            // Skip if too long (probably a container) or too short
-            if (text.length > 300 || text.length < 10) return;
+            // Skip if too long (probably a container)
+            if (text.length > 300) continue;
 
             // Get just the item name (text before the price usually)
             var parts = text.split('$')[0].trim();
             var name = parts.split('\\n')[0].trim();
-            if (name.length < 3 || name.length > 80) return;
+            if (name.length < 3 || name.length > 80) continue;
 
             // Skip duplicates
-            if (seen[name]) return;
+            if (seen[name]) continue;
             seen[name] = true;
 
             var rect = el.getBoundingClientRect();
@@ -2560,7 +4094,7 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
                     y: rect.top + rect.height/2
                 });
             }
-        });
+        }
 
         return {
             count: items.length,
@@ -2569,13 +4103,18 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
         };
     })();
     '''
-    menu_result = cdp_execute_script(ws_url, menu_script)
-    log(f"Menu items: {menu_result}")
-
-    try:
-        menu_data = menu_result.get('result', {}).get('result', {}).get('value', {})
-    except:
-        menu_data = {}
+    # Wait for the menu to load, check the page, scroll down to load more menu
+    # items and read them - one round trip
+    menu_batch = cdp_eval_batch(ws_url, {
+        'settle': _dom_quiet_js(0.3, 2.0),
+        'page': page_check_script,
+        'scroll': 'window.scrollBy(0, 300)',
+        'settled': _dom_quiet_js(0.2, 1.0),
+        'menu': menu_script,
+    })
+    log(f"Restaurant page check: {menu_batch.get('page')}")
+    menu_data = menu_batch.get('menu') or {}
+    log(f"Menu items: {menu_data}")
 
     menu_items = menu_data.get('items', [])
 
@@ -2670,7 +4209,7 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
 
     # First scroll down to see menu items
     cdp_execute_script(ws_url, 'window.scrollBy(0, 350);')
-    time.sleep(1)
+    cdp_wait_for_dom_quiet(ws_url, quiet=0.2, timeout=1.0)
 
     # Clean up item name for searching (remove prefixes like "#1 most likedPlus small")
     clean_name = selected_item['name']
@@ -2746,20 +4285,15 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
     click_result = cdp_execute_script(ws_url, click_item_script)
     log(f"Click item result: {click_result}")
 
-    try:
-        click_data = click_result.get('result', {}).get('result', {}).get('value', {})
-    except:
-        click_data = {}
+    click_data = _eval_value(click_result)
 
-    time.sleep(3)  # Wait for modal to open
+    cdp_wait_for_selector(ws_url, _EATS_ITEM_MODAL, timeout=3.0)
 
     # Verify modal opened - check for dialog element
     modal_verify = cdp_execute_script(ws_url, '''
     (function() {
-        var dialog = document.querySelector('[role="dialog"], [data-testid*="modal"], [class*="modal"]');
-        var bodyText = document.body.innerText.toLowerCase();
-        var hasAddBtn = bodyText.includes('add 1') || bodyText.includes('add to cart') ||
-                        bodyText.includes('add to order') || bodyText.includes('add for');
+        var dialog = document.querySelector('%s');
+        var hasAddBtn = /add 1|add to cart|add to order|add for/i.test(document.body.innerText);
 
         return {
             hasDialog: dialog !== null,
@@ -2768,13 +4302,10 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
             url: window.location.href
         };
     })();
-    ''')
+    ''' % _EATS_ITEM_MODAL)
     log(f"Modal verify: {modal_verify}")
 
-    try:
-        modal_data = modal_verify.get('result', {}).get('result', {}).get('value', {})
-    except:
-        modal_data = {}
+    modal_data = _eval_value(modal_verify)
 
     # If modal didn't open, try direct coordinate click
     if not modal_data.get('hasDialog') and not modal_data.get('hasAddButton'):
@@ -2797,39 +4328,34 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
                 return {scrolled: false};
             })();
             ''')
-            time.sleep(1)
+            cdp_wait_for_dom_quiet(ws_url, quiet=0.2, timeout=1.0)
             ix = min(ix, 600)  # Adjust to visible area
 
         log(f"Clicking at coordinates ({ix}, {iy})")
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mousePressed', 'x': ix, 'y': iy, 'button': 'left', 'clickCount': 1
-        })
-        time.sleep(0.1)
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mouseReleased', 'x': ix, 'y': iy, 'button': 'left', 'clickCount': 1
-        })
-        time.sleep(3)
+        cdp_send_many(ws_url, [
+            ('Input.dispatchMouseEvent', {'type': 'mousePressed', 'x': ix, 'y': iy, 'button': 'left', 'clickCount': 1}),
+            ('Input.dispatchMouseEvent', {'type': 'mouseReleased', 'x': ix, 'y': iy, 'button': 'left', 'clickCount': 1}),
+        ])
+        cdp_wait_for_selector(ws_url, _EATS_ITEM_MODAL, timeout=3.0)
 
     # Step 10: Click "Add to Cart" or similar button
     log("Looking for Add to Cart button...")
-    time.sleep(1)  # Extra wait for modal to fully render
 
     # Check what's on the page after clicking item
-    modal_check = cdp_execute_script(ws_url, '''
+    modal_check_script = '''
     (function() {
-        var bodyText = document.body.innerText.toLowerCase();
+        var bodyText = document.body.innerText;
         return {
-            hasAddButton: bodyText.includes('add to') || bodyText.includes('add 1'),
-            hasCustomize: bodyText.includes('required') || bodyText.includes('choose') || bodyText.includes('select'),
-            pageText: document.body.innerText.substring(0, 800)
+            hasAddButton: /add to|add 1/i.test(bodyText),
+            hasCustomize: /required|choose|select/i.test(bodyText),
+            pageText: bodyText.substring(0, 800)
         };
     })();
-    ''')
-    log(f"Modal check: {modal_check}")
+    '''
 
     # Handle required customizations - ONLY select required fields, skip optional add-ons
     # First scroll modal to TOP to find required sections
-    cdp_execute_script(ws_url, '''
+    scroll_top_script = '''
     (function() {
         var modal = document.querySelector('[role="dialog"]');
         if (modal) {
@@ -2839,11 +4365,10 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
             for (var s of scrollables) { s.scrollTop = 0; }
         }
     })();
-    ''')
-    time.sleep(0.5)
+    '''
 
     # Debug: Log what's inside the modal
-    modal_debug = cdp_execute_script(ws_url, '''
+    modal_debug_script = '''
     (function() {
         var modal = document.querySelector('[role="dialog"]');
         if (!modal) return {error: 'No modal found'};
@@ -2875,12 +4400,11 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
             textPreview: allText.substring(0, 500)
         };
     })();
-    ''')
-    log(f"Modal debug: {modal_debug}")
+    '''
 
     # EXTRACT CUSTOMIZATION QUESTIONS from the modal using DOM structure
     # This finds actual customization sections and their options
-    extract_questions = cdp_execute_script(ws_url, '''
+    extract_questions_script = '''
     (function() {
         var modal = document.querySelector('[role="dialog"]');
         if (!modal) return {error: 'No modal found'};
@@ -2981,13 +4505,22 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
             modalText: allText.substring(0, 800)
         };
     })();
-    ''')
-    log(f"Extracted questions: {extract_questions}")
+    '''
 
-    try:
-        questions_data = extract_questions.get('result', {}).get('result', {}).get('value', {})
-    except:
-        questions_data = {}
+    # Let the modal render, then check it, scroll it to the top and read its
+    # customization questions - one round trip
+    modal = cdp_eval_batch(ws_url, {
+        'settle': _dom_quiet_js(0.2, 1.0),
+        'check': modal_check_script,
+        'scroll': scroll_top_script,
+        'settled': _dom_quiet_js(0.1, 0.5),
+        'debug': modal_debug_script,
+        'questions': extract_questions_script,
+    })
+    log(f"Modal check: {modal.get('check')}")
+    log(f"Modal debug: {modal.get('debug')}")
+    questions_data = modal.get('questions') or {}
+    log(f"Extracted questions: {questions_data}")
 
     questions_list = questions_data.get('questions', [])
 
@@ -3055,7 +4588,7 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
 
             apply_answer = cdp_execute_script(ws_url, js_code)
             log(f"Apply answer result: {apply_answer}")
-            time.sleep(0.3)
+            cdp_wait_for_dom_quiet(ws_url, quiet=0.1, timeout=0.3)
 
     # Check for interrupt before customization loop
     if check_interrupt():
@@ -3066,93 +4599,24 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
         # Check for interrupt in loop
         if check_interrupt():
             return {'success': False, 'error': 'Operation cancelled by user', 'interrupted': True}
-        select_required = cdp_execute_script(ws_url, '''
-        (function() {
-            var modal = document.querySelector('[role="dialog"]');
-            if (!modal) return {error: 'No modal'};
-
-            var results = {clicked: [], debug: []};
-
-            // Find required sections that don't have a selection yet
-            var sections = modal.querySelectorAll('[data-testid="customization-pick-one"], [data-testid*="customization"]');
-
-            for (var s = 0; s < sections.length; s++) {
-                var section = sections[s];
-                var sectionText = section.innerText || '';
-
-                // Only process required sections
-                if (!sectionText.includes('Required')) continue;
-
-                // Check if already has selection
-                var hasSelection = section.querySelector('[aria-checked="true"], input:checked, .selected');
-                if (hasSelection) continue;
-
-                // Find first unselected option and click it
-                var options = section.querySelectorAll('label, [role="radio"], li');
-                for (var o = 0; o < options.length; o++) {
-                    var opt = options[o];
-                    var isSelected = opt.querySelector('[aria-checked="true"], input:checked');
-                    if (isSelected) continue;
-
-                    var optText = (opt.textContent || '').trim();
-                    if (optText.length < 3 || optText.includes('Required')) continue;
-
-                    opt.scrollIntoView({behavior: 'instant', block: 'center'});
-                    opt.click();
-                    results.clicked.push(optText.substring(0, 40));
-                    break;
-                }
-            }
-
-            return results;
-        })();
-        ''')
+        select_required = cdp_run_script(ws_url, _EATS_SELECT_REQUIRED_JS, 'eats_select_required.js')
         log(f"Auto-select round {custom_round+1}: {select_required}")
 
-        time.sleep(0.5)
+        cdp_wait_for_dom_quiet(ws_url, quiet=0.1, timeout=0.5)
 
         # Check if Add button is now enabled
-        check_add = cdp_execute_script(ws_url, '''
-        (function() {
-            var modal = document.querySelector('[role="dialog"]');
-            if (!modal) return {error: 'No modal'};
-
-            var addBtn = null;
-            var buttons = modal.querySelectorAll('button');
-            for (var i = 0; i < buttons.length; i++) {
-                var text = (buttons[i].textContent || '').toLowerCase();
-                if (text.includes('add 1') || text.includes('add to order') || text.includes('add for $')) {
-                    addBtn = buttons[i];
-                    break;
-                }
-            }
-
-            return {
-                addBtnFound: addBtn !== null,
-                addBtnEnabled: addBtn ? !addBtn.disabled : false,
-                addBtnText: addBtn ? addBtn.textContent.trim().substring(0, 40) : null
-            };
-        })();
-        ''')
+        check_add = cdp_run_script(ws_url, _EATS_ADD_BUTTON_STATE_JS, 'eats_add_button_state.js')
         log(f"Add button check: {check_add}")
 
-        try:
-            add_data = check_add.get('result', {}).get('result', {}).get('value', {})
-        except:
-            add_data = {}
+        add_data = _eval_value(check_add)
 
         if add_data.get('addBtnEnabled'):
             log("Add button is now enabled!")
             break
 
         # Scroll modal if needed
-        cdp_execute_script(ws_url, '''
-        (function() {
-            var modal = document.querySelector('[role="dialog"]');
-            if (modal) modal.scrollTop += 200;
-        })();
-        ''')
-        time.sleep(0.3)
+        cdp_run_script(ws_url, _EATS_MODAL_SCROLL_JS, 'eats_modal_scroll.js')
+        cdp_wait_for_dom_quiet(ws_url, quiet=0.1, timeout=0.3)
 
     # Final: scroll to bottom to see Add button
     cdp_execute_script(ws_url, '''
@@ -3161,7 +4625,7 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
         if (modal) modal.scrollTop = modal.scrollHeight;
     })();
     ''')
-    time.sleep(0.5)
+    cdp_wait_for_dom_quiet(ws_url, quiet=0.1, timeout=0.5)
 
     # Check for interrupt before Add to Cart
     if check_interrupt():
@@ -3172,118 +4636,51 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
     for attempt in range(3):
         if check_interrupt():
             return {'success': False, 'error': 'Operation cancelled by user', 'interrupted': True}
-        add_cart_script = '''
-        (function() {
-            var buttons = document.querySelectorAll('button');
-            var targets = ['add to cart', 'add to order', 'add item', 'add 1 to order', 'add 1 for'];
-
-            for (var i = 0; i < buttons.length; i++) {
-                var btn = buttons[i];
-                var text = (btn.textContent || '').toLowerCase();
-
-                // Skip disabled buttons
-                if (btn.disabled) continue;
-
-                for (var j = 0; j < targets.length; j++) {
-                    if (text.includes(targets[j])) {
-                        btn.scrollIntoView({behavior: 'instant', block: 'center'});
-
-                        // Try multiple click methods
-                        btn.focus();
-                        btn.click();
-
-                        // Also dispatch a real click event
-                        var evt = new MouseEvent('click', {
-                            bubbles: true,
-                            cancelable: true,
-                            view: window
-                        });
-                        btn.dispatchEvent(evt);
-
-                        return {
-                            found: true,
-                            clicked: true,
-                            text: btn.textContent.trim(),
-                            disabled: btn.disabled
-                        };
-                    }
-                }
-            }
-            return {found: false, availableButtons: Array.from(buttons).slice(0,10).map(b => b.textContent.trim().substring(0,30))};
-        })();
-        '''
-        add_cart_result = cdp_execute_script(ws_url, add_cart_script)
+        add_cart_result = cdp_run_script(ws_url, _EATS_ADD_TO_CART_JS, 'eats_add_to_cart.js')
         log(f"Add to cart attempt {attempt+1}: {add_cart_result}")
 
-        try:
-            add_btn = add_cart_result.get('result', {}).get('result', {}).get('value', {})
-        except:
-            add_btn = {}
+        add_btn, add_error = _cdp_result_value(add_cart_result)
+        add_btn = add_btn or {}
 
         if add_btn.get('clicked'):
             add_success = True
             log(f"Clicked: {add_btn.get('text', 'unknown')}")
-            time.sleep(2)
+            # The modal closes once the item is in the cart
+            cdp_wait_for(ws_url, "!document.querySelector('[role=\"dialog\"]')", timeout=2.0)
             break
+        elif add_error:
+            log(f"Add to cart script error: {add_error}")
+            cdp_wait_for_dom_quiet(ws_url, quiet=0.2, timeout=1.0)
         else:
             log(f"Add button not found, available: {add_btn.get('availableButtons', [])}")
-            time.sleep(1)
+            cdp_wait_for_dom_quiet(ws_url, quiet=0.2, timeout=1.0)
 
     if not add_success:
         log("Failed to click Add to Cart after 3 attempts")
+        if add_error:
+            return {'success': False, 'error': f'Could not add the item to the cart: {add_error}'}
 
     # Step 11: Go to cart and checkout
     log("Looking for cart/checkout...")
 
-    cart_script = '''
-    (function() {
-        // Look for cart button or checkout
-        var targets = ['view cart', 'go to cart', 'checkout', 'view order'];
+    # Look for cart button or checkout and click it in the same evaluate
+    cart_btn = cdp_js_click(ws_url, '''(function() {
+        var targets = /view cart|go to cart|checkout|view order/;
         var buttons = document.querySelectorAll('button, a');
-
         for (var i = 0; i < buttons.length; i++) {
-            var text = (buttons[i].textContent || '').toLowerCase();
-            for (var j = 0; j < targets.length; j++) {
-                if (text.includes(targets[j])) {
-                    buttons[i].scrollIntoView({behavior: 'instant', block: 'center'});
-                    var rect = buttons[i].getBoundingClientRect();
-                    return {
-                        found: true,
-                        text: buttons[i].textContent.trim(),
-                        x: rect.left + rect.width/2,
-                        y: rect.top + rect.height/2
-                    };
-                }
-            }
+            if (targets.test((buttons[i].textContent || '').toLowerCase())) return buttons[i];
         }
-        return {found: false};
-    })();
-    '''
-    cart_result = cdp_execute_script(ws_url, cart_script)
-    log(f"Cart/checkout: {cart_result}")
-
-    try:
-        cart_btn = cart_result.get('result', {}).get('result', {}).get('value', {})
-    except:
-        cart_btn = {}
+        return null;
+    })()''')
+    log(f"Cart/checkout: {cart_btn}")
 
-    if cart_btn.get('found'):
-        time.sleep(0.3)
-        cx, cy = cart_btn['x'], cart_btn['y']
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mousePressed', 'x': cx, 'y': cy, 'button': 'left', 'clickCount': 1
-        })
-        time.sleep(0.1)
-        cdp_send(ws_url, 'Input.dispatchMouseEvent', {
-            'type': 'mouseReleased', 'x': cx, 'y': cy, 'button': 'left', 'clickCount': 1
-        })
-        time.sleep(3)
+    if cart_btn.get('clicked'):
+        cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=3.0, require_change=True)
 
     # Step 12: Final verification - check if item is actually in cart
     verify_script = '''
     (function() {
         var bodyText = document.body.innerText;
-        var lowerText = bodyText.toLowerCase();
 
         // Look for cart indicators
         var hasCartBadge = false;
@@ -3300,16 +4697,16 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
         var viewCartBtn = null;
         var buttons = document.querySelectorAll('button, a');
         for (var j = 0; j < buttons.length; j++) {
-            var btnText = (buttons[j].textContent || '').toLowerCase();
-            if (btnText.includes('view cart') || btnText.includes('view order') || btnText.includes('checkout')) {
+            if (/view cart|view order|checkout/i.test(buttons[j].textContent || '')) {
                 viewCartBtn = buttons[j].textContent.trim();
                 break;
             }
         }
 
         return {
-            inCart: lowerText.includes('your order') || lowerText.includes('cart') || lowerText.includes('checkout'),
-            hasItems: lowerText.includes('$') && (lowerText.includes('subtotal') || lowerText.includes('total')),
+            inCart: /your order|cart|checkout/i.test(bodyText),
+            // 'total' also covers 'subtotal'
+            hasItems: bodyText.includes('$') && /total/i.test(bodyText),
             hasCartBadge: hasCartBadge,
             viewCartBtn: viewCartBtn,
             pageText: bodyText.substring(0, 800)
@@ -3319,10 +4716,7 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
     final_state = cdp_execute_script(ws_url, verify_script)
     log(f"Final state: {final_state}")
 
-    try:
-        state = final_state.get('result', {}).get('result', {}).get('value', {})
-    except:
-        state = {}
+    state = _eval_value(final_state)
 
     # Determine actual success
     cart_verified = state.get('hasCartBadge', False) or state.get('hasItems', False) or add_success
@@ -3348,26 +4742,23 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
 
     # Step 13: Automatically proceed to checkout with quantity 1
     log("Proceeding to checkout...")
-    time.sleep(1)
 
     # Click View Cart / Go to Checkout button
     checkout_click = cdp_execute_script(ws_url, '''
     (function() {
         var buttons = document.querySelectorAll('button, a');
-        var targets = ['view cart', 'go to checkout', 'checkout', 'view order'];
+        // 'checkout' also covers 'go to checkout'
+        var targets = /view cart|checkout|view order/;
 
         for (var i = 0; i < buttons.length; i++) {
             var btn = buttons[i];
-            var text = (btn.textContent || '').toLowerCase();
-
             if (btn.disabled) continue;
 
-            for (var j = 0; j < targets.length; j++) {
-                if (text.includes(targets[j])) {
-                    btn.scrollIntoView({behavior: 'instant', block: 'center'});
-                    btn.click();
-                    return {clicked: true, text: btn.textContent.trim()};
-                }
+            var text = (btn.textContent || '').toLowerCase();
+            if (targets.test(text)) {
+                btn.scrollIntoView({behavior: 'instant', block: 'center'});
+                btn.click();
+                return {clicked: true, text: btn.textContent.trim()};
             }
         }
 
@@ -3382,15 +4773,14 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
     })();
     ''')
     log(f"Checkout click: {checkout_click}")
-    time.sleep(3)
+    cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=3.0, require_change=True)
 
     # Click "Go to Checkout" if we're in cart view
     go_checkout = cdp_execute_script(ws_url, '''
     (function() {
         var buttons = document.querySelectorAll('button, a');
         for (var i = 0; i < buttons.length; i++) {
-            var text = (buttons[i].textContent || '').toLowerCase();
-            if (text.includes('go to checkout') || text.includes('proceed to checkout')) {
+            if (/(go to|proceed to) checkout/i.test(buttons[i].textContent || '')) {
                 buttons[i].click();
                 return {clicked: true, text: buttons[i].textContent.trim()};
             }
@@ -3399,7 +4789,7 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
     })();
     ''')
     log(f"Go to checkout: {go_checkout}")
-    time.sleep(3)
+    cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=3.0, require_change=True)
 
     # Check for interrupt before popup handling
     if check_interrupt():
@@ -3409,135 +4799,26 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
     for popup_attempt in range(3):
         if check_interrupt():
             return {'success': False, 'error': 'Operation cancelled by user', 'interrupted': True}
-        dismiss_popup = cdp_execute_script(ws_url, '''
-        (function() {
-            // First check if we're already on the final checkout page (no popup needed)
-            var pageText = document.body.innerText.toLowerCase();
-            if (pageText.includes('place order') && !document.querySelector('[role="dialog"]')) {
-                return {dismissed: false, reason: 'already on checkout', onCheckout: true};
-            }
-
-            // Look for modal/dialog overlay - try multiple selectors
-            var modal = document.querySelector('[role="dialog"]');
-            if (!modal) modal = document.querySelector('[data-testid*="modal"]');
-            if (!modal) modal = document.querySelector('[aria-modal="true"]');
-            if (!modal) modal = document.querySelector('[class*="modal"]');
-            if (!modal) modal = document.querySelector('[class*="Modal"]');
-            if (!modal) modal = document.querySelector('[class*="overlay"]');
-            if (!modal) modal = document.querySelector('[class*="Overlay"]');
-
-            // Try finding by z-index (popups usually have high z-index)
-            if (!modal) {
-                var allDivs = document.querySelectorAll('div');
-                for (var d = 0; d < allDivs.length; d++) {
-                    var div = allDivs[d];
-                    var style = window.getComputedStyle(div);
-                    var zIndex = parseInt(style.zIndex) || 0;
-                    var position = style.position;
-
-                    // High z-index, fixed/absolute position, covering screen
-                    if (zIndex > 100 && (position === 'fixed' || position === 'absolute')) {
-                        var rect = div.getBoundingClientRect();
-                        if (rect.width > 300 && rect.height > 200) {
-                            modal = div;
-                            break;
-                        }
-                    }
-                }
-            }
-
-            if (!modal) return {dismissed: false, reason: 'no modal found'};
-
-            // Find all buttons - search INSIDE the modal first, then globally if needed
-            var buttons = modal.querySelectorAll('button');
-
-            // Find the bottom-most visible button (horizontal bar at bottom of popup)
-            var bottomBtn = null;
-            var maxY = -1;
-
-            for (var i = 0; i < buttons.length; i++) {
-                var btn = buttons[i];
-
-                // Skip disabled
-                if (btn.disabled) continue;
-
-                // Skip navigation/accessibility links
-                var text = (btn.textContent || '').toLowerCase().trim();
-                if (text === 'skip to content' || text === 'back' || text === 'close') continue;
-
-                var rect = btn.getBoundingClientRect();
-
-                // Must be visible (has size and on screen)
-                if (rect.width < 80 || rect.height < 30) continue;
-                if (rect.bottom < 0 || rect.top > window.innerHeight) continue;
-
-                // Track the bottom-most button
-                if (rect.bottom > maxY) {
-                    maxY = rect.bottom;
-                    bottomBtn = btn;
-                }
-            }
-
-            if (bottomBtn) {
-                bottomBtn.scrollIntoView({behavior: 'instant', block: 'center'});
-                bottomBtn.click();
-                return {
-                    dismissed: true,
-                    text: bottomBtn.textContent.trim().substring(0, 50),
-                    method: 'bottom-button',
-                    y: maxY
-                };
-            }
-
-            // Try finding buttons with common dismiss text anywhere on page
-            var dismissTexts = ['next', 'skip', 'continue', 'no thanks', 'not now', 'done', 'got it'];
-            var allButtons = document.querySelectorAll('button');
-            for (var j = 0; j < allButtons.length; j++) {
-                var b = allButtons[j];
-                var bText = (b.textContent || '').toLowerCase().trim();
-                for (var k = 0; k < dismissTexts.length; k++) {
-                    if (bText === dismissTexts[k] || bText.startsWith(dismissTexts[k] + ' ')) {
-                        var bRect = b.getBoundingClientRect();
-                        if (bRect.width > 50 && bRect.height > 20 && !b.disabled) {
-                            b.click();
-                            return {dismissed: true, text: b.textContent.trim(), method: 'text-match'};
-                        }
-                    }
-                }
-            }
-
-            // Fallback: try clicking X/close buttons
-            var closeBtn = modal.querySelector('[aria-label="Close"], [aria-label="close"], button[class*="close"]');
-            if (closeBtn) {
-                closeBtn.click();
-                return {dismissed: true, method: 'close-btn'};
-            }
-
-            return {dismissed: false, hasModal: true, buttonCount: buttons.length};
-        })();
-        ''')
+        dismiss_popup = cdp_run_script(ws_url, _EATS_DISMISS_POPUP_JS, 'eats_dismiss_popup.js')
         log(f"Popup dismiss attempt {popup_attempt+1}: {dismiss_popup}")
 
-        try:
-            popup_data = dismiss_popup.get('result', {}).get('result', {}).get('value', {})
-        except:
-            popup_data = {}
+        popup_data = _eval_value(dismiss_popup)
 
         if popup_data.get('dismissed'):
-            time.sleep(1.5)
+            cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=1.5, require_change=True)
             # Keep trying in case there are multiple popups
         else:
             # No more popups to dismiss
             break
 
-    time.sleep(1)
+    cdp_wait_for_dom_quiet(ws_url, quiet=0.2, timeout=1.0)
 
     # Check final state
     final_check = cdp_execute_script(ws_url, '''
     (function() {
         var url = window.location.href;
         var bodyText = document.body.innerText;
-        var isCheckout = url.includes('checkout') || bodyText.toLowerCase().includes('place order');
+        var isCheckout = url.includes('checkout') || /place order/i.test(bodyText);
 
         return {
             url: url,
@@ -3548,10 +4829,7 @@ def order_uber_eats(pickup_lat, pickup_lon, pickup_address, cuisine_type='', sur
     ''')
     log(f"Final check: {final_check}")
 
-    try:
-        final_data = final_check.get('result', {}).get('result', {}).get('value', {})
-    except:
-        final_data = {}
+    final_data = _eval_value(final_check)
 
     on_checkout = final_data.get('isCheckout', False)
 
@@ -3574,23 +4852,20 @@ def set_quantity_and_checkout(quantity=1):
     """
     Set the quantity for the item in cart and proceed to checkout.
     """
-    import time
-
     log(f"Setting quantity to {quantity} and going to checkout...")
 
-    # Get CDP connection
-    targets = cdp_get_targets()
-    if targets is None:
+    # Get CDP connection - the Uber Eats tab the order was placed in, unless another
+    # flow is driving it right now
+    target = cdp_claim_page('ubereats.com')
+    if target is None:
         return {'success': False, 'error': 'Chrome not connected'}
+    try:
+        return _checkout_in_tab(target['webSocketDebuggerUrl'], quantity)
+    finally:
+        cdp_release_page(target)
 
-    ws_url = None
-    for target in targets:
-        if target.get('type') == 'page':
-            ws_url = target.get('webSocketDebuggerUrl')
-            break
-
-    if not ws_url:
-        return {'success': False, 'error': 'No Chrome tab available'}
+def _checkout_in_tab(ws_url, quantity):
+    """set_quantity_and_checkout, driving the page target at ws_url"""
 
     # First, find and click the cart icon to open cart
     open_cart = cdp_execute_script(ws_url, '''
@@ -3617,63 +4892,44 @@ def set_quantity_and_checkout(quantity=1):
     })();
     ''')
     log(f"Open cart: {open_cart}")
-    time.sleep(2)
+    cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=2.0, require_change=True)
 
     # If quantity > 1, we need to increase it
     if quantity > 1:
         for q in range(quantity - 1):
-            increase_qty = cdp_execute_script(ws_url, '''
-            (function() {
-                // Look for + button or increase quantity button
-                var buttons = document.querySelectorAll('button, [role="button"]');
-                for (var i = 0; i < buttons.length; i++) {
-                    var btn = buttons[i];
-                    var text = btn.textContent || '';
-                    var label = btn.getAttribute('aria-label') || '';
-
-                    // Look for + or "increase" or "add"
-                    if (text === '+' || text === 'Add' || label.includes('increase') || label.includes('Increase') || label.includes('add 1')) {
-                        btn.click();
-                        return {clicked: true, btn: text || label};
-                    }
-                }
-
-                // Also try finding by Plus icon
-                var plusBtns = document.querySelectorAll('[data-testid*="increase"], [data-testid*="plus"], [aria-label*="Add"]');
-                if (plusBtns.length > 0) {
-                    plusBtns[0].click();
-                    return {clicked: true, method: 'plus-btn'};
-                }
-
-                return {clicked: false};
-            })();
-            ''')
+            increase_qty = cdp_run_script(ws_url, _EATS_INCREASE_QUANTITY_JS, 'eats_increase_quantity.js')
             log(f"Increase quantity: {increase_qty}")
-            time.sleep(0.5)
+            increased, error = _cdp_result_value(increase_qty)
+            if error or not (increased or {}).get('clicked'):
+                # Never go on to checkout with a quantity other than the one asked for
+                return {
+                    'success': False,
+                    'error': f"Could not set quantity to {quantity} (stuck at {q + 1}): {error or 'no + button found'}. Please adjust it in Chrome.",
+                    'quantity_set': q + 1
+                }
+            cdp_wait_for_dom_quiet(ws_url, quiet=0.1, timeout=0.5, require_change=True)
 
-    time.sleep(1)
+    cdp_wait_for_dom_quiet(ws_url, quiet=0.2, timeout=1.0)
 
     # Now click "Go to Checkout" button
     checkout_result = cdp_execute_script(ws_url, '''
     (function() {
         var buttons = document.querySelectorAll('button, a');
-        var targets = ['go to checkout', 'checkout', 'proceed to checkout', 'place order'];
+        // 'checkout' also covers 'go to checkout' and 'proceed to checkout'
+        var targets = /checkout|place order/;
 
         for (var i = 0; i < buttons.length; i++) {
             var btn = buttons[i];
-            var text = (btn.textContent || '').toLowerCase();
-
             if (btn.disabled) continue;
 
-            for (var j = 0; j < targets.length; j++) {
-                if (text.includes(targets[j])) {
-                    btn.scrollIntoView({behavior: 'instant', block: 'center'});
-                    btn.click();
-                    return {
-                        clicked: true,
-                        text: btn.textContent.trim()
-                    };
-                }
+            var text = (btn.textContent || '').toLowerCase();
+            if (targets.test(text)) {
+                btn.scrollIntoView({behavior: 'instant', block: 'center'});
+                btn.click();
+                return {
+                    clicked: true,
+                    text: btn.textContent.trim()
+                };
             }
         }
         return {clicked: false, availableButtons: Array.from(buttons).slice(0,15).map(b => b.textContent.trim().substring(0,30))};
@@ -3681,12 +4937,9 @@ def set_quantity_and_checkout(quantity=1):
     ''')
     log(f"Checkout click: {checkout_result}")
 
-    try:
-        checkout_data = checkout_result.get('result', {}).get('result', {}).get('value', {})
-    except:
-        checkout_data = {}
+    checkout_data = _eval_value(checkout_result)
 
-    time.sleep(3)
+    cdp_wait_for_dom_quiet(ws_url, quiet=0.3, timeout=3.0, require_change=True)
 
     # Verify we're on checkout page
     verify_checkout = cdp_execute_script(ws_url, '''
@@ -3695,7 +4948,7 @@ def set_quantity_and_checkout(quantity=1):
         var url = window.location.href;
 
         return {
-            onCheckout: url.includes('checkout') || bodyText.toLowerCase().includes('place order') || bodyText.toLowerCase().includes('payment'),
+            onCheckout: url.includes('checkout') || /place order|payment/i.test(bodyText),
             url: url,
             pagePreview: bodyText.substring(0, 500)
         };
@@ -3703,10 +4956,7 @@ def set_quantity_and_checkout(quantity=1):
     ''')
     log(f"Checkout verify: {verify_checkout}")
 
-    try:
-        verify_data = verify_checkout.get('result', {}).get('result', {}).get('value', {})
-    except:
-        verify_data = {}
+    verify_data = _eval_value(verify_checkout)
 
     return {
         'success': checkout_data.get('clicked', False),
@@ -3738,17 +4988,10 @@ def order_amazon(item_description, check_previous_orders=True, quantity=1):
     clear_interrupt()
 
     # Step 1: Check CDP connection
-    targets = cdp_get_targets()
-    if targets is None:
-        return {'success': False, 'error': 'Chrome debug mode not running. Start agent.py to auto-launch Chrome.'}
-
-    ws_url = None
-    for target in targets:
-        if target.get('type') == 'page':
-            ws_url = target.get('webSocketDebuggerUrl')
-            break
-
+    ws_url = cdp_page_ws_url('amazon.')
     if not ws_url:
+        if cdp_get_targets() is None:
+            return {'success': False, 'error': 'Chrome debug mode not running. Start agent.py to auto-launch Chrome.'}
         return {'success': False, 'error': 'No Chrome tab available'}
 
     log(f"Connected to Chrome tab: {ws_url}")
@@ -3780,10 +5023,7 @@ def order_amazon(item_description, check_previous_orders=True, quantity=1):
     ''')
     log(f"Login check: {login_check}")
 
-    try:
-        login_state = login_check.get('result', {}).get('result', {}).get('value', {})
-    except:
-        login_state = {}
+    login_state = _eval_value(login_check)
 
     if login_state.get('needsLogin'):
         return {
@@ -3817,10 +5057,7 @@ def order_amazon(item_description, check_previous_orders=True, quantity=1):
         search_box_result = cdp_execute_script(ws_url, search_orders_script)
         log(f"Order search box: {search_box_result}")
 
-        try:
-            search_data = search_box_result.get('result', {}).get('result', {}).get('value', {})
-        except:
-            search_data = {}
+        search_data = _eval_value(search_box_result)
 
         if search_data.get('hasSearchBox'):
             # Type the search query
@@ -3867,10 +5104,7 @@ def order_amazon(item_description, check_previous_orders=True, quantity=1):
             ''')
             log(f"Order history search: {check_orders}")
 
-            try:
-                orders_data = check_orders.get('result', {}).get('result', {}).get('value', {})
-            except:
-                orders_data = {}
+            orders_data = _eval_value(check_orders)
 
             # If found matching orders, try to get "Buy it again" option
             if orders_data.get('orderCount', 0) > 0 or orders_data.get('pageHasBuyAgain'):
@@ -3972,10 +5206,7 @@ def order_amazon(item_description, check_previous_orders=True, quantity=1):
     results = cdp_execute_script(ws_url, results_script)
     log(f"Search results: {results}")
 
-    try:
-        results_data = results.get('result', {}).get('result', {}).get('value', {})
-    except:
-        results_data = {}
+    results_data = _eval_value(results)
 
     products = results_data.get('products', [])
 
@@ -4028,10 +5259,7 @@ def order_amazon(item_description, check_previous_orders=True, quantity=1):
     ''')
     log(f"Product details: {product_details}")
 
-    try:
-        details = product_details.get('result', {}).get('result', {}).get('value', {})
-    except:
-        details = {}
+    details = _eval_value(product_details)
 
     if not details.get('hasAddToCart'):
         return {
@@ -4091,10 +5319,7 @@ def order_amazon(item_description, check_previous_orders=True, quantity=1):
     ''')
     log(f"Add to cart result: {add_to_cart}")
 
-    try:
-        add_result = add_to_cart.get('result', {}).get('result', {}).get('value', {})
-    except:
-        add_result = {}
+    add_result = _eval_value(add_to_cart)
 
     if not add_result.get('clicked'):
         return {
@@ -4144,10 +5369,7 @@ def order_amazon(item_description, check_previous_orders=True, quantity=1):
         ''')
         log(f"Post-cart handling {attempt+1}: {handle_popup}")
 
-        try:
-            popup_result = handle_popup.get('result', {}).get('result', {}).get('value', {})
-        except:
-            popup_result = {}
+        popup_result = _eval_value(handle_popup)
 
         if popup_result.get('action') == 'go-to-cart':
             time.sleep(2)
@@ -4202,10 +5424,7 @@ def order_amazon(item_description, check_previous_orders=True, quantity=1):
     ''')
     log(f"Cart verification: {cart_verify}")
 
-    try:
-        cart_data = cart_verify.get('result', {}).get('result', {}).get('value', {})
-    except:
-        cart_data = {}
+    cart_data = _eval_value(cart_verify)
 
     if cart_data.get('itemCount', 0) == 0:
         return {
@@ -4263,10 +5482,7 @@ def order_amazon(item_description, check_previous_orders=True, quantity=1):
     ''')
     log(f"Final checkout state: {final_check}")
 
-    try:
-        final_data = final_check.get('result', {}).get('result', {}).get('value', {})
-    except:
-        final_data = {}
+    final_data = _eval_value(final_check)
 
     # Build response
     return {
@@ -4290,11 +5506,10 @@ def order_amazon(item_description, check_previous_orders=True, quantity=1):
     }
 
 
-def download_selected_images(indices):
-    global _cached_images
-    import urllib.request
-
-    if not _cached_images:
+async def download_selected_images(indices):
+    # list_page_images may replace the list while the downloads are in flight
+    images = _cached_images
+    if not images:
         return {'success': False, 'error': 'No cached images. Call list_page_images first.'}
 
     if not indices:
@@ -4302,38 +5517,35 @@ def download_selected_images(indices):
 
     log(f"Downloading images at indices: {indices}")
 
-    downloaded = []
-    for idx in indices:
-        if idx < 0 or idx >= len(_cached_images):
-            continue
-
-        img = _cached_images[idx]
-        src = img.get('src', '')
-        if not src:
-            continue
+    selected = [
+        (idx, images[idx]) for idx in indices
+        if 0 <= idx < len(images) and images[idx].get('src')
+    ]
+    limit = asyncio.Semaphore(IMAGE_FETCH_CONCURRENCY)
 
+    async def fetch(session, idx, img):
+        src = img['src']
         log(f"  Downloading image {idx}: {src[:50]}...")
 
-        try:
-            req = urllib.request.Request(src, headers={
-                'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36'
-            })
-            with urllib.request.urlopen(req, timeout=10) as response:
-                image_data = response.read()
-                image_b64 = base64.b64encode(image_data).decode('utf-8')
-
-                downloaded.append({
-                    'image_data': image_b64,
-                    'url': img.get('url', ''),
-                    'src': src,
-                    'alt': img.get('alt', ''),
-                    'width': img.get('width', 0),
-                    'height': img.get('height', 0),
-                    'index': idx
-                })
-        except Exception as e:
-            log(f"    Failed: {e}")
-            continue
+        image_data = await _fetch_image(session, limit, src)
+        if image_data is None:
+            return None
+
+        # Raw bytes: write_response sends them as a blob, with no base64 copy
+        return {
+            'image_data': image_data,
+            'url': img.get('url', ''),
+            'src': src,
+            'alt': img.get('alt', ''),
+            'width': img.get('width', 0),
+            'height': img.get('height', 0),
+            'index': idx
+        }
+
+    # Fetch the selection concurrently, keeping the requested order
+    session = _image_session()
+    results = await asyncio.gather(*(fetch(session, idx, img) for idx, img in selected))
+    downloaded = [r for r in results if r]
 
     log(f"Downloaded {len(downloaded)} images")
     return {
@@ -4343,165 +5555,256 @@ def download_selected_images(indices):
     }
 
 
-def handle_request(data):
-    action = data.get('action')
-    if action == 'ping':
-        return {'success': True, 'message': 'pong'}
-    elif action == 'execute':
-        return execute_command(data.get('command', ''))
-    elif action == 'applescript':
-        return execute_applescript(data.get('script', ''))
-    elif action == 'read_file':
-        return read_file(data.get('filepath', ''))
-    elif action == 'read_image':
-        return read_image(data.get('filepath', ''))
-    elif action == 'screenshot':
-        return take_screenshot(mode=data.get('mode', 'full'), app_name=data.get('app_name'), region=data.get('region'))
-    elif action == 'list_windows':
-        return list_windows()
-    elif action == 'get_window_bounds':
-        return get_window_bounds(data.get('app_name', ''))
-    elif action == 'scroll':
-        return scroll_page(data.get('app_name', 'Google Chrome'), data.get('direction', 'down'), data.get('amount', 3))
-    elif action == 'execute_js':
-        return execute_js_in_chrome(data.get('js_code', ''))
-    elif action == 'capture_images':
-        return capture_webpage_images(count=data.get('count', 5), min_width=data.get('min_width', 150), min_height=data.get('min_height', 150))
-    elif action == 'list_page_images':
-        return list_page_images(min_width=data.get('min_width', 150), min_height=data.get('min_height', 150))
-    elif action == 'download_selected_images':
-        return download_selected_images(indices=data.get('indices', []))
-    elif action == 'order_uber':
-        return order_uber(
-            pickup_lat=data.get('pickup_lat'),
-            pickup_lon=data.get('pickup_lon'),
-            pickup_address=data.get('pickup_address', ''),
-            destination=data.get('destination', ''),
-            ride_type=data.get('ride_type', 'UberX'),
-            num_passengers=data.get('num_passengers', 1)
-        )
-    # New granular Uber tools
-    elif action == 'uber_open':
-        return uber_open_app(
-            pickup_lat=data.get('pickup_lat'),
-            pickup_lon=data.get('pickup_lon')
-        )
-    elif action == 'uber_get_state':
-        return uber_get_page_state()
-    elif action == 'uber_click':
-        return uber_click_element(
-            selector=data.get('selector'),
-            text_contains=data.get('text_contains'),
-            element_type=data.get('element_type', 'button')
-        )
-    elif action == 'uber_type':
-        return uber_type_text(
-            text=data.get('text', ''),
-            selector=data.get('selector'),
-            clear_first=data.get('clear_first', True)
-        )
-    elif action == 'uber_set_location':
-        return uber_set_location(
-            location_type=data.get('location_type', 'destination'),
-            lat=data.get('lat'),
-            lon=data.get('lon'),
-            address=data.get('address', '')
-        )
-    elif action == 'uber_select_autocomplete':
-        return uber_select_autocomplete(index=data.get('index', 0))
-    elif action == 'uber_select_ride':
-        return uber_select_ride_type(ride_type=data.get('ride_type', 'UberX'))
-    elif action == 'uber_confirm':
-        return uber_confirm_ride()
-    elif action == 'uber_keyboard':
-        return uber_keyboard_action(action=data.get('key', 'enter'))
-    elif action == 'order_uber_eats':
-        return order_uber_eats(
-            pickup_lat=data.get('pickup_lat'),
-            pickup_lon=data.get('pickup_lon'),
-            pickup_address=data.get('pickup_address', ''),
-            cuisine_type=data.get('cuisine_type', ''),
-            surprise_me=data.get('surprise_me', False),
-            customization_answers=data.get('customization_answers', None)
-        )
-    elif action == 'uber_eats_checkout':
-        return set_quantity_and_checkout(
-            quantity=data.get('quantity', 1)
-        )
-    elif action == 'order_amazon':
-        return order_amazon(
-            item_description=data.get('item_description', ''),
-            check_previous_orders=data.get('check_previous_orders', True),
-            quantity=data.get('quantity', 1)
-        )
-    elif action == 'interrupt':
-        # Set interrupt flag to stop current operation
-        INTERRUPT_FLAG.set()
-        log("🛑 INTERRUPT flag set - current operation will stop")
-        return {'success': True, 'message': 'Interrupt signal received'}
-    elif action == 'create_note':
-        # Create an Apple Note using AppleScript
-        title = data.get('title', 'Untitled')
-        body = data.get('body', '')
-        return create_apple_note(title, body)
-    elif action == 'get_spotify_track':
-        # Get currently playing track from Spotify web player
-        return get_spotify_current_track()
-    elif action == 'clear_interrupt':
-        # Clear interrupt flag
-        INTERRUPT_FLAG.clear()
-        return {'success': True, 'message': 'Interrupt flag cleared'}
-    return {'success': False, 'error': 'Unknown action'}
-
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-server.bind(('0.0.0.0', PORT))
-server.listen(5)
-print('=' * 50)
-print('Mac Agent v7 - Auto Chrome Debug Mode')
-print('=' * 50)
-print(f'Port: {PORT}')
-print(f'Screenshots: {SCREENSHOT_DIR}')
-print('')
-
-# Auto-start Chrome in debug mode
-ensure_chrome_debug_mode()
-print('')
+async def _ping(data):
+    return {'success': True, 'message': 'pong'}
 
-try:
-    while True:
-        try:
-            client, addr = server.accept()
-            log(f'Connection from {addr}')
-            client.settimeout(30)
-            chunks = []
-            while True:
-                chunk = client.recv(4096)
-                if not chunk:
-                    break
-                chunks.append(chunk)
-                try:
-                    json.loads(b''.join(chunks).decode('utf-8', errors='ignore'))
-                    break
-                except:
-                    continue
-            if chunks:
-                req = json.loads(b''.join(chunks).decode('utf-8', errors='ignore'))
-                if req.get('secret') == SECRET:
-                    log(f"Action: {req.get('action')}")
-                    resp = handle_request(req)
-                else:
-                    resp = {'success': False, 'error': 'Invalid secret'}
-                client.sendall(json.dumps(resp).encode('utf-8'))
-            client.close()
-            log('Done\n')
-        except Exception as e:
-            log(f'Error: {e}')
+async def _read_image_action(data):
+    return read_image(data.get('filepath', ''))
+
+async def _interrupt(data):
+    # Set interrupt flag to stop current operation
+    INTERRUPT_FLAG.set()
+    log("🛑 INTERRUPT flag set - current operation will stop")
+    return {'success': True, 'message': 'Interrupt signal received'}
+
+async def _clear_interrupt(data):
+    INTERRUPT_FLAG.clear()
+    return {'success': True, 'message': 'Interrupt flag cleared'}
+
+# action -> handler(data) returning an awaitable. Blocking handlers go through
+# asyncio.to_thread so the event loop stays free.
+_ACTIONS = {
+    'ping': _ping,
+    'execute': lambda data: execute_command(data.get('command', '')),
+    'applescript': lambda data: execute_applescript(data.get('script', '')),
+    'read_file': lambda data: asyncio.to_thread(read_file, data.get('filepath', '')),
+    'read_image': _read_image_action,
+    'screenshot': lambda data: take_screenshot(mode=data.get('mode', 'full'), app_name=data.get('app_name'), region=data.get('region'), inline=data.get('inline', False)),
+    'list_windows': lambda data: list_windows(),
+    'get_window_bounds': lambda data: get_window_bounds(data.get('app_name', '')),
+    'scroll': lambda data: scroll_page(data.get('app_name', 'Google Chrome'), data.get('direction', 'down'), data.get('amount', 3)),
+    'execute_js': lambda data: execute_js_in_chrome(data.get('js_code', '')),
+    'capture_images': lambda data: capture_webpage_images(count=data.get('count', 5), min_width=data.get('min_width', 150), min_height=data.get('min_height', 150)),
+    'list_page_images': lambda data: list_page_images(min_width=data.get('min_width', 150), min_height=data.get('min_height', 150)),
+    'download_selected_images': lambda data: download_selected_images(indices=data.get('indices', [])),
+    'order_uber': lambda data: asyncio.to_thread(
+        order_uber,
+        pickup_lat=data.get('pickup_lat'),
+        pickup_lon=data.get('pickup_lon'),
+        pickup_address=data.get('pickup_address', ''),
+        destination=data.get('destination', ''),
+        ride_type=data.get('ride_type', 'UberX'),
+        num_passengers=data.get('num_passengers', 1)
+    ),
+    # Granular Uber tools
+    'uber_open': lambda data: asyncio.to_thread(
+        uber_open_app,
+        pickup_lat=data.get('pickup_lat'),
+        pickup_lon=data.get('pickup_lon')
+    ),
+    'uber_get_state': lambda data: asyncio.to_thread(uber_get_page_state),
+    'uber_screenshot': lambda data: asyncio.to_thread(uber_screenshot),
+    'uber_snapshot': lambda data: uber_snapshot(mode=data.get('mode', 'full'), app_name=data.get('app_name'), inline=data.get('inline', True)),
+    'uber_click': lambda data: asyncio.to_thread(
+        uber_click_element,
+        selector=data.get('selector'),
+        text_contains=data.get('text_contains'),
+        element_type=data.get('element_type', 'button')
+    ),
+    'uber_type': lambda data: asyncio.to_thread(
+        uber_type_text,
+        text=data.get('text', ''),
+        selector=data.get('selector'),
+        clear_first=data.get('clear_first', True)
+    ),
+    'uber_set_location': lambda data: asyncio.to_thread(
+        uber_set_location,
+        location_type=data.get('location_type', 'destination'),
+        lat=data.get('lat'),
+        lon=data.get('lon'),
+        address=data.get('address', '')
+    ),
+    'uber_select_autocomplete': lambda data: asyncio.to_thread(uber_select_autocomplete, index=data.get('index', 0), timeout_ms=data.get('timeout_ms', 3000)),
+    'uber_select_ride': lambda data: asyncio.to_thread(uber_select_ride_type, ride_type=data.get('ride_type', 'UberX')),
+    'uber_confirm': lambda data: asyncio.to_thread(uber_confirm_ride),
+    'uber_keyboard': lambda data: asyncio.to_thread(uber_keyboard_action, action=data.get('key', 'enter')),
+    'uber_chain': lambda data: asyncio.to_thread(uber_chain, steps=data.get('steps', [])),
+    'order_uber_eats': lambda data: asyncio.to_thread(
+        order_uber_eats,
+        pickup_lat=data.get('pickup_lat'),
+        pickup_lon=data.get('pickup_lon'),
+        pickup_address=data.get('pickup_address', ''),
+        cuisine_type=data.get('cuisine_type', ''),
+        surprise_me=data.get('surprise_me', False),
+        customization_answers=data.get('customization_answers', None)
+    ),
+    'uber_eats_checkout': lambda data: asyncio.to_thread(
+        set_quantity_and_checkout,
+        quantity=data.get('quantity', 1)
+    ),
+    'order_amazon': lambda data: asyncio.to_thread(
+        order_amazon,
+        item_description=data.get('item_description', ''),
+        check_previous_orders=data.get('check_previous_orders', True),
+        quantity=data.get('quantity', 1)
+    ),
+    'interrupt': _interrupt,
+    # Create an Apple Note using AppleScript
+    'create_note': lambda data: create_apple_note(data.get('title', 'Untitled'), data.get('body', '')),
+    # Currently playing track from Spotify web player
+    'get_spotify_track': lambda data: get_spotify_current_track(),
+    'clear_interrupt': _clear_interrupt,
+}
+
+async def handle_request(data):
+    """Dispatch a request to its handler in _ACTIONS"""
+    action = data.get('action')
+    handler = _ACTIONS.get(action) if isinstance(action, str) else None
+    if handler is None:
+        return {'success': False, 'error': 'Unknown action'}
+    return await handler(data)
+
+def _extract_blobs(obj, blobs):
+    """Replace bytes/FileBlob values with {'$blob': index} placeholders, collecting the blobs."""
+    if isinstance(obj, (bytes, bytearray, memoryview, FileBlob)):
+        blobs.append(obj)
+        return {'$blob': len(blobs) - 1}
+    if isinstance(obj, dict):
+        return {k: _extract_blobs(v, blobs) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_extract_blobs(v, blobs) for v in obj]
+    return obj
+
+def encode_response(resp):
+    """Frame a response as: 4-byte big-endian header length, JSON header, raw blobs.
+    Returns the pieces as a list so large blobs are written without concatenation."""
+    blobs = []
+    header = _extract_blobs(resp, blobs)
+    header['$blobs'] = [len(b) for b in blobs]
+    header_bytes = _json_dumps(header)
+    return [struct.pack('>I', len(header_bytes)), header_bytes, *blobs]
+
+async def _read_unframed_request(reader, data):
+    """Read a bare JSON request from an older bot, which sends no length prefix and
+    keeps the socket open for the reply. Only a buffer ending in '}' can hold a
+    complete object, so the parse is attempted once per candidate end rather than
+    after every chunk."""
+    buf = bytearray(data)
+    while len(buf) <= MAX_REQUEST_SIZE:
+        if buf.rstrip().endswith(b'}'):
             try:
-                client.close()
-            except:
+                return _json_loads(bytes(buf))
+            except ValueError:
                 pass
-except KeyboardInterrupt:
-    print('\nShutting down...')
-finally:
-    server.close()
+        chunk = await reader.read(65536)
+        if not chunk:
+            return _json_loads(bytes(buf))
+        buf += chunk
+    raise ValueError(f'Request too large: over {MAX_REQUEST_SIZE} bytes')
+
+async def read_request(reader):
+    """Read one request: 4-byte big-endian payload length, then the JSON payload.
+    Returns (request, framed), where framed is False for an older bot's bare JSON,
+    or (None, True) if the client disconnects before sending anything."""
+    try:
+        header = await reader.readexactly(4)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.startswith(b'{'):
+            return None, True
+        header = e.partial
+    # A framed length never starts with '{' (0x7B... is far past MAX_REQUEST_SIZE)
+    if header.startswith(b'{'):
+        return await _read_unframed_request(reader, header), False
+    (length,) = struct.unpack('>I', header)
+    if length > MAX_REQUEST_SIZE:
+        raise ValueError(f'Request too large: {length} bytes')
+    return _json_loads(await reader.readexactly(length)), True
+
+def _inline_blobs(obj):
+    """Base64-encode bytes/FileBlob values, as older bots expect them in plain JSON"""
+    if isinstance(obj, FileBlob):
+        return _b64.b64encode(obj.read()).decode('ascii')
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return _b64.b64encode(obj).decode('ascii')
+    if isinstance(obj, dict):
+        return {k: _inline_blobs(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_inline_blobs(v) for v in obj]
+    return obj
+
+async def write_response(writer, resp):
+    """Write a framed response. FileBlobs go out via loop.sendfile (os.sendfile when the
+    transport allows it), so on-disk images are copied kernel-side."""
+    for piece in encode_response(resp):
+        if isinstance(piece, FileBlob):
+            await writer.drain()
+            with open(piece.path, 'rb') as f:
+                await asyncio.get_running_loop().sendfile(writer.transport, f, 0, piece.size)
+        else:
+            writer.write(piece)
+    await writer.drain()
+
+def _tune_socket(sock):
+    """Latency settings for a client connection: no Nagle delay on small replies, a
+    1 MB send buffer for image payloads, and keepalive to reap dead peers."""
+    try:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 20)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    except OSError as e:
+        log(f'Socket tuning failed: {e}')
+
+async def handle_client(reader, writer):
+    addr = writer.get_extra_info('peername')
+    log(f'Connection from {addr}')
+    sock = writer.get_extra_info('socket')
+    if sock is not None:
+        _tune_socket(sock)
+    try:
+        req, framed = await asyncio.wait_for(read_request(reader), 30)
+        if req is not None:
+            secret = req.get('secret')
+            if isinstance(secret, str) and hmac.compare_digest(secret.encode('utf-8'), SECRET.encode('utf-8')):
+                log(f"Action: {req.get('action')}")
+                resp = await handle_request(req)
+            else:
+                resp = {'success': False, 'error': 'Invalid secret'}
+            if framed:
+                await write_response(writer, resp)
+            else:
+                writer.write(_json_dumps(_inline_blobs(resp)))
+                await writer.drain()
+        log('Done\n')
+    except Exception as e:
+        log(f'Error: {e}')
+    finally:
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except:
+            pass
+
+async def main():
+    server = await asyncio.start_server(handle_client, '0.0.0.0', PORT, reuse_address=True)
+    print('=' * 50)
+    print('Mac Agent v7 - Auto Chrome Debug Mode')
+    print('=' * 50)
+    print(f'Port: {PORT}')
+    print(f'Screenshots: {SCREENSHOT_DIR}')
+    print('')
+
+    # Auto-start Chrome in debug mode
+    await asyncio.to_thread(ensure_chrome_debug_mode)
+    print('')
+
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            await _close_image_session()
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print('\nShutting down...')
@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-import os, logging, json, socket, base64, io, asyncio
+import os, logging, json, socket, struct, base64, io, asyncio
 from telegram import Update, KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
 import anthropic
@@ -13,6 +13,18 @@ try:
 except ImportError:
     pass  # dotenv not installed, rely on environment variables
 
+# Optional: SIMD base64 for image payloads (pip install pybase64). Same API as the stdlib module.
+try:
+    import pybase64 as b64
+except ImportError:
+    b64 = base64
+
+# Optional: faster JSON for the agent protocol (pip install orjson)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -99,6 +111,43 @@ MAC_TOOLS = [
      }, "required": ["item_description"]}}
 ]
 
+def _json_loads(data):
+    """Parse UTF-8 JSON bytes, using orjson when installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(bytes(data).decode("utf-8"))
+
+def _json_dumps(obj):
+    """Serialize to UTF-8 JSON bytes, using orjson when installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
+
+def _restore_blobs(obj, blobs):
+    """Swap {'$blob': index} placeholders back for the raw bytes they stand for"""
+    if isinstance(obj, dict):
+        if len(obj) == 1 and "$blob" in obj:
+            return blobs[obj["$blob"]]
+        return {k: _restore_blobs(v, blobs) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_restore_blobs(v, blobs) for v in obj]
+    return obj
+
+def decode_mac_response(raw):
+    """Unpack a framed agent response: 4-byte header length, JSON header, raw blobs"""
+    if raw[:1] == b"{":
+        # Older agents reply with plain JSON
+        return _json_loads(raw)
+    (header_len,) = struct.unpack(">I", raw[:4])
+    view = memoryview(raw)
+    header = _json_loads(view[4:4 + header_len])
+    offset = 4 + header_len
+    blobs = []
+    for size in header.pop("$blobs", []):
+        blobs.append(bytes(view[offset:offset + size]))
+        offset += size
+    return _restore_blobs(header, blobs)
+
 def call_mac_sync(action, timeout=30.0, **kwargs):
     """Synchronous call to Mac agent - blocks until complete"""
     if not MAC_IP or not MAC_PORT or not MAC_SECRET:
@@ -106,9 +155,11 @@ def call_mac_sync(action, timeout=30.0, **kwargs):
     try:
         request = {"secret": MAC_SECRET, "action": action, **kwargs}
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         sock.settimeout(timeout)
         sock.connect((MAC_IP, MAC_PORT))
-        sock.sendall(json.dumps(request).encode("utf-8"))
+        payload = _json_dumps(request)
+        sock.sendall(struct.pack(">I", len(payload)) + payload)
         response_chunks = []
         while True:
             chunk = sock.recv(4096)
@@ -116,7 +167,7 @@ def call_mac_sync(action, timeout=30.0, **kwargs):
                 break
             response_chunks.append(chunk)
         sock.close()
-        return json.loads(b"".join(response_chunks).decode("utf-8"))
+        return decode_mac_response(b"".join(response_chunks))
     except socket.timeout:
         return {"success": False, "error": "Connection timed out"}
     except ConnectionRefusedError:
@@ -444,12 +495,16 @@ Be helpful, conversational, and proactive. If you can help with something even w
                         tool_results.append({"type": "tool_result", "tool_use_id": block.id, "content": json.dumps(result)})
                     elif tool_name == "take_screenshot":
                         mode = tool_input.get("mode", "full")
-                        result = call_mac("screenshot", mode=mode, app_name=tool_input.get("app_name"), region=tool_input.get("region"))
-                        if result.get("success") and result.get("filepath"):
-                            image_result = call_mac("read_image", filepath=result["filepath"])
+                        result = call_mac("screenshot", mode=mode, app_name=tool_input.get("app_name"), region=tool_input.get("region"), inline=True)
+                        if result.get("success") and (result.get("image_data") or result.get("filepath")):
+                            # inline captures come back in one round trip; older agents only return a filepath
+                            image_result = result if result.get("image_data") else call_mac("read_image", filepath=result["filepath"])
                             if image_result.get("success") and image_result.get("image_data"):
-                                screenshots_to_send.append({"data": image_result["image_data"], "mode": "screenshot"})
-                                tool_results.append({"type": "tool_result", "tool_use_id": block.id, "content": [{"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": image_result["image_data"]}}, {"type": "text", "text": f"Screenshot captured ({mode})"}]})
+                                image_data = image_result["image_data"]
+                                screenshots_to_send.append({"data": image_data, "mode": "screenshot"})
+                                # Framed replies carry raw bytes; older agents send base64 text already
+                                image_b64 = b64.b64encode(image_data).decode("utf-8") if isinstance(image_data, bytes) else image_data
+                                tool_results.append({"type": "tool_result", "tool_use_id": block.id, "content": [{"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": image_b64}}, {"type": "text", "text": f"Screenshot captured ({mode})"}]})
                             else:
                                 tool_results.append({"type": "tool_result", "tool_use_id": block.id, "content": json.dumps({"success": False, "error": "Failed to read"})})
                         else:
@@ -721,7 +776,9 @@ Be helpful, conversational, and proactive. If you can help with something even w
                         tool_results.append({"type": "tool_result", "tool_use_id": block.id, "content": json.dumps(result)})
             for screenshot in screenshots_to_send:
                 try:
-                    screenshot_bytes = base64.b64decode(screenshot["data"])
+                    # Agent sends raw bytes for framed images, base64 text otherwise
+                    data = screenshot["data"]
+                    screenshot_bytes = data if isinstance(data, bytes) else b64.b64decode(data)
                     if screenshot.get("mode") == "download":
                         caption = screenshot.get("url", "") if screenshot.get("url") else None
                     else:
@@ -762,7 +819,7 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
         photo_path = f"/tmp/photo_{user_id}.jpg"
         await photo_file.download_to_drive(photo_path)
         with open(photo_path, "rb") as f:
-            image_data = base64.standard_b64encode(f.read()).decode("utf-8")
+            image_data = b64.standard_b64encode(f.read()).decode("utf-8")
         if user_id not in user_conversations:
             user_conversations[user_id] = []
         caption = update.message.caption or "Analyze this"